@@ -0,0 +1,147 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    AnalyticsWatermark, DailyClassStat, DailyOverdueSnapshot, DailyRevenueStat, DailyTitleStat, Loan, Transaction,
+)
+
+
+class AnalyticsService:
+    """
+    Daily rollups behind the librarian dashboard. `refresh` folds in only
+    the loans and transactions newer than each source's watermark (minus a
+    short settle lag so rows from transactions still in flight are not
+    skipped), so its cost tracks recent activity, not years of history.
+    Dashboard reads touch at most `days` rollup rows per key.
+    """
+    SETTLE_LAG = timedelta(minutes=5)
+
+    @classmethod
+    def refresh(cls, now=None):
+        now = now or timezone.now()
+        upper = now - cls.SETTLE_LAG
+        stats = {
+            'loans': cls.fold('loans', Loan.objects, 'issued_at', upper, cls.fold_loans),
+            'transactions': cls.fold('transactions', Transaction.objects, 'timestamp', upper, cls.fold_transactions),
+        }
+        cls.snapshot_overdue(now)
+        return stats
+
+    @staticmethod
+    def fold(source, manager, field, upper, apply):
+        with transaction.atomic():
+            mark = AnalyticsWatermark.objects.select_for_update().filter(source=source).first()
+            rows = manager.filter(**{f'{field}__lte': upper})
+            if mark:
+                if mark.value >= upper: return 0
+                rows = rows.filter(**{f'{field}__gt': mark.value})
+            folded = apply(rows.annotate(day=TruncDate(field, tzinfo=timezone.get_current_timezone())))
+            AnalyticsWatermark.objects.update_or_create(source=source, defaults={'value': upper})
+        return folded
+
+    @staticmethod
+    def merge(model, keys, rows, counters):
+        """Adds `rows` ({key tuple: {counter: delta}}) onto existing rollup rows."""
+        if not rows: return
+        existing = model.objects.filter(date__in={k[0] for k in rows})
+        current = {tuple(getattr(obj, f) for f in keys): obj for obj in existing}
+        created, updated = [], []
+        for key, deltas in rows.items():
+            obj = current.get(key)
+            if obj is None:
+                created.append(model(**dict(zip(keys, key)), **deltas))
+                continue
+            for counter in counters: setattr(obj, counter, getattr(obj, counter) + deltas[counter])
+            updated.append(obj)
+        model.objects.bulk_create(created)
+        model.objects.bulk_update(updated, counters)
+
+    @classmethod
+    def fold_loans(cls, loans):
+        by_title = {
+            (r['day'], r['book_id']): {'loans': r['n']}
+            for r in loans.values('day', 'book_id').annotate(n=Count('id'))
+        }
+        by_class = {}
+        for r in loans.values('day', 'patron__class_name').annotate(n=Count('id')):
+            key = (r['day'], r['patron__class_name'] or '')
+            by_class[key] = {'loans': by_class.get(key, {'loans': 0})['loans'] + r['n']}
+        cls.merge(DailyTitleStat, ('date', 'book_id'), by_title, ['loans'])
+        cls.merge(DailyClassStat, ('date', 'class_name'), by_class, ['loans'])
+        return sum(d['loans'] for d in by_title.values())
+
+    @classmethod
+    def fold_transactions(cls, transactions):
+        by_type = {
+            (r['day'], r['type']): {'count': r['n'], 'total': r['total']}
+            for r in transactions.values('day', 'type').annotate(n=Count('id'), total=Sum('amount'))
+        }
+        cls.merge(DailyRevenueStat, ('date', 'type'), by_type, ['count', 'total'])
+        return sum(d['count'] for d in by_type.values())
+
+    @staticmethod
+    def snapshot_overdue(now):
+        overdue = Loan.objects.filter(returned_at__isnull=True, due_date__lt=now).aggregate(
+            loans=Count('id'), patrons=Count('patron_id', distinct=True)
+        )
+        DailyOverdueSnapshot.objects.update_or_create(
+            date=timezone.localdate(now),
+            defaults={'overdue_loans': overdue['loans'], 'overdue_patrons': overdue['patrons'], 'taken_at': now},
+        )
+
+    # ------------------------------------------------------------------
+    # Dashboard reads
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def window_start(days):
+        return timezone.localdate() - timedelta(days=days - 1)
+
+    @classmethod
+    def top_titles(cls, days=30, limit=10):
+        """Loans summed over every copy of each Title, so a class set ranks as one title (copies with no ISBN have no Title)."""
+        return list(
+            DailyTitleStat.objects.filter(date__gte=cls.window_start(days), book__record__isnull=False)
+            .values(title_id=F('book__record_id'), isbn=F('book__record__isbn'), title=F('book__record__title'))
+            .annotate(author=Min('book__author'), copies=Count('book_id', distinct=True), loans=Sum('loans'))
+            .order_by('-loans', 'title_id')[:limit]
+        )
+
+    @classmethod
+    def loans_by_class(cls, days=30):
+        return list(
+            DailyClassStat.objects.filter(date__gte=cls.window_start(days))
+            .values('class_name').annotate(loans=Sum('loans')).order_by('-loans')
+        )
+
+    @classmethod
+    def revenue_by_type(cls, days=30):
+        return list(
+            DailyRevenueStat.objects.filter(date__gte=cls.window_start(days))
+            .values('type').annotate(count=Sum('count'), total=Sum('total')).order_by('type')
+        )
+
+    @classmethod
+    def daily_loans(cls, days=30):
+        return list(
+            DailyClassStat.objects.filter(date__gte=cls.window_start(days))
+            .values('date').annotate(loans=Sum('loans')).order_by('date')
+        )
+
+    @staticmethod
+    def overdue():
+        snapshot = DailyOverdueSnapshot.objects.order_by('-date').first()
+        if not snapshot: return {'overdue_loans': 0, 'overdue_patrons': 0, 'taken_at': None}
+        return {
+            'overdue_loans': snapshot.overdue_loans, 'overdue_patrons': snapshot.overdue_patrons,
+            'taken_at': snapshot.taken_at,
+        }
+
+    @staticmethod
+    def last_refreshed():
+        mark = AnalyticsWatermark.objects.order_by('-refreshed_at').first()
+        return mark.refreshed_at if mark else None
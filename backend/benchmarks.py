@@ -0,0 +1,524 @@
+"""
+Benchmark data and scenarios for the API, driven by the seed_benchmark_data,
+run_benchmarks and load_test management commands.
+"""
+import json
+import random
+import statistics
+import threading
+import time
+from array import array
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .labels import SPINE_COLUMNS, spine_job
+from .models import Book, Hold, LibraryClass, Loan, Patron, Title, Transaction
+from .profiling import QUERY_BUDGETS, query_budget
+from .push import Broker, MemoryBackend
+from .services import CirculationService, TitleService
+from .wayfinding import ShelfIndex
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+PREFIX = 'BENCH' # barcode / student_id prefix marking generated rows
+WORDS = (
+    'history garden river science ocean mountain secret journey winter island shadow empire machine '
+    'dragon forest kingdom music stars city letters war peace light glass stone silver night summer'
+).split()
+
+
+def percentile(samples, pct):
+    if not samples: return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(samples, elapsed=None):
+    """Latency summary in milliseconds; throughput over `elapsed` wall seconds (defaults to the sample sum)."""
+    total = elapsed if elapsed is not None else sum(samples)
+    return {
+        'n': len(samples),
+        'min_ms': min(samples) * 1000 if samples else 0.0,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'mean_ms': statistics.fmean(samples) * 1000 if samples else 0.0,
+        'ops_per_sec': len(samples) / total if total else 0.0,
+    }
+
+
+# ------------------------------------------------------------------
+# Data generator
+# ------------------------------------------------------------------
+
+class BenchmarkSeeder:
+    """
+    Seeds a consistent library at a given scale with bulk_create: `scale`
+    books each with one loan (the first 5% still out, a quarter of those
+    overdue, every tenth with one hold), scale/10 patrons and one paid fine
+    per patron in the ledger. One book in twenty is a copy in a 30-copy
+    class set sharing its ISBN. Rows are marked with PREFIX so `flush` can
+    remove them again.
+    """
+    def __init__(self, scale, batch_size=5000, seed=42, progress=None):
+        self.scale = scale
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.progress = progress or (lambda message: None)
+
+    def run(self):
+        started = time.monotonic()
+        books = self.scale
+        patrons = max(books // 10, 100)
+        open_loans = books // 20
+        patron_ids = self.seed_patrons(patrons)
+        book_ids = self.seed_books(books, open_loans)
+        self.seed_loans(book_ids, patron_ids, open_loans)
+        self.seed_holds(book_ids, patron_ids, open_loans)
+        self.seed_transactions(patron_ids)
+        TitleService.fold()
+        return {'books': books, 'patrons': patrons, 'open_loans': open_loans, 'elapsed': time.monotonic() - started}
+
+    def insert(self, model, rows, label):
+        """bulk_create in batches from a generator, one transaction per batch; returns the new ids."""
+        ids, batch, written = array('q'), [], 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                written = self.flush_batch(model, batch, ids, written, label)
+                batch = []
+        if batch: self.flush_batch(model, batch, ids, written, label)
+        return ids
+
+    def flush_batch(self, model, batch, ids, written, label):
+        with transaction.atomic():
+            created = model.objects.bulk_create(batch)
+        ids.extend(obj.pk for obj in created if obj.pk is not None)
+        written += len(batch)
+        self.progress(f'  {label}: {written}')
+        return written
+
+    def seed_patrons(self, count):
+        groups = ['STUDENT'] * 8 + ['TEACHER']
+        return self.insert(Patron, (
+            Patron(
+                student_id=f'{PREFIX}{n:07d}', full_name=f'{self.title(2)} {n}', patron_group=self.random.choice(groups),
+                class_name=f'{7 + n % 6}-{"ABCD"[n % 4]}', total_paid=Decimal('1.50'),
+            )
+            for n in range(count)
+        ), 'patrons')
+
+    def seed_books(self, count, open_loans):
+        today = timezone.localdate()
+        return self.insert(Book, (
+            Book(
+                isbn=f'8{n - n % 30 if n % 600 < 30 else n:012d}', title=self.title(3), author=f'{self.title(1)} {self.title(1)}',
+                ddc_code=f'{self.random.randrange(1000):03d}.{self.random.randrange(100)}',
+                barcode_id=f'{PREFIX}-{n:08d}', shelf_location=f'Shelf {"ABCD"[n % 4]}',
+                acquisition_date=today - timedelta(days=n % 3650),
+                status='LOANED' if n < open_loans else 'AVAILABLE',
+                queue_length=1 if n < open_loans and n % 10 == 0 else 0, loan_count=1,
+                subjects=[self.random.choice(WORDS)],
+            )
+            for n in range(count)
+        ), 'books')
+
+    def seed_loans(self, book_ids, patron_ids, open_loans):
+        now = timezone.now()
+
+        def rows():
+            for n, book_id in enumerate(book_ids):
+                issued = now - timedelta(days=20 + n % 700)
+                if n < open_loans:
+                    due = now - timedelta(days=1 + n % 30) if n % 4 == 0 else now + timedelta(days=1 + n % 14)
+                    yield Loan(book_id=book_id, patron_id=patron_ids[n % len(patron_ids)], due_date=due)
+                else:
+                    yield Loan(
+                        book_id=book_id, patron_id=patron_ids[n % len(patron_ids)],
+                        due_date=issued + timedelta(days=14), returned_at=issued + timedelta(days=7),
+                    )
+        self.insert(Loan, rows(), 'loans')
+        # issued_at is auto_now_add; backdate it to match each due date
+        Loan.objects.filter(book__barcode_id__startswith=PREFIX).update(issued_at=F('due_date') - timedelta(days=14))
+
+    def seed_holds(self, book_ids, patron_ids, open_loans):
+        self.insert(Hold, (
+            Hold(book_id=book_ids[n], patron_id=patron_ids[(n + 1) % len(patron_ids)])
+            for n in range(0, open_loans, 10)
+        ), 'holds')
+
+    def seed_transactions(self, patron_ids):
+        now = timezone.now()
+
+        def rows():
+            for n, patron_id in enumerate(patron_ids):
+                at = now - timedelta(days=1 + n % 365)
+                for kind, offset in (('FINE_ASSESSMENT', 0), ('FINE_PAYMENT', 1)):
+                    yield Transaction(
+                        patron_id=patron_id, amount=Decimal('1.50'), type=kind, method='SYSTEM' if offset == 0 else 'CASH',
+                        librarian_id='bench', timestamp=at + timedelta(hours=offset),
+                    )
+        self.insert(Transaction, rows(), 'transactions')
+
+    def title(self, words):
+        return ' '.join(self.random.choice(WORDS) for _ in range(words)).title()
+
+    @staticmethod
+    def flush():
+        """Removes generated rows, children first so each delete is one statement."""
+        patrons = Patron.objects.filter(student_id__startswith=PREFIX)
+        books = Book.objects.filter(barcode_id__startswith=PREFIX)
+        titles = list(books.values_list('record_id', flat=True).distinct())
+        Transaction.objects.filter(patron__in=patrons).delete()
+        Hold.objects.filter(book__in=books).delete()
+        Loan.objects.filter(book__in=books).delete()
+        Loan.objects.filter(patron__in=patrons).delete()
+        Hold.objects.filter(patron__in=patrons).delete()
+        deleted = books.delete()[0] + patrons.delete()[0]
+        Title.objects.filter(id__in=titles, copies__isnull=True).delete()
+        return deleted
+
+
+# ------------------------------------------------------------------
+# Stub Open Library
+# ------------------------------------------------------------------
+
+class StubOpenLibrary:
+    """Local /api/books responder so waterfall lookups are timed without the internet."""
+    def __enter__(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                keys = parse_qs(urlparse(self.path).query).get('bibkeys', [''])[0].split(',')
+                body = json.dumps({
+                    key: {'title': f'Stub {key}', 'authors': [{'name': 'Stub Author'}],
+                          'identifiers': {'dewey_decimal': ['500.1']}}
+                    for key in keys if key
+                }).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.settings = override_settings(OPEN_LIBRARY_URL=f'http://127.0.0.1:{self.server.server_port}')
+        self.settings.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.settings.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ------------------------------------------------------------------
+# Scenarios: each takes the context and returns a step(timer) callable;
+# only the code inside `with timer:` is measured.
+# ------------------------------------------------------------------
+
+class Timer:
+    elapsed = 0.0
+    size = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
+
+
+class BenchmarkContext:
+    def __init__(self):
+        user, _ = User.objects.get_or_create(username='bench', defaults={'is_staff': True})
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.counter = 0
+
+    def next(self):
+        self.counter += 1
+        return self.counter
+
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def get(ctx, timer, url):
+    with timer:
+        response = ctx.client.get(url)
+    timer.size = len(response.content) if not response.streaming else None
+    assert response.status_code == 200, (url, response.status_code)
+
+
+@scenario('catalog_list')
+def catalog_list(ctx):
+    return lambda timer: get(ctx, timer, '/api/catalog/')
+
+
+@scenario('catalog_list_deep_page')
+def catalog_list_deep_page(ctx):
+    pages = max(Title.objects.filter(copy_count__gt=0).count() // 50, 1) # One row per title
+    return lambda timer: get(ctx, timer, f'/api/catalog/?page={pages}')
+
+
+@scenario('catalog_list_keyset')
+def catalog_list_keyset(ctx):
+    return lambda timer: get(ctx, timer, '/api/catalog/?cursor=&ordering=-loan_count')
+
+
+@scenario('catalog_list_full_payload')
+def catalog_list_full_payload(ctx):
+    return lambda timer: get(ctx, timer, '/api/catalog/?expand=marc_metadata,summary,subjects')
+
+
+@scenario('catalog_search')
+def catalog_search(ctx):
+    terms = ['history', 'secret garden', 'dragon', 'silver river night']
+    return lambda timer: get(ctx, timer, f'/api/catalog/?search={terms[ctx.next() % len(terms)]}')
+
+
+@scenario('waterfall_search_miss')
+def waterfall_search_miss(ctx):
+    """Unknown ISBN each time: local miss, metadata-cache miss, stub Open Library fetch."""
+    return lambda timer: get(ctx, timer, f'/api/catalog/waterfall_search/?isbn=97{time.time_ns() % 10**11:011d}')
+
+
+@scenario('waterfall_search_cached')
+def waterfall_search_cached(ctx):
+    return lambda timer: get(ctx, timer, '/api/catalog/waterfall_search/?isbn=9700000000001')
+
+
+def borrower(ctx):
+    """A generated patron with nothing out, so every batch fits under max_items."""
+    patron = (
+        Patron.objects.filter(student_id__startswith=PREFIX, is_blocked=False)
+        .exclude(loans__returned_at__isnull=True).order_by('-id').first()
+    )
+    if not patron: raise RuntimeError('No benchmark data: run seed_benchmark_data first')
+    return patron
+
+
+def shelf_barcodes(count):
+    return list(
+        Book.objects.filter(barcode_id__startswith=PREFIX, status='AVAILABLE', queue_length=0)
+        .order_by('-id').values_list('barcode_id', flat=True)[:count]
+    )
+
+
+@scenario('checkout_batch')
+def checkout_batch(ctx, batch=5):
+    patron = borrower(ctx)
+    barcodes = shelf_barcodes(batch * 20)
+
+    def step(timer):
+        chunk = [barcodes[(ctx.next() * batch + i) % len(barcodes)] for i in range(batch)]
+        with timer:
+            response = ctx.client.post(
+                '/api/circulation/checkout/', {'patron_id': patron.student_id, 'books': chunk}, format='json',
+            )
+        assert response.json().get('processed') == batch, response.content
+        CirculationService.return_batch(chunk)
+    return step
+
+
+@scenario('return_book')
+def return_book(ctx):
+    patron = borrower(ctx)
+    barcodes = shelf_barcodes(50)
+
+    def step(timer):
+        barcode = barcodes[ctx.next() % len(barcodes)]
+        CirculationService.checkout_batch(patron, [barcode])
+        with timer:
+            response = ctx.client.post('/api/circulation/return_book/', {'barcode': barcode}, format='json')
+        assert response.status_code == 200, response.content
+    return step
+
+
+@scenario('patron_account')
+def patron_account(ctx):
+    patron = Patron.objects.filter(student_id__startswith=PREFIX, loans__returned_at__isnull=True).order_by('id').first()
+    if not patron: raise RuntimeError('No benchmark data: run seed_benchmark_data first')
+
+    def step(timer):
+        with query_budget(QUERY_BUDGETS['GET patrons-account']):
+            get(ctx, timer, f'/api/patrons/{patron.id}/account/')
+    return step
+
+
+@scenario('class_accounts')
+def class_accounts(ctx):
+    """The largest generated class; must stay within the same query budget as a one-patron class."""
+    name = (
+        Patron.objects.filter(student_id__startswith=PREFIX).values('class_name')
+        .annotate(n=Count('id')).order_by('-n').values_list('class_name', flat=True).first()
+    )
+    if not name: raise RuntimeError('No benchmark data: run seed_benchmark_data first')
+    library_class, _ = LibraryClass.objects.get_or_create(name=name)
+
+    def step(timer):
+        with query_budget(QUERY_BUDGETS['GET classes-accounts']):
+            get(ctx, timer, f'/api/classes/{library_class.id}/accounts/')
+    return step
+
+
+@scenario('zpl_labels_10k')
+def zpl_labels_10k(ctx):
+    def step(timer):
+        with timer:
+            payload = ''.join(spine_job(Book.objects.only(*SPINE_COLUMNS).order_by('id')[:10000]))
+        timer.size = len(payload)
+    return step
+
+
+def large_map(shelves=5000, levels=10):
+    width = 1000 / shelves
+    return {
+        'levels': [{'id': f'L{n}', 'name': f'Level {n}'} for n in range(levels)],
+        'shelves': [
+            {'id': f's{n}', 'label': f'Shelf {n}', 'minDDC': round(n * width, 3),
+             'maxDDC': round((n + 1) * width - 0.001, 3), 'levelId': f'L{n % levels}'}
+            for n in range(shelves)
+        ],
+    }
+
+
+@scenario('shelf_index_compile')
+def shelf_index_compile(ctx):
+    map_data = large_map()
+
+    def step(timer):
+        with timer:
+            ShelfIndex(map_data)
+    return step
+
+
+@scenario('shelf_locate_10k')
+def shelf_locate_10k(ctx):
+    index = ShelfIndex(large_map())
+    rng = random.Random(7)
+    codes = [f'{rng.uniform(0, 999):.3f}' for _ in range(10000)]
+
+    def step(timer):
+        with timer:
+            for code in codes: index.locate(code)
+    return step
+
+
+@scenario('push_fanout_500')
+def push_fanout_500(ctx, subscribers=500, events=20):
+    """Time for `events` published messages to reach every one of `subscribers` waiting streams."""
+    def step(timer):
+        hub = Broker(MemoryBackend(), replay_size=events * 2)
+        start_id = hub.last_id()
+        ready = threading.Barrier(subscribers + 1)
+
+        def subscriber():
+            last, received = start_id, 0
+            ready.wait()
+            while received < events:
+                batch = hub.wait(last, 5)
+                if not batch: break
+                received += len(batch)
+                last = batch[-1][0]
+
+        threads = [threading.Thread(target=subscriber, daemon=True) for _ in range(subscribers)]
+        for thread in threads: thread.start()
+        ready.wait()
+        with timer:
+            for n in range(events): hub.publish('books', 'book.status', [{'id': n, 'status': 'AVAILABLE'}])
+            for thread in threads: thread.join()
+    return step
+
+
+def run_scenario(name, repeat=20, warmup=2):
+    ctx = BenchmarkContext()
+    with StubOpenLibrary():
+        step = SCENARIOS[name](ctx)
+        samples, size = [], None
+        for i in range(warmup + repeat):
+            timer = Timer()
+            step(timer)
+            if i >= warmup:
+                samples.append(timer.elapsed)
+                size = timer.size
+    return {'scenario': name, 'vendor': connection.vendor, 'books': Book.objects.count(), 'bytes': size, **summarize(samples)}
+
+
+# ------------------------------------------------------------------
+# Concurrent load driver against a running server
+# ------------------------------------------------------------------
+
+class LoadDriver:
+    """
+    Fires GET requests at `paths` (round-robin) from `concurrency` threads,
+    each with its own keep-alive session, for `duration` seconds or until
+    `requests` have been sent. Reports p50/p99 latency and throughput per
+    path and overall.
+    """
+    def __init__(self, base_url, paths, concurrency=8, duration=None, requests=1000, token=None, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.paths = paths
+        self.concurrency = concurrency
+        self.duration = duration
+        self.requests = requests
+        self.headers = {'Authorization': f'Token {token}'} if token else {}
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.results = {path: {'samples': [], 'errors': 0} for path in paths}
+
+    def claim(self, deadline):
+        with self.lock:
+            if deadline is not None and time.monotonic() >= deadline: return None
+            if deadline is None and self.sent >= self.requests: return None
+            path = self.paths[self.sent % len(self.paths)]
+            self.sent += 1
+            return path
+
+    def worker(self, deadline):
+        import requests
+        session = requests.Session()
+        session.headers.update(self.headers)
+        while True:
+            path = self.claim(deadline)
+            if path is None: break
+            started = time.perf_counter()
+            try:
+                ok = session.get(self.base_url + path, timeout=self.timeout).status_code < 400
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                if ok: self.results[path]['samples'].append(elapsed)
+                else: self.results[path]['errors'] += 1
+
+    def run(self):
+        deadline = time.monotonic() + self.duration if self.duration else None
+        started = time.monotonic()
+        threads = [threading.Thread(target=self.worker, args=(deadline,)) for _ in range(self.concurrency)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        wall = time.monotonic() - started
+        report = {path: {**summarize(r['samples'], wall), 'errors': r['errors']} for path, r in self.results.items()}
+        everything = [s for r in self.results.values() for s in r['samples']]
+        report['ALL'] = {**summarize(everything, wall), 'errors': sum(r['errors'] for r in self.results.values())}
+        return report
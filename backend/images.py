@@ -0,0 +1,69 @@
+import base64
+import io
+import uuid
+from urllib.parse import unquote
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+# Longest edge in pixels for each stored rendition.
+PATRON_SIZES = {'full': 512, 'thumb': 96}
+LOGO_SIZES = {'full': 512}
+
+# The only image types stored or served: no SVG or HTML that could carry script onto the API origin.
+RASTER_TYPES = {'image/png': 'PNG', 'image/jpeg': 'JPEG', 'image/webp': 'WEBP', 'image/gif': 'GIF'}
+
+
+def is_data_url(value):
+    return isinstance(value, str) and value.startswith('data:')
+
+
+def decode_data_url(value):
+    """Returns (content_type, bytes) for a data: URL (base64 or percent-encoded)."""
+    header, _, body = value.partition(',')
+    content_type = header[5:].split(';')[0] or 'application/octet-stream'
+    content = base64.b64decode(body) if ';base64' in header else unquote(body).encode()
+    return content_type, content
+
+
+def store_image(data_url, prefix, sizes):
+    """
+    Writes each rendition of a data-URL image to the default storage
+    (MediaStorage on S3/R2, the local media folder otherwise) and returns
+    {rendition: storage key}. Only RASTER_TYPES are accepted, and every
+    rendition is re-encoded as JPEG (PNG when it carries transparency).
+    Raises ValueError for anything else, SVG included.
+    """
+    content_type, content = decode_data_url(data_url)
+    if content_type not in RASTER_TYPES: raise ValueError(f'Unsupported image type {content_type}')
+    name = uuid.uuid4().hex
+    source = Image.open(io.BytesIO(content), formats=list(RASTER_TYPES.values()))
+    source.load()
+    keep_alpha = source.mode in ('RGBA', 'LA') or (source.mode == 'P' and 'transparency' in source.info)
+    keys = {}
+    for rendition, edge in sizes.items():
+        image = source.convert('RGBA' if keep_alpha else 'RGB')
+        image.thumbnail((edge, edge))
+        buffer = io.BytesIO()
+        if keep_alpha:
+            image.save(buffer, format='PNG', optimize=True)
+            ext = 'png'
+        else:
+            image.save(buffer, format='JPEG', quality=85, optimize=True)
+            ext = 'jpg'
+        keys[rendition] = default_storage.save(f"{prefix}/{name}-{rendition}.{ext}", ContentFile(buffer.getvalue()))
+    return keys
+
+
+def delete_images(*keys):
+    for key in set(filter(None, keys)):
+        default_storage.delete(key)
+
+
+def image_url(key, request=None):
+    if not key: return None
+    url = default_storage.url(key)
+    if request is not None and not url.startswith(('http://', 'https://')):
+        return request.build_absolute_uri(url)
+    return url
@@ -0,0 +1,256 @@
+import csv
+import re
+import xml.etree.ElementTree as ET
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from pymarc import MARCReader
+
+from .kiosk import invalidate_on_commit
+from .models import Book, ChangeLog, ImportJob, Title
+from .serializers import BookImportSerializer
+
+MARCXML_NS = '{http://www.loc.gov/MARC21/slim}'
+MAX_STORED_ERRORS = 1000
+
+
+# ------------------------------------------------------------------
+# Streaming readers: each yields (record_dict, resume_offset) where
+# resume_offset is the byte position just past the record.
+# ------------------------------------------------------------------
+
+def read_csv(fh, job):
+    """
+    CSV with a header row of Book field names. Lines are pulled from the
+    binary handle one at a time so the byte offset after each row is exact.
+    `subjects` may be a ';'-separated string.
+    """
+    header = next(csv.reader([fh.readline().decode('utf-8-sig')]))
+    if job.offset: fh.seek(job.offset)
+    position = [fh.tell()]
+
+    def lines():
+        for raw in iter(fh.readline, b''):
+            position[0] += len(raw)
+            yield raw.decode('utf-8', errors='replace')
+
+    for row in csv.reader(lines()):
+        if not any(cell.strip() for cell in row): continue
+        record = {k.strip(): v.strip() for k, v in zip(header, row) if k and v.strip()}
+        if 'subjects' in record:
+            record['subjects'] = [s.strip() for s in record['subjects'].split(';') if s.strip()]
+        yield record, position[0]
+
+
+def read_marc(fh, job):
+    """ISO 2709 binary MARC. MARCReader consumes exactly one record per step."""
+    if job.offset: fh.seek(job.offset)
+    reader = MARCReader(fh, to_unicode=True, force_utf8=True, utf8_handling='replace')
+    for record in reader:
+        if record is None:
+            yield {'_error': str(reader.current_exception)}, fh.tell()
+            continue
+        fields = {}
+        for field in record.get_fields():
+            if field.is_control_field(): continue
+            subfields = {}
+            for sub in field.subfields:
+                subfields.setdefault(sub.code, []).append(sub.value)
+            fields.setdefault(field.tag, []).append(subfields)
+        yield marc_to_book(fields), fh.tell()
+
+
+def read_marcxml(fh, job):
+    """
+    MARCXML via iterparse, clearing each <record> once mapped. The parser
+    reads ahead, so byte offsets are not exact here: resume skips the
+    `records_read` already checkpointed instead.
+    """
+    skip = job.records_read
+    context = ET.iterparse(fh, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event != 'end' or elem.tag not in (f'{MARCXML_NS}record', 'record'): continue
+        if skip:
+            skip -= 1
+        else:
+            fields = {}
+            for df in elem.iter(f'{MARCXML_NS}datafield'):
+                subfields = {}
+                for sf in df.iter(f'{MARCXML_NS}subfield'):
+                    subfields.setdefault(sf.get('code'), []).append(sf.text or '')
+                fields.setdefault(df.get('tag'), []).append(subfields)
+            yield marc_to_book(fields), 0
+        elem.clear()
+        root.clear()
+
+
+READERS = {'CSV': read_csv, 'MARC': read_marc, 'MARCXML': read_marcxml}
+
+
+def detect_format(filename):
+    name = filename.lower()
+    if name.endswith('.csv'): return 'CSV'
+    if name.endswith('.xml'): return 'MARCXML'
+    return 'MARC'
+
+
+def marc_to_book(fields):
+    """Maps MARC 21 tags ({tag: [{code: [values]}]}) onto Book fields."""
+    def first(tag, code):
+        for field in fields.get(tag, []):
+            for value in field.get(code, []):
+                if value.strip(): return value.strip()
+        return None
+
+    def clean(value):
+        return value.rstrip(' /:;,.=').strip() if value else value
+
+    isbn = first('020', 'a')
+    title = ' '.join(filter(None, [clean(first('245', 'a')), clean(first('245', 'b'))]))
+    year = re.search(r'\d{4}', first('264', 'c') or first('260', 'c') or '')
+    pages = re.search(r'\d+', first('300', 'a') or '')
+    record = {
+        'isbn': re.sub(r'[^0-9Xx]', '', isbn.split()[0]) if isbn else None,
+        'title': title or None,
+        'author': clean(first('100', 'a') or first('110', 'a') or first('700', 'a')),
+        'ddc_code': first('082', 'a') or '000.0',
+        'call_number': first('092', 'a') or first('090', 'a') or first('952', 'o'),
+        'barcode_id': first('952', 'p') or first('852', 'p'),
+        'edition': clean(first('250', 'a')),
+        'publisher': clean(first('264', 'b') or first('260', 'b')),
+        'pub_year': year.group(0) if year else None,
+        'pages': int(pages.group(0)) if pages else None,
+        'series': clean(first('490', 'a') or first('830', 'a')),
+        'summary': first('520', 'a'),
+        'subjects': [clean(f['a'][0]) for f in fields.get('650', []) if f.get('a')],
+    }
+    return {k: v for k, v in record.items() if v not in (None, '', [])}
+
+
+# ------------------------------------------------------------------
+# Import engine
+# ------------------------------------------------------------------
+
+class CatalogImporter:
+    """
+    Streams an ImportJob's file, validates records in chunks with
+    BookImportSerializer and upserts each chunk's copies on `barcode_id`
+    with bulk_create(update_conflicts=True), one statement per set of
+    columns the rows supply. The job's offset and counters are
+    saved in the same transaction as the chunk, so a crash resumes exactly
+    after the last committed chunk.
+    """
+    def __init__(self, job, chunk_size=500, progress=None):
+        self.job = job
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+    def run(self):
+        job = self.job
+        job.status = 'RUNNING'
+        job.save(update_fields=['status', 'updated_at'])
+        try:
+            with open(job.file_path, 'rb') as fh:
+                chunk, offset = [], job.offset
+                for record, offset in READERS[job.format](fh, job):
+                    chunk.append(record)
+                    if len(chunk) >= self.chunk_size:
+                        self.commit_chunk(chunk, offset)
+                        chunk = []
+                if chunk: self.commit_chunk(chunk, offset)
+            job.status = 'COMPLETED'
+            job.finished_at = timezone.now()
+        except Exception as e:
+            job.status = 'FAILED'
+            job.message = str(e)
+        job.save(update_fields=['status', 'message', 'finished_at', 'updated_at'])
+        return job
+
+    def commit_chunk(self, records, offset):
+        job = self.job
+        valid, errors = {}, []
+        for index, record in enumerate(records, start=job.records_read + 1):
+            if '_error' in record:
+                errors.append({'record': index, 'errors': record['_error']})
+                continue
+            serializer = BookImportSerializer(data=record)
+            if serializer.is_valid():
+                data = serializer.validated_data
+                valid[data.get('barcode_id') or ('isbn', data['isbn'])] = (index, data)
+            else:
+                errors.append({'record': index, 'isbn': record.get('isbn'), 'errors': serializer.errors})
+
+        with transaction.atomic():
+            imported = self.upsert(list(valid.values()), errors)
+            job.records_read += len(records)
+            job.imported += imported
+            job.failed += len(errors)
+            job.errors = (job.errors + errors)[:MAX_STORED_ERRORS]
+            if job.format != 'MARCXML': job.offset = offset
+            job.save(update_fields=['records_read', 'imported', 'failed', 'errors', 'offset', 'updated_at'])
+        if self.progress: self.progress(job)
+
+    def upsert(self, entries, errors):
+        """Writes (record number, row) entries; returns how many were imported."""
+        if not entries: return 0
+        try:
+            with transaction.atomic():
+                self.write([row for _, row in entries])
+            return len(entries)
+        except IntegrityError:
+            pass
+        # A conflicting barcode poisons the whole statement; isolate it per row.
+        imported = 0
+        for index, row in entries:
+            try:
+                with transaction.atomic():
+                    self.write([row])
+                imported += 1
+            except IntegrityError as e:
+                errors.append({'record': index, 'isbn': row['isbn'], 'errors': str(e)})
+        return imported
+
+    @staticmethod
+    def write(rows):
+        """
+        Rows with a barcode are copies, upserted on `barcode_id`. Rows without
+        one refresh every copy of their ISBN with bulk_update, or create its
+        first copy. Titles are created as needed and recounted afterwards.
+        """
+        titles = Title.ensure((row['isbn'], row.get('title')) for row in rows)
+        barcodes = [row['barcode_id'] for row in rows if row.get('barcode_id')]
+        bare = {row['isbn']: row for row in rows if not row.get('barcode_id')}
+        catalogued = set(Book.objects.filter(isbn__in=bare).values_list('isbn', flat=True))
+        # Titles a re-catalogued copy moves away from
+        left = set(Book.objects.filter(barcode_id__in=barcodes).values_list('record_id', flat=True))
+        # One upsert per set of supplied columns: a row only overwrites the fields it has
+        # (blank cells are dropped), never with the model defaults of another row's columns.
+        shapes = {}
+        for row in rows:
+            if row.get('barcode_id') or row['isbn'] not in catalogued: shapes.setdefault(frozenset(row), []).append(row)
+        for columns, group in shapes.items():
+            Book.objects.bulk_create(
+                [Book(**row, record_id=titles[row['isbn']]) for row in group],
+                update_conflicts=True, unique_fields=['barcode_id'], update_fields=sorted(columns - {'barcode_id'}) + ['record'],
+            )
+        refreshes = {}
+        for isbn in catalogued: refreshes.setdefault(frozenset(bare[isbn]), []).append(isbn)
+        for columns, isbns in refreshes.items():
+            copies = list(Book.objects.filter(isbn__in=isbns).only('id', 'isbn'))
+            for book in copies:
+                for field, value in bare[book.isbn].items(): setattr(book, field, value)
+                book.record_id = titles[book.isbn]
+            Book.objects.bulk_update(copies, sorted(columns) + ['record'])
+        ChangeLog.record(Book, Book.objects.filter(Q(barcode_id__in=barcodes) | Q(isbn__in=bare)).values_list('id', flat=True))
+        Title.recount(set(titles.values()) | left)
+        invalidate_on_commit('catalog')
+
+
+def run_import_job(job_id, chunk_size=500):
+    """Thread entry point for uploads handled by the API."""
+    try:
+        CatalogImporter(ImportJob.objects.get(pk=job_id), chunk_size=chunk_size).run()
+    finally:
+        connection.close()
@@ -0,0 +1,115 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, Value, When
+from django.utils import timezone
+
+from .kiosk import invalidate_on_commit
+from .models import Book, ChangeLog, InventoryScan, InventorySession, Title
+
+
+class InventoryError(Exception):
+    pass
+
+
+class InventoryService:
+    """
+    Stocktakes in batches. A scan batch costs one SELECT (to remember where
+    the catalog had each item), one multi-row INSERT of scans and one
+    `UPDATE ... WHERE barcode_id IN (...)`; closing the session computes
+    missing and misplaced items as anti-joins in SQL instead of per book.
+    """
+    @staticmethod
+    def scan_batch(session, shelf_location, barcodes):
+        """
+        Marks the scanned items inventoried today and on `shelf_location`.
+        Items scanned while LOST are found again. Barcodes already scanned
+        in this session keep their first scan. Returns per-batch counts.
+        """
+        if session.status != 'OPEN': raise InventoryError('Session is closed')
+        if not shelf_location: raise InventoryError('shelf_location required')
+        barcodes = list(dict.fromkeys(b.strip() for b in barcodes if isinstance(b, str) and b.strip()))
+        if not barcodes: return {'scanned': 0, 'unknown': 0, 'misplaced': 0}
+
+        with transaction.atomic():
+            catalog, found = {}, set()
+            for pk, barcode, shelf, status, record_id in Book.objects.filter(barcode_id__in=barcodes).values_list(
+                'id', 'barcode_id', 'shelf_location', 'status', 'record_id'
+            ):
+                catalog[barcode] = (pk, shelf)
+                if status == 'LOST': found.add(record_id)
+            now = timezone.now()
+            InventoryScan.objects.bulk_create([
+                InventoryScan(
+                    session=session, barcode_id=barcode, book_id=catalog.get(barcode, (None, None))[0],
+                    shelf_location=shelf_location, previous_shelf=catalog.get(barcode, (None, None))[1], scanned_at=now,
+                )
+                for barcode in barcodes
+            ], ignore_conflicts=True)
+            Book.objects.filter(barcode_id__in=list(catalog)).update(
+                last_inventoried=timezone.localdate(now), shelf_location=shelf_location,
+                status=Case(When(status='LOST', then=Value('AVAILABLE')), default=F('status')),
+            )
+            ChangeLog.record(Book, [pk for pk, _ in catalog.values()])
+            Title.recount(found)
+            invalidate_on_commit('catalog') # Shelf locations moved
+        return {
+            'scanned': len(barcodes),
+            'unknown': sum(1 for b in barcodes if b not in catalog),
+            'misplaced': sum(1 for pk, shelf in catalog.values() if shelf != shelf_location),
+        }
+
+    @staticmethod
+    def shelves(session):
+        if session.shelf_location: return [session.shelf_location]
+        return list(session.scans.values_list('shelf_location', flat=True).distinct())
+
+    @classmethod
+    def missing(cls, session):
+        """AVAILABLE items catalogued on the counted shelves with no scan in this session."""
+        scanned = InventoryScan.objects.filter(session=session, book_id=OuterRef('pk'))
+        return Book.objects.filter(shelf_location__in=cls.shelves(session), status='AVAILABLE').filter(~Exists(scanned))
+
+    @staticmethod
+    def misplaced(session):
+        """Scans found away from the shelf the catalog had them on."""
+        return session.scans.filter(book__isnull=False).filter(
+            Q(previous_shelf__isnull=True) | ~Q(previous_shelf=F('shelf_location'))
+        )
+
+    @classmethod
+    def close(cls, session, lost_after_days=None):
+        """
+        Closes the session and returns its discrepancy report. With
+        `lost_after_days`, missing items not inventoried for that long (or
+        never, and catalogued before the cutoff) are marked LOST.
+        """
+        with transaction.atomic():
+            session = InventorySession.objects.select_for_update().get(pk=session.pk)
+            if session.status != 'OPEN': raise InventoryError('Session is already closed')
+            columns = ['barcode_id', 'title', 'shelf_location', 'last_inventoried']
+            missing = list(cls.missing(session).order_by('shelf_location', 'ddc_code', 'id').values(*columns))
+            misplaced = list(
+                cls.misplaced(session).order_by('id').values('barcode_id', 'book__title', 'previous_shelf', 'shelf_location')
+            )
+            marked_lost = 0
+            if lost_after_days is not None:
+                cutoff = timezone.now() - timedelta(days=int(lost_after_days))
+                lost = list(cls.missing(session).filter(
+                    Q(last_inventoried__lt=timezone.localdate(cutoff)) |
+                    Q(last_inventoried__isnull=True, created_at__lt=cutoff)
+                ).values_list('id', 'record_id'))
+                marked_lost = Book.objects.filter(id__in=[pk for pk, _ in lost]).update(status='LOST')
+                ChangeLog.record(Book, [pk for pk, _ in lost])
+                Title.recount(record_id for _, record_id in lost)
+                invalidate_on_commit('catalog')
+
+            session.status = 'CLOSED'
+            session.closed_at = timezone.now()
+            session.scanned = session.scans.count()
+            session.unknown = session.scans.filter(book__isnull=True).count()
+            session.misplaced = len(misplaced)
+            session.missing = len(missing)
+            session.marked_lost = marked_lost
+            session.save(update_fields=['status', 'closed_at', 'scanned', 'unknown', 'misplaced', 'missing', 'marked_lost'])
+        return session, {'missing': missing, 'misplaced': misplaced}
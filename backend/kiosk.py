@@ -0,0 +1,207 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from rest_framework.throttling import BaseThrottle
+
+from .profiling import METRICS
+from .replicas import read_only_action
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------
+# Token buckets
+# ------------------------------------------------------------------
+
+class RedisBuckets:
+    """
+    Buckets shared by every worker: one Lua call refills and takes a token
+    atomically, timed by the Redis clock so workers need not agree.
+    """
+    SCRIPT = """
+    local capacity, rate = tonumber(ARGV[1]), tonumber(ARGV[2])
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+    local tokens = tonumber(state[1]) or capacity
+    local at = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(now - at, 0) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url):
+        import redis
+        self.take_script = redis.Redis.from_url(url).register_script(self.SCRIPT)
+
+    def take(self, key, capacity, rate):
+        """(allowed, tokens left)"""
+        allowed, tokens = self.take_script(keys=[key], args=[capacity, rate])
+        return bool(allowed), float(tokens)
+
+
+class CacheBuckets:
+    """Fallback on the default cache; atomic within a process only."""
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        with self.lock:
+            now = time.time()
+            tokens, at = cache.get(key) or (capacity, now)
+            tokens = min(capacity, tokens + max(now - at, 0) * rate)
+            allowed = tokens >= 1
+            if allowed: tokens -= 1
+            cache.set(key, (tokens, now), math.ceil(capacity / rate) + 1)
+        return allowed, tokens
+
+
+_buckets = None
+_buckets_lock = threading.Lock()
+_buckets_failing = False
+
+
+def buckets():
+    global _buckets
+    if _buckets is None:
+        with _buckets_lock:
+            if _buckets is None:
+                url = getattr(settings, 'THROTTLE_REDIS_URL', None)
+                _buckets = RedisBuckets(url) if url else CacheBuckets()
+    return _buckets
+
+
+class KioskThrottle(BaseThrottle):
+    """
+    Token-bucket throttle for anonymous public traffic. A request carrying
+    a configured `X-Kiosk-Key` draws from that kiosk's bucket (kiosks behind
+    one school NAT share an address); anything else draws from its client
+    address's. KIOSK_THROTTLE_RATES[scope] is (burst, tokens per second).
+    Signed-in staff are not throttled. If the bucket store fails (Redis
+    unreachable, or the redis package missing) the request is let through:
+    each failure is counted in library_throttle_errors_total, and the first
+    one of an outage is logged with its traceback.
+    """
+    scope = 'public'
+
+    def allow_request(self, request, view):
+        if request.user and request.user.is_authenticated: return True
+        kiosk = request.headers.get('X-Kiosk-Key')
+        kind = 'kiosk' if kiosk and kiosk in settings.KIOSK_KEYS else 'ip'
+        capacity, rate = settings.KIOSK_THROTTLE_RATES[f'{self.scope}-{kind}']
+        ident = hashlib.sha1((kiosk if kind == 'kiosk' else self.get_ident(request)).encode()).hexdigest()
+        global _buckets_failing
+        try:
+            allowed, tokens = buckets().take(f'throttle:{self.scope}:{kind}:{ident}', capacity, rate)
+        except Exception as e:
+            METRICS.increment('library_throttle_errors_total', scope=self.scope, error=type(e).__name__)
+            if not _buckets_failing: logger.exception('Kiosk throttle backend failed; letting public requests through')
+            _buckets_failing = True
+            return True
+        if _buckets_failing:
+            logger.warning('Kiosk throttle backend recovered')
+            _buckets_failing = False
+        self.wait_seconds = 0 if allowed else (1 - tokens) / rate
+        if not allowed: METRICS.increment('library_throttled_total', scope=self.scope, client=kind)
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class KioskLookupThrottle(KioskThrottle):
+    """Tighter bucket for lookups that can fan out to Open Library."""
+    scope = 'lookup'
+
+
+# ------------------------------------------------------------------
+# Anonymous response cache
+# ------------------------------------------------------------------
+
+def group_version_key(group):
+    return f'public_cache:{group}:version'
+
+
+def invalidate_public_cache(*groups):
+    """Starts a new cache generation for `groups`; old entries are never read again and expire."""
+    for group in groups:
+        try:
+            cache.incr(group_version_key(group))
+        except ValueError:
+            cache.set(group_version_key(group), 1, None)
+
+
+def invalidate_on_commit(*groups):
+    """For writers outside the public viewsets (imports, stocktakes, title folding, circulation, holds)."""
+    transaction.on_commit(lambda: invalidate_public_cache(*groups))
+
+
+def is_anonymous(request):
+    return 'Authorization' not in request.headers and settings.SESSION_COOKIE_NAME not in request.COOKIES
+
+
+class PublicCacheMiddleware:
+    """
+    Short-TTL cache of anonymous GET responses from viewsets that name a
+    `public_cache_group`, for the read-only actions routed in
+    replicas.read_only_action. Entries are keyed on the group's generation,
+    the path, the sorted query string and Accept. Any successful write
+    through one of those viewsets starts a new generation, as do other
+    catalog writers (imports, stocktakes, checkouts, returns and hold
+    changes, which move availability and queue lengths) through
+    invalidate_on_commit.
+    Hits and misses are counted in METRICS.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.public_cache = None
+        response = self.get_response(request)
+        entry = request.public_cache
+        if entry is None: return response
+        group, key = entry
+        if key is None:
+            if response.status_code < 400: invalidate_public_cache(group)
+        elif response.status_code == 200 and not response.streaming:
+            cache.set(key, (response.content, response['Content-Type']), settings.PUBLIC_CACHE_TTL)
+            response['X-Cache'] = 'MISS'
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        group = getattr(getattr(view_func, 'cls', None), 'public_cache_group', None)
+        if not group: return None
+        if request.method not in SAFE_METHODS:
+            if not read_only_action(view_func, request): request.public_cache = (group, None)
+            return None
+        if not settings.PUBLIC_CACHE_TTL or not is_anonymous(request) or not read_only_action(view_func, request):
+            return None
+
+        version = cache.get(group_version_key(group)) or 0
+        query = '&'.join(sorted(request.META.get('QUERY_STRING', '').split('&')))
+        digest = hashlib.sha1(f"{request.path}?{query}|{request.headers.get('Accept', '')}".encode()).hexdigest()
+        key = f'public_cache:{group}:{version}:{digest}'
+        cached = cache.get(key)
+        METRICS.increment('library_public_cache_total', group=group, result='hit' if cached else 'miss')
+        if cached:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response['X-Cache'] = 'HIT'
+            return response
+        request.public_cache = (group, key)
+        return None
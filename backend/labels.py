@@ -0,0 +1,122 @@
+from django.utils.dateparse import parse_date
+
+from .models import Book, Patron
+
+# Stored on the printer once per job (^DF) and recalled for every label (^XF),
+# so each label only carries its variable fields.
+SPINE_TEMPLATE = 'R:SPINE.ZPL'
+CARD_TEMPLATE = 'R:IDCARD.ZPL'
+
+SPINE_FORMAT = """^XA
+^DF{name}^FS
+^CI28
+^FO30,30^A0N,30,30^FN1^FS
+^FO30,65^A0N,30,30^FN2^FS
+^FO30,100^A0N,25,25^FN3^FS
+^FO150,30^BCN,60,Y,N,N^FN4^FS
+^XZ
+"""
+
+CARD_FORMAT = """^XA
+^DF{name}^FS
+^CI28
+^FO40,40^A0N,35,35^FDSt. Thomas Library^FS
+^FO40,90^A0N,25,25^FDPatron Identity Card^FS
+^FO40,160^A0N,50,50^FN1^FS
+^FO40,225^A0N,30,30^FN2^FS
+^FO40,300^BCN,100,Y,N,N^FN3^FS
+^XZ
+"""
+
+SPINE_COLUMNS = ['id', 'author', 'ddc_code', 'barcode_id']
+CARD_COLUMNS = ['id', 'full_name', 'patron_group', 'student_id']
+
+
+def spine_fields(book):
+    """(ddc main, ddc fraction, author cutter, barcode) for a Book or dict."""
+    def get_field(field):
+        if isinstance(book, dict): return book.get(field, '')
+        return getattr(book, field, '')
+
+    author, ddc_code = get_field('author'), get_field('ddc_code')
+    ddc_main, dot, ddc_sub = (ddc_code or '000').partition('.')
+    return ddc_main, dot + ddc_sub, author[:3].upper() if author else 'UNK', get_field('barcode_id') or ''
+
+
+def card_fields(patron):
+    return (
+        getattr(patron, 'full_name', 'Unknown Patron'),
+        getattr(patron, 'patron_group', 'STUDENT'),
+        getattr(patron, 'student_id', '000000'),
+    )
+
+
+def field_data(value):
+    """^FH^FD with the ZPL control characters hex-escaped."""
+    value = str(value or '').replace('_', '_5F').replace('^', '_5E').replace('~', '_7E')
+    return f'^FH^FD{value}^FS'
+
+
+def recall(name, values):
+    fields = ''.join(f'^FN{n}{field_data(value)}' for n, value in enumerate(values, start=1))
+    return f'^XA^XF{name}^FS{fields}^XZ\n'
+
+
+def stream_labels(rows, name, template, fields):
+    yield template.format(name=name)
+    for row in rows:
+        yield recall(name, fields(row))
+
+
+# ------------------------------------------------------------------
+# Print jobs: filter → .only() → .iterator() → ZPL chunks
+# ------------------------------------------------------------------
+
+def split_ids(value):
+    if not value: return []
+    if isinstance(value, str): value = value.split(',')
+    try:
+        return [int(v) for v in value if str(v).strip()]
+    except (TypeError, ValueError):
+        raise ValueError('ids must be a list of integers')
+
+
+def to_date(value):
+    if not value: return None
+    date = parse_date(str(value))
+    if date is None: raise ValueError(f'Invalid date {value}')
+    return date
+
+
+def spine_queryset(params):
+    """
+    Books matching ids / shelf_location / acquired_from / acquired_to, in
+    shelf order. Returns None when no filter is given.
+    """
+    queryset = Book.objects.all()
+    ids = split_ids(params.get('ids'))
+    if ids: queryset = queryset.filter(id__in=ids)
+    if params.get('shelf_location'): queryset = queryset.filter(shelf_location=params['shelf_location'])
+    acquired_from, acquired_to = to_date(params.get('acquired_from')), to_date(params.get('acquired_to'))
+    if acquired_from: queryset = queryset.filter(acquisition_date__gte=acquired_from)
+    if acquired_to: queryset = queryset.filter(acquisition_date__lte=acquired_to)
+    if not queryset.query.where: return None
+    return queryset.only(*SPINE_COLUMNS).order_by('ddc_code', 'author', 'id')
+
+
+def card_queryset(params):
+    """Patrons matching ids / class_name, in name order. None when unfiltered."""
+    queryset = Patron.objects.all()
+    ids = split_ids(params.get('ids'))
+    if ids: queryset = queryset.filter(id__in=ids)
+    if params.get('class_name'): queryset = queryset.filter(class_name=params['class_name'])
+    if not queryset.query.where: return None
+    return queryset.only(*CARD_COLUMNS).order_by('full_name', 'id')
+
+
+def spine_job(queryset, chunk_size=2000):
+    return stream_labels(queryset.iterator(chunk_size=chunk_size), SPINE_TEMPLATE, SPINE_FORMAT, spine_fields)
+
+
+def card_job(queryset, chunk_size=2000):
+    return stream_labels(queryset.iterator(chunk_size=chunk_size), CARD_TEMPLATE, CARD_FORMAT, card_fields)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from backend.services import FineAccrualService
+
+
+class Command(BaseCommand):
+    help = "Charge accrued fines on overdue loans that are still out and block patrons over the threshold (safe to rerun)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--block-threshold', help='Defaults to settings.FINE_BLOCK_THRESHOLD')
+
+    def handle(self, *args, **options):
+        def progress(stats, rate):
+            self.stdout.write(f"  {stats['scanned']} loans scanned, {stats['assessed']} charged ({rate:.0f} rows/s)")
+
+        stats = FineAccrualService.run(
+            chunk_size=options['chunk_size'], block_threshold=options['block_threshold'], progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {stats['scanned']} overdue loans in {stats['elapsed']:.1f}s ({stats['rows_per_sec']:.0f} rows/s): "
+            f"{stats['assessed']} charges totalling {stats['amount']}, {stats['blocked']} patrons blocked"
+        ))
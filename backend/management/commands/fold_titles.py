@@ -0,0 +1,29 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.services import TitleService
+
+
+class Command(BaseCommand):
+    help = "Group catalog copies into Titles by ISBN and recount each title's availability."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--merge', metavar='CSV',
+            help='Two-column CSV of stand-in ISBN, real ISBN: class-set copies catalogued under made-up numbers',
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        merge = {}
+        if options['merge']:
+            try:
+                with open(options['merge'], newline='') as fh:
+                    merge = {row[0].strip(): row[1].strip() for row in csv.reader(fh) if len(row) >= 2 and row[0].strip()}
+            except OSError as e:
+                raise CommandError(str(e))
+        stats = TitleService.fold(merge=merge, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['linked']} copies linked ({stats['merged']} moved off stand-in ISBNs), {stats['titles']} titles recounted"
+        ))
@@ -0,0 +1,47 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.importers import CatalogImporter, detect_format
+from backend.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = "Stream a CSV, MARC 21 or MARCXML file into the catalog with chunked bulk upserts (resumable)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='File to import')
+        parser.add_argument('--format', choices=[c for c, _ in ImportJob.FORMAT_CHOICES], help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--resume', type=int, metavar='JOB_ID', help='Continue an interrupted job from its checkpoint')
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            try:
+                job = ImportJob.objects.get(pk=options['resume'])
+            except ImportJob.DoesNotExist:
+                raise CommandError(f"Import job {options['resume']} not found")
+            if job.status == 'COMPLETED': raise CommandError(f"Import job {job.pk} already completed")
+            self.stdout.write(f"Resuming job {job.pk} at record {job.records_read} (byte {job.offset})")
+        else:
+            path = options['path']
+            if not path or not os.path.exists(path): raise CommandError('A readable file path is required')
+            job = ImportJob.objects.create(
+                file_name=os.path.basename(path), file_path=os.path.abspath(path),
+                format=options['format'] or detect_format(path), created_by='manage.py',
+            )
+            self.stdout.write(f"Created import job {job.pk} ({job.format})")
+
+        started = time.monotonic()
+
+        def progress(job):
+            rate = job.records_read / max(time.monotonic() - started, 1e-6)
+            self.stdout.write(f"  {job.records_read} read, {job.imported} imported, {job.failed} failed ({rate:.0f} rec/s)")
+
+        job = CatalogImporter(job, chunk_size=options['chunk_size'], progress=progress).run()
+        if job.status == 'FAILED':
+            raise CommandError(f"Import job {job.pk} failed: {job.message} (resume with --resume {job.pk})")
+        self.stdout.write(self.style.SUCCESS(
+            f"Job {job.pk} completed: {job.imported} imported, {job.failed} failed"
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from backend.benchmarks import LoadDriver
+
+DEFAULT_PATHS = ['/api/catalog/', '/api/catalog/?search=history', '/api/catalog/?cursor=&ordering=-loan_count']
+
+
+class Command(BaseCommand):
+    help = "Concurrent GET load against a running server; reports p50/p99 latency and throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--path', action='append', dest='paths', help=f"Repeatable. Default: {', '.join(DEFAULT_PATHS)}")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--duration', type=float, help='Run for this many seconds instead of a request count')
+        parser.add_argument('--token', help='DRF token for librarian-only endpoints')
+
+    def handle(self, *args, **options):
+        report = LoadDriver(
+            options['base_url'], options['paths'] or DEFAULT_PATHS, concurrency=options['concurrency'],
+            duration=options['duration'], requests=options['requests'], token=options['token'],
+        ).run()
+        self.stdout.write(f"{'path':48} {'ok':>6} {'errors':>6} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+        for path, row in report.items():
+            self.stdout.write(
+                f"{path:48} {row['n']:>6} {row['errors']:>6} {row['p50_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['ops_per_sec']:>9.1f}"
+            )
+        if report['ALL']['errors']:
+            self.stdout.write(self.style.WARNING(f"{report['ALL']['errors']} requests failed"))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backend.images import LOGO_SIZES, PATRON_SIZES, store_image
+from backend.models import Patron, SystemConfiguration
+
+
+class Command(BaseCommand):
+    help = "Move inline base64 patron photos and the library logo into MediaStorage with thumbnails."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        moved = failed = 0
+        # Only rows still carrying a data URL are selected, so reruns pick up where a crash left off.
+        pending = Patron.objects.filter(photo_url__startswith='data:').only('id', 'photo_url').order_by('id')
+        last_id = 0
+        while True:
+            batch = list(pending.filter(id__gt=last_id)[:batch_size])
+            if not batch: break
+            last_id = batch[-1].id
+            updated = []
+            for patron in batch:
+                try:
+                    keys = store_image(patron.photo_url, 'patrons', PATRON_SIZES)
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"  Patron {patron.id}: {e}")
+                    continue
+                patron.photo_key, patron.photo_thumb_key, patron.photo_url = keys['full'], keys['thumb'], None
+                updated.append(patron)
+            with transaction.atomic():
+                Patron.objects.bulk_update(updated, ['photo_key', 'photo_thumb_key', 'photo_url'])
+            moved += len(updated)
+            self.stdout.write(f"  {moved} photos moved")
+
+        config = SystemConfiguration.objects.filter(pk=1, logo__startswith='data:').first()
+        if config:
+            keys = store_image(config.logo, 'branding', LOGO_SIZES)
+            config.logo_key, config.logo = keys['full'], None
+            config.save(update_fields=['logo_key', 'logo', 'last_updated']) # New stamp: workers reload the config
+            self.stdout.write("  Logo moved")
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {moved} photos moved, {failed} unreadable"))
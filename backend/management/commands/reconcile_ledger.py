@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from backend.services import LedgerService
+
+
+class Command(BaseCommand):
+    help = "Compare every patron's fines/total_paid with the transaction ledger and report drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--post-adjustments', action='store_true',
+            help='Book balance drift as MANUAL_ADJUSTMENT entries so the ledger matches patron balances',
+        )
+
+    def handle(self, *args, **options):
+        rows = LedgerService.reconcile(post_adjustments=options['post_adjustments'])
+        for row in rows:
+            self.stdout.write(
+                f"  {row['student_id']} {row['full_name']}: fines {row['fines']} vs ledger {row['ledger_fines']}, "
+                f"paid {row['total_paid']} vs ledger {row['ledger_paid']}"
+            )
+        verb = 'adjusted' if options['post_adjustments'] else 'drifted'
+        self.stdout.write(self.style.SUCCESS(f"{len(rows)} patrons {verb}"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from backend.analytics import AnalyticsService
+
+
+class Command(BaseCommand):
+    help = "Fold new loans and transactions into the daily dashboard rollups (run every few minutes)."
+
+    def handle(self, *args, **options):
+        folded = AnalyticsService.refresh()
+        self.stdout.write(self.style.SUCCESS(
+            f"Folded {folded['loans']} loans and {folded['transactions']} transactions"
+        ))
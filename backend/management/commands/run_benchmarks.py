@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.benchmarks import SCENARIOS, run_scenario
+
+
+class Command(BaseCommand):
+    help = "Time API scenarios in-process against the current database (seed it with seed_benchmark_data)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help=f"Defaults to all: {', '.join(SCENARIOS)}")
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--output', help='Write the results as JSON (use as a later --baseline)')
+        parser.add_argument('--baseline', help='JSON results to compare p50 latency against')
+        parser.add_argument('--tolerance', type=float, default=25.0, help='Allowed p50 slowdown vs baseline, in percent')
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or list(SCENARIOS)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown: raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        results = []
+        self.stdout.write(f"{'scenario':28} {'n':>4} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'ops/s':>9} {'bytes':>10}")
+        for name in names:
+            result = run_scenario(name, repeat=options['repeat'], warmup=options['warmup'])
+            results.append(result)
+            self.stdout.write(
+                f"{name:28} {result['n']:>4} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                f"{result['mean_ms']:>9.2f} {result['ops_per_sec']:>9.1f} {result['bytes'] or '':>10}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as fh: json.dump(results, fh, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as fh:
+                baseline = {row['scenario']: row for row in json.load(fh)}
+            regressions = []
+            for result in results:
+                before = baseline.get(result['scenario'])
+                if not before or not before['p50_ms']: continue
+                change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100
+                if change > options['tolerance']:
+                    regressions.append(f"{result['scenario']}: p50 {before['p50_ms']:.2f} -> {result['p50_ms']:.2f} ms (+{change:.0f}%)")
+            if regressions: raise CommandError('Regressions against baseline:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS(f"No p50 regressions over {options['tolerance']:.0f}%"))
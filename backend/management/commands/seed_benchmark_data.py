@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.benchmarks import SCALES, BenchmarkSeeder
+
+
+class Command(BaseCommand):
+    help = "Seed books, patrons, loans, holds and transactions for benchmarking (10k / 100k / 1m books)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', default='10k', help=f"One of {', '.join(SCALES)} or a book count")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--flush', action='store_true', help='Remove previously generated rows first')
+        parser.add_argument('--flush-only', action='store_true', help='Remove generated rows and stop')
+
+    def handle(self, *args, **options):
+        scale = options['scale'].lower()
+        if scale in SCALES:
+            books = SCALES[scale]
+        elif scale.isdigit():
+            books = int(scale)
+        else:
+            raise CommandError(f"Unknown scale {options['scale']}")
+
+        if options['flush'] or options['flush_only']:
+            self.stdout.write(f"Removed {BenchmarkSeeder.flush()} generated rows")
+            if options['flush_only']: return
+
+        stats = BenchmarkSeeder(
+            books, batch_size=options['batch_size'], seed=options['seed'], progress=self.stdout.write
+        ).run()
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {stats['books']} books, {stats['patrons']} patrons and {stats['open_loans']} open loans "
+            f"in {stats['elapsed']:.1f}s"
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from backend.services import HoldService
+
+
+class Command(BaseCommand):
+    help = "Expire uncollected shelf holds and offer each copy to the next patron in its queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        stats = HoldService.sweep(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['expired']} holds expired: {stats['promoted']} copies passed to the next patron, "
+            f"{stats['released']} returned to the shelf"
+        ))
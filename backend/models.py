@@ -1,13 +1,18 @@
 
-from django.db import models
-from django.db.models import JSONField
+from collections import Counter
+
+from django.db import connections, models, transaction
+from django.db.models import Case, Count, F, JSONField, Max, Min, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.contrib.postgres.search import SearchVectorField
 from django.utils import timezone
 
 class SystemConfiguration(models.Model):
     """
     Global library settings including branding and spatial layout.
     """
-    logo = models.TextField(blank=True, null=True) # Base64 Logo String
+    logo = models.TextField(blank=True, null=True) # Legacy base64 / external URL
+    logo_key = models.CharField(max_length=255, blank=True, null=True) # MediaStorage key
     map_data = JSONField(default=dict) # Stores { levels: [], shelves: [] }
     last_updated = models.DateTimeField(auto_now=True)
 
@@ -25,6 +30,78 @@ class LibraryClass(models.Model):
     def __str__(self):
         return self.name
 
+class Title(models.Model):
+    """
+    A catalogued work, keyed by ISBN; each physical copy is a Book keyed by
+    its barcode (a class set is one Title with 30 copies). The counters are
+    materialized: circulation and holds shift them with F() updates under
+    the copies' row locks, Book.save()/delete() recount after commit, and
+    bulk writers (imports, stocktakes, fold_titles) call `recount`.
+    """
+    STATUS_COUNTERS = {'AVAILABLE': 'available_count', 'LOANED': 'loaned_count'}
+
+    isbn = models.CharField(max_length=13, unique=True)
+    title = models.CharField(max_length=255)
+    copy_count = models.IntegerField(default=0)
+    available_count = models.IntegerField(default=0)
+    loaned_count = models.IntegerField(default=0)
+    hold_count = models.IntegerField(default=0) # Queued and shelf holds on any copy
+
+    def __str__(self):
+        return f"{self.title} ({self.isbn})"
+
+    @classmethod
+    def ensure(cls, pairs):
+        """{isbn: title id} for (isbn, title) pairs, creating the missing titles."""
+        wanted = {isbn: name for isbn, name in pairs if isbn}
+        if not wanted: return {}
+        cls.objects.bulk_create([cls(isbn=isbn, title=name or isbn) for isbn, name in wanted.items()], ignore_conflicts=True)
+        return dict(cls.objects.filter(isbn__in=wanted).values_list('isbn', 'id'))
+
+    @classmethod
+    def moves(cls, books, status, deltas=None):
+        """Adds the counter changes of `books` going from their loaded status to `status` to a Counter."""
+        deltas = Counter() if deltas is None else deltas
+        for book in books:
+            if book.status == status: continue
+            if book.status in cls.STATUS_COUNTERS: deltas[(book.record_id, cls.STATUS_COUNTERS[book.status])] -= 1
+            if status in cls.STATUS_COUNTERS: deltas[(book.record_id, cls.STATUS_COUNTERS[status])] += 1
+        return deltas
+
+    @classmethod
+    def shift(cls, deltas):
+        """Applies a Counter of (title id, counter) -> change with one F() UPDATE."""
+        changes = {key: n for key, n in deltas.items() if n and key[0] is not None}
+        if not changes: return
+        cls.objects.filter(id__in={title_id for title_id, _ in changes}).update(**{
+            field: F(field) + Case(
+                *[When(id=title_id, then=Value(n)) for (title_id, f), n in changes.items() if f == field],
+                default=Value(0),
+            )
+            for field in {field for _, field in changes}
+        })
+
+    @classmethod
+    def recount(cls, ids):
+        """
+        Recomputes the counters of titles `ids` from their copies and holds.
+        The title rows are locked first, so a concurrent shift either lands
+        before the count (and is included) or after it (on top of it).
+        """
+        ids = {pk for pk in ids if pk is not None}
+        if not ids: return
+        def count(queryset, key):
+            return Coalesce(Subquery(queryset.values(key).annotate(n=Count('id')).values('n')), 0)
+        copies = Book.objects.filter(record_id=OuterRef('pk'))
+        with transaction.atomic():
+            list(cls.objects.select_for_update().filter(id__in=ids).values_list('id', flat=True))
+            cls.objects.filter(id__in=ids).update(
+                copy_count=count(copies, 'record_id'),
+                available_count=count(copies.filter(status='AVAILABLE'), 'record_id'),
+                loaned_count=count(copies.filter(status='LOANED'), 'record_id'),
+                hold_count=count(Hold.objects.filter(book__record_id=OuterRef('pk')), 'book__record_id'),
+            )
+
 class Book(models.Model):
     STATUS_CHOICES = [
         ('AVAILABLE', 'Available'),
@@ -34,7 +111,8 @@ class Book(models.Model):
         ('HELD', 'Held'),
     ]
 
-    isbn = models.CharField(max_length=13, unique=True, db_index=True)
+    isbn = models.CharField(max_length=13, db_index=True)
+    record = models.ForeignKey(Title, on_delete=models.SET_NULL, null=True, blank=True, related_name='copies')
     title = models.CharField(max_length=255)
     author = models.CharField(max_length=255)
     ddc_code = models.CharField(max_length=20, db_index=True)
@@ -70,9 +148,83 @@ class Book(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     loan_count = models.IntegerField(default=0)
 
+    # Maintained by the backend_book_search_vector trigger (schema.sql)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [models.Index(fields=['record', 'id'], name='book_title_copies_idx')]
+
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        book = super().from_db(db, field_names, values)
+        book._counted = (book.__dict__.get('record_id'), book.__dict__.get('status'))
+        return book
+
+    def save(self, *args, **kwargs):
+        # Copies always belong to the Title of their ISBN
+        if self.isbn and (self.record_id is None or self.record.isbn != self.isbn):
+            self.record_id = Title.ensure([(self.isbn, self.title)])[self.isbn]
+        counted = getattr(self, '_counted', (None, None))
+        super().save(*args, **kwargs)
+        if counted != (self.record_id, self.status):
+            # New copy, moved to another title or changed status: recount what it left and joined
+            titles = {counted[0], self.record_id}
+            transaction.on_commit(lambda: Title.recount(titles))
+            self._counted = (self.record_id, self.status)
+
+    def delete(self, *args, **kwargs):
+        record_id = self.record_id
+        deleted = super().delete(*args, **kwargs)
+        transaction.on_commit(lambda: Title.recount([record_id]))
+        return deleted
+
+class ISBNMetadataCache(models.Model):
+    """
+    Open Library lookups by ISBN. A null payload records a confirmed miss so
+    unknown ISBNs are not re-queried until the (shorter) negative TTL lapses.
+    """
+    isbn = models.CharField(max_length=13, unique=True)
+    payload = JSONField(null=True, blank=True) # Normalized waterfall metadata
+    fetched_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.isbn} ({'hit' if self.payload else 'miss'})"
+
+class ImportJob(models.Model):
+    """
+    A bulk catalog import (CSV / MARC / MARCXML). `offset` is the byte
+    position after the last committed chunk, used to resume after a crash.
+    """
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    ]
+    FORMAT_CHOICES = [('CSV', 'CSV'), ('MARC', 'MARC 21'), ('MARCXML', 'MARCXML')]
+
+    file_name = models.CharField(max_length=255)
+    file_path = models.CharField(max_length=500)
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    offset = models.BigIntegerField(default=0)
+    records_read = models.IntegerField(default=0)
+    imported = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    errors = JSONField(default=list, blank=True) # Per-record errors (capped)
+    message = models.TextField(blank=True, null=True)
+    created_by = models.CharField(max_length=150, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Import {self.file_name} ({self.status})"
+
 class Patron(models.Model):
     GROUP_CHOICES = [
         ('STUDENT', 'Student'),
@@ -87,7 +239,9 @@ class Patron(models.Model):
     class_name = models.CharField(max_length=100, blank=True, null=True)
     email = models.EmailField(blank=True, null=True)
     phone = models.CharField(max_length=20, blank=True, null=True)
-    photo_url = models.TextField(blank=True, null=True) # Base64 portrait
+    photo_url = models.TextField(blank=True, null=True) # Legacy base64 / external URL
+    photo_key = models.CharField(max_length=255, blank=True, null=True) # MediaStorage key (512px)
+    photo_thumb_key = models.CharField(max_length=255, blank=True, null=True) # MediaStorage key (96px)
     is_blocked = models.BooleanField(default=False)
     fines = models.DecimalField(max_digits=8, decimal_places=2, default=0.00)
     total_paid = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
@@ -102,13 +256,28 @@ class Loan(models.Model):
     due_date = models.DateTimeField()
     returned_at = models.DateTimeField(null=True, blank=True)
     renewal_count = models.IntegerField(default=0)
+    fine_accrued = models.DecimalField(max_digits=8, decimal_places=2, default=0.00) # Already charged to the patron
+
+    class Meta:
+        # Partial indexes: only open loans are ever scanned by circulation and the accrual job
+        indexes = [
+            models.Index(fields=['due_date', 'id'], name='loan_open_due_idx', condition=models.Q(returned_at__isnull=True)),
+            models.Index(fields=['book'], name='loan_open_book_idx', condition=models.Q(returned_at__isnull=True)),
+            models.Index(fields=['patron'], name='loan_open_patron_idx', condition=models.Q(returned_at__isnull=True)),
+        ]
 
 class Hold(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='holds')
     patron = models.ForeignKey(Patron, on_delete=models.CASCADE, related_name='holds')
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField(null=True, blank=True)
-    is_active = models.BooleanField(default=False)
+    is_active = models.BooleanField(default=False) # True = waiting on the hold shelf; False = queued
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['book', 'created_at'], name='hold_queue_idx'),
+            models.Index(fields=['expires_at'], name='hold_shelf_expiry_idx', condition=models.Q(is_active=True)),
+        ]
 
 class Transaction(models.Model):
     TYPE_CHOICES = [
@@ -131,12 +300,22 @@ class Transaction(models.Model):
     note = models.TextField(blank=True, null=True)
     book_title = models.CharField(max_length=255, blank=True, null=True)
 
+    # Effect on Patron.fines: assessments add, payments/waivers subtract,
+    # MANUAL_ADJUSTMENT applies its own sign.
+    DEBIT_TYPES = ['FINE_ASSESSMENT', 'REPLACEMENT_ASSESSMENT', 'DAMAGE_ASSESSMENT']
+    CREDIT_TYPES = ['FINE_PAYMENT', 'REPLACEMENT_PAYMENT', 'WAIVE']
+    PAYMENT_TYPES = ['FINE_PAYMENT', 'REPLACEMENT_PAYMENT']
+
+    class Meta:
+        indexes = [models.Index(fields=['patron', 'timestamp', 'id'], name='txn_patron_history_idx')]
+
 class CirculationRule(models.Model):
     patron_group = models.CharField(max_length=20, choices=Patron.GROUP_CHOICES)
     material_type = models.CharField(max_length=50, default='REGULAR')
     loan_days = models.IntegerField(default=14)
     max_items = models.IntegerField(default=5)
     fine_per_day = models.DecimalField(max_digits=5, decimal_places=2, default=0.50)
+    updated_at = models.DateTimeField(auto_now=True) # Stamp for CirculationRuleCache: write rules with save()
 
     class Meta:
         unique_together = ('patron_group', 'material_type')
@@ -159,3 +338,142 @@ class SystemAlert(models.Model):
     location = models.CharField(max_length=100)
     timestamp = models.DateTimeField(auto_now_add=True)
     is_resolved = models.BooleanField(default=False)
+
+class AnalyticsWatermark(models.Model):
+    """
+    High-water mark per rollup source (e.g. 'loans' on issued_at,
+    'transactions' on timestamp). Rows at or below it are already counted.
+    """
+    source = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField()
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+class DailyTitleStat(models.Model):
+    date = models.DateField()
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='daily_stats')
+    loans = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'book')
+
+class DailyClassStat(models.Model):
+    date = models.DateField()
+    class_name = models.CharField(max_length=100, blank=True, default='') # '' = no class (staff)
+    loans = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'class_name')
+
+class DailyRevenueStat(models.Model):
+    date = models.DateField()
+    type = models.CharField(max_length=30, choices=Transaction.TYPE_CHOICES)
+    count = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+
+    class Meta:
+        unique_together = ('date', 'type')
+
+class DailyOverdueSnapshot(models.Model):
+    """Open overdue loans as of each refresh; the latest row of the day wins."""
+    date = models.DateField(unique=True)
+    overdue_loans = models.IntegerField(default=0)
+    overdue_patrons = models.IntegerField(default=0)
+    taken_at = models.DateTimeField()
+
+class InventorySession(models.Model):
+    """
+    A stocktake. Scans arrive in batches per shelf; closing the session
+    records what was expected on the counted shelves but never scanned.
+    `shelf_location` limits the count to one shelf, otherwise every shelf
+    scanned during the session counts.
+    """
+    STATUS_CHOICES = [('OPEN', 'Open'), ('CLOSED', 'Closed')]
+
+    name = models.CharField(max_length=255, blank=True, null=True)
+    shelf_location = models.CharField(max_length=50, blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='OPEN')
+    started_by = models.CharField(max_length=150, blank=True, null=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    closed_at = models.DateTimeField(null=True, blank=True)
+    scanned = models.IntegerField(default=0)
+    unknown = models.IntegerField(default=0)
+    misplaced = models.IntegerField(default=0)
+    missing = models.IntegerField(default=0)
+    marked_lost = models.IntegerField(default=0)
+
+class InventoryScan(models.Model):
+    """One barcode seen during a session; `previous_shelf` is where the catalog had it."""
+    session = models.ForeignKey(InventorySession, on_delete=models.CASCADE, related_name='scans')
+    barcode_id = models.CharField(max_length=50)
+    book = models.ForeignKey(Book, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    shelf_location = models.CharField(max_length=50)
+    previous_shelf = models.CharField(max_length=50, blank=True, null=True)
+    scanned_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['session', 'barcode_id'], name='inventory_scan_once')]
+
+class ChangeLog(models.Model):
+    """
+    Delta-sync feed: one row per write to a synced model. Rows only say
+    *which* object changed; readers load its current state (or report it
+    deleted), so repeated writes compact away.
+
+    Rows are written without a feed position. `sequence` numbers committed
+    rows after every `seq` already handed out, so however long a writing
+    transaction stays open, its rows land ahead of any reader's cursor.
+    """
+    MODELS = ['book', 'patron', 'loan', 'hold', 'circulationrule']
+    SEQUENCE_LOCK = 7210001 # pg_advisory_xact_lock key serializing `sequence`
+
+    id = models.BigAutoField(primary_key=True)
+    seq = models.BigIntegerField(null=True, blank=True, unique=True)
+    model = models.CharField(max_length=30)
+    object_id = models.BigIntegerField()
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'object_id', 'seq'], name='changelog_object_idx'),
+            models.Index(fields=['id'], name='changelog_unsequenced_idx', condition=Q(seq__isnull=True)),
+        ]
+
+    @classmethod
+    def record(cls, model, ids):
+        """Journals a write to `ids` of `model` (a class or its lowercase name) with one INSERT."""
+        name = model if isinstance(model, str) else model._meta.model_name
+        ids = {int(pk) for pk in ids if pk is not None}
+        if ids: cls.objects.bulk_create([cls(model=name, object_id=pk) for pk in sorted(ids)])
+
+    @classmethod
+    def sequence(cls):
+        """
+        Gives every committed, unnumbered row a `seq` above the current head,
+        in insert order. Runs under a lock so two sequencers never number
+        from the same head; rows still in flight are numbered by a later call.
+        """
+        connection = connections['default'] # Where ReplicaRouter sends every write
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor: cursor.execute('SELECT pg_advisory_xact_lock(%s)', [cls.SEQUENCE_LOCK])
+            pending = cls.objects.filter(seq__isnull=True).aggregate(first=Min('id'), last=Max('id'))
+            if pending['first'] is None: return
+            head = cls.objects.aggregate(head=Max('seq'))['head'] or 0
+            cls.objects.filter(seq__isnull=True, id__range=(pending['first'], pending['last'])).update(
+                seq=F('id') - pending['first'] + head + 1,
+            )
+
+class SyncMutation(models.Model):
+    """An offline desk mutation, keyed by the client's id so replays apply exactly once."""
+    TYPE_CHOICES = [('CHECKOUT', 'Checkout'), ('RETURN', 'Return')]
+    STATUS_CHOICES = [('APPLIED', 'Applied'), ('REJECTED', 'Rejected')]
+
+    client_id = models.CharField(max_length=64, unique=True)
+    type = models.CharField(max_length=10, choices=TYPE_CHOICES)
+    payload = JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    result = JSONField(default=dict)
+    device = models.CharField(max_length=100, blank=True, null=True)
+    performed_at = models.DateTimeField(null=True, blank=True) # Client clock when it happened offline
+    applied_at = models.DateTimeField(auto_now_add=True)
+    applied_by = models.CharField(max_length=150, blank=True, null=True)
@@ -0,0 +1,117 @@
+import base64
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Seek-based pagination over a (field, id) ordering. Each page is a single
+    indexed range scan with LIMIT page_size + 1, no COUNT(*) and no OFFSET,
+    so page 1000 costs the same as page 1. The next cursor is an opaque token
+    carrying the last row's key; only forward paging is offered.
+
+    Views opt in by listing the leading fields they allow in `keyset_fields`
+    (they must be non-null). The ordering is taken from the queryset after
+    filtering, so `?ordering=-loan_count` works as usual.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        lead, descending = self.get_keyset(queryset, view)
+        keys = (lead,) if lead == 'id' else (lead, 'id')
+        self.ordering = [('-' if descending else '') + key for key in keys]
+        queryset = queryset.order_by(*self.ordering)
+        loaded, deferring = queryset.query.deferred_loading
+        if loaded and not deferring: queryset = queryset.only(*loaded, *keys) # Keys must not lazy-load per row
+
+        token = request.query_params.get(self.cursor_query_param)
+        if token:
+            position = self.decode_cursor(token)
+            queryset = queryset.filter(self.seek_filter(queryset.model, keys, position, descending))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_position = [self.key_value(getattr(rows[-1], key)) for key in keys] if rows else None
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_next_link(self):
+        if not self.has_next: return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, self.encode_cursor(self.next_position)
+        )
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_keyset(self, queryset, view):
+        allowed = getattr(view, 'keyset_fields', ['id'])
+        ordering = queryset.query.order_by or ('-id',)
+        lead = ordering[0]
+        if not isinstance(lead, str) or lead.lstrip('-') not in allowed:
+            raise ValidationError({'ordering': f"Cursor pagination supports ordering by: {', '.join(allowed)}"})
+        return lead.lstrip('-'), lead.startswith('-')
+
+    def seek_filter(self, model, keys, position, descending):
+        op = 'lt' if descending else 'gt'
+        values = [model._meta.get_field(key).to_python(value) for key, value in zip(keys, position)]
+        if len(keys) == 1: return Q(**{f'{keys[0]}__{op}': values[0]})
+        return Q(**{f'{keys[0]}__{op}': values[0]}) | Q(**{keys[0]: values[0], f'id__{op}': values[1]})
+
+    @staticmethod
+    def key_value(value):
+        return value.isoformat() if hasattr(value, 'isoformat') else value
+
+    def encode_cursor(self, position):
+        payload = json.dumps({'o': self.ordering, 'p': position}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            ordering, position = payload['o'], payload['p']
+        except (ValueError, KeyError, TypeError):
+            raise NotFound('Invalid cursor')
+        if ordering != self.ordering or len(position) != len(ordering):
+            raise NotFound('Cursor does not match the requested ordering')
+        return position
+
+
+class LibraryPagination(PageNumberPagination):
+    """
+    Default pagination: classic ?page= numbering, or keyset paging when the
+    client sends ?cursor= (empty for the first page) to a view that declares
+    `keyset_fields`.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.keyset_class.cursor_query_param in request.query_params and hasattr(view, 'keyset_fields'):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset: return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+# Latency histogram buckets (seconds)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Labelled counters other modules bump through METRICS.increment (name -> help)
+COUNTERS = {
+    'library_public_cache_total': 'Anonymous response cache lookups by group and result (hit/miss).',
+    'library_throttled_total': 'Public requests refused by the kiosk throttle, by scope and client kind.',
+    'library_throttle_errors_total': 'Kiosk throttle bucket-store failures (requests let through), by scope and error.',
+}
+
+# Most queries a single request to each view may run ('METHOD route name' ->
+# count), including the token lookup. Batch endpoints must stay flat in batch
+# size. Enforced by ProfilingMiddleware when QUERY_BUDGET_STRICT is on (test runs).
+QUERY_BUDGETS = {
+    'GET catalog-list': 4, # ?search= first probes for an exact barcode / ISBN match
+    'GET catalog-detail': 2,
+    'GET patrons-list': 3,
+    'GET patrons-account': 5,
+    'GET classes-accounts': 6,
+    'GET holds-list': 3,
+    'GET transactions-list': 4,
+    'GET system-config-list': 2,
+    'POST circulation-checkout': 14,
+    'POST circulation-return-book': 16,
+    'POST circulation-return-books': 16,
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder:
+    """execute_wrapper that counts queries and their wall time on every connection."""
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []
+        self.keep_sql = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            if self.keep_sql: self.statements.append(sql)
+
+    @contextmanager
+    def installed(self):
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(self))
+            yield self
+
+
+class Metrics:
+    """
+    In-process metric store rendered in Prometheus text format. Every worker
+    keeps its own and labels its samples with its pid, so a scrape of any
+    worker is consistent and `sum by (view)` aggregates across workers.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}  # (view, method, status) -> count
+        self.latency = {}   # (view, method) -> [bucket counts..., +Inf count, sum]
+        self.queries = {}   # (view, method) -> [queries, query seconds, response bytes]
+        self.counters = {}  # (name, ((label, value), ...)) -> count
+
+    def increment(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def observe(self, view, method, status, seconds, queries, query_seconds, size):
+        with self.lock:
+            key = (view, method)
+            self.requests[(view, method, status)] = self.requests.get((view, method, status), 0) + 1
+            histogram = self.latency.setdefault(key, [0] * (len(BUCKETS) + 2))
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound: histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            totals = self.queries.setdefault(key, [0, 0.0, 0])
+            totals[0] += queries
+            totals[1] += query_seconds
+            totals[2] += size
+
+    def render(self):
+        pid = os.getpid()
+        lines = []
+
+        def family(name, kind, help):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def labels(view, method, **extra):
+            pairs = {'view': view, 'method': method, **extra, 'worker': pid}
+            return ','.join(f'{k}="{v}"' for k, v in pairs.items())
+
+        with self.lock:
+            family('library_requests_total', 'counter', 'HTTP requests by view and status.')
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append(f'library_requests_total{{{labels(view, method, status=status)}}} {count}')
+
+            family('library_request_duration_seconds', 'histogram', 'Request latency by view.')
+            for (view, method), histogram in sorted(self.latency.items()):
+                for bound, count in zip(BUCKETS, histogram):
+                    lines.append(f'library_request_duration_seconds_bucket{{{labels(view, method, le=bound)}}} {count}')
+                lines.append(f'library_request_duration_seconds_bucket{{{labels(view, method, le="+Inf")}}} {histogram[-2]}')
+                lines.append(f'library_request_duration_seconds_count{{{labels(view, method)}}} {histogram[-2]}')
+                lines.append(f'library_request_duration_seconds_sum{{{labels(view, method)}}} {histogram[-1]:.6f}')
+
+            for index, name, help in (
+                (0, 'library_db_queries_total', 'Database queries run by view.'),
+                (1, 'library_db_query_seconds_total', 'Time spent in database queries by view.'),
+                (2, 'library_response_bytes_total', 'Response body bytes by view (streaming bodies excluded).'),
+            ):
+                family(name, 'counter', help)
+                for (view, method), totals in sorted(self.queries.items()):
+                    value = f'{totals[index]:.6f}' if index == 1 else totals[index]
+                    lines.append(f'{name}{{{labels(view, method)}}} {value}')
+
+            for name, help in COUNTERS.items():
+                family(name, 'counter', help)
+                for (counter, pairs), count in sorted(self.counters.items()):
+                    if counter != name: continue
+                    text = ','.join(f'{k}="{v}"' for k, v in (*pairs, ('worker', pid)))
+                    lines.append(f'{name}{{{text}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match and match.view_name else 'unresolved'
+
+
+class ProfilingMiddleware:
+    """
+    Times each request, counts its database queries and response size,
+    records them in METRICS and reports them in a Server-Timing header.
+    With QUERY_BUDGET_STRICT, a view running more queries than its entry in
+    QUERY_BUDGETS raises QueryBudgetExceeded, failing the test that made
+    the request.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        strict = getattr(settings, 'QUERY_BUDGET_STRICT', False)
+        recorder.keep_sql = strict
+        started = time.perf_counter()
+        with recorder.installed():
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        view = view_name(request)
+        size = 0 if response.streaming else len(response.content)
+        METRICS.observe(
+            view, request.method, response.status_code, elapsed, recorder.count, recorder.duration, size,
+        )
+        response['Server-Timing'] = (
+            f'app;dur={elapsed * 1000:.1f}, db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries"'
+        )
+        budget = QUERY_BUDGETS.get(f'{request.method} {view}')
+        if strict and budget is not None and recorder.count > budget:
+            raise QueryBudgetExceeded(budget_report(f'{request.method} {view}', budget, recorder.statements))
+        return response
+
+
+def budget_report(label, budget, statements):
+    listing = '\n'.join(f'  {n}. {sql}' for n, sql in enumerate(statements, start=1))
+    return f'{label} ran {len(statements)} queries (budget {budget}):\n{listing}'
+
+
+@contextmanager
+def query_budget(limit):
+    """
+    Test helper: fails when the block runs more than `limit` queries.
+
+        with query_budget(QUERY_BUDGETS['POST circulation-checkout']):
+            client.post('/api/circulation/checkout/', {...})
+    """
+    recorder = QueryRecorder()
+    recorder.keep_sql = True
+    with recorder.installed():
+        yield recorder
+    if recorder.count > limit:
+        raise QueryBudgetExceeded(budget_report('Block', limit, recorder.statements))
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint. Requires `Authorization: Bearer <METRICS_TOKEN>` when that is set."""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(METRICS.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,213 @@
+import json
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+
+TOPICS = ('alerts', 'events', 'books')
+
+
+def id_key(event_id):
+    """Sort key for '<ms>-<n>' event ids."""
+    try:
+        return tuple(int(part) for part in str(event_id).split('-'))
+    except ValueError:
+        return None
+
+
+class MemoryBackend:
+    """
+    Single-process transport (development and tests): publishing delivers
+    straight to the local broker. Ids are '<ms>-<n>' like Redis stream ids,
+    so they keep increasing across restarts.
+    """
+    def __init__(self):
+        self.last = (0, 0)
+        self.lock = threading.Lock()
+
+    def publish(self, broker, topic, event, data):
+        with self.lock:
+            ms = int(time.time() * 1000)
+            self.last = (ms, 0) if ms > self.last[0] else (self.last[0], self.last[1] + 1)
+            broker.deliver('%d-%d' % self.last, topic, event, data)
+
+    def start(self, broker):
+        pass
+
+
+class RedisStreamBackend:
+    """
+    Cross-worker transport on a capped Redis stream. Each process runs one
+    pump thread that blocks on XREAD and hands new entries to its local
+    broker, so a process costs one Redis connection however many kiosks
+    it serves. Stream ids are global, so Last-Event-ID works on any worker.
+    """
+    STREAM = 'kiosk:push'
+
+    def __init__(self, url, maxlen=10000):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.maxlen = maxlen
+
+    def publish(self, broker, topic, event, data):
+        self.redis.xadd(
+            self.STREAM, {'topic': topic, 'event': event, 'data': json.dumps(data)}, maxlen=self.maxlen, approximate=True,
+        )
+
+    def start(self, broker):
+        threading.Thread(target=self.pump, args=(broker,), daemon=True, name='push-pump').start()
+
+    def pump(self, broker):
+        last = '$'
+        while True:
+            try:
+                for _, entries in self.redis.xread({self.STREAM: last}, block=5000, count=500) or []:
+                    for entry_id, fields in entries:
+                        last = entry_id.decode()
+                        broker.deliver(
+                            last, fields[b'topic'].decode(), fields[b'event'].decode(), json.loads(fields[b'data']),
+                        )
+            except Exception:
+                time.sleep(1) # Redis unavailable: keep the local subscribers, retry
+
+
+class Broker:
+    """
+    In-process fan-out for the kiosk push channel. Delivered events go into
+    a ring of the most recent `replay_size` entries and wake every waiting
+    subscriber; a subscriber resuming from an id still in the ring replays
+    what it missed, otherwise it is told to resync from the REST endpoints.
+    """
+    def __init__(self, backend, replay_size=1000):
+        self.backend = backend
+        self.recent = deque(maxlen=replay_size)
+        self.condition = threading.Condition()
+        self.started = False
+        # Everything after `floor` is in the ring: the broker's start, then the last evicted entry
+        self.floor_id = f'{int(time.time() * 1000) - 1}-0'
+        self.floor = id_key(self.floor_id)
+
+    def ensure_started(self):
+        if self.started: return
+        with self.condition:
+            if not self.started:
+                self.backend.start(self)
+                self.started = True
+
+    def publish(self, topic, event, data):
+        self.ensure_started()
+        self.backend.publish(self, topic, event, data)
+
+    def deliver(self, event_id, topic, event, data):
+        with self.condition:
+            if len(self.recent) == self.recent.maxlen: self.floor, self.floor_id = self.recent[0][:2]
+            self.recent.append((id_key(event_id), event_id, topic, event, data))
+            self.condition.notify_all()
+
+    def last_id(self):
+        with self.condition:
+            return self.recent[-1][1] if self.recent else self.floor_id
+
+    def since(self, last_id):
+        """Events after `last_id`, or None when it has fallen out of the replay ring."""
+        with self.condition:
+            if last_id is None: return []
+            key = id_key(last_id)
+            if key is None: return None
+            if key < self.floor: return None
+            newer = []
+            for entry in reversed(self.recent): # Usually only the last few entries are new
+                if entry[0] <= key: break
+                newer.append(entry[1:])
+            newer.reverse()
+            return newer
+
+    def wait(self, last_id, timeout):
+        """Blocks up to `timeout` seconds for events after `last_id`."""
+        self.ensure_started()
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                events = self.since(last_id)
+                if events is None or events: return events
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: return []
+                self.condition.wait(remaining)
+
+
+def create_broker():
+    size = getattr(settings, 'PUSH_REPLAY_SIZE', 1000)
+    url = getattr(settings, 'PUSH_REDIS_URL', None)
+    return Broker(RedisStreamBackend(url, maxlen=size * 10) if url else MemoryBackend(), replay_size=size)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None: _broker = create_broker()
+    return _broker
+
+
+def publish_on_commit(topic, event, data):
+    """Publishes once the surrounding transaction commits, so kiosks never see rolled-back changes."""
+    transaction.on_commit(lambda: broker().publish(topic, event, data))
+
+
+def publish_book_status(books):
+    """`book.status` for each changed copy: [{id, isbn, barcode_id, status}]."""
+    changes = [{'id': b.id, 'isbn': b.isbn, 'barcode_id': b.barcode_id, 'status': b.status} for b in books]
+    if changes: publish_on_commit('books', 'book.status', changes)
+
+
+# ------------------------------------------------------------------
+# Server-Sent Events endpoint
+# ------------------------------------------------------------------
+
+def sse(event_id, event, data):
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+def event_stream(request):
+    """
+    GET /api/push/stream?topics=alerts,books — text/event-stream of
+    `alert.*`, `event.*` and `book.status` messages. Browsers resume with
+    the Last-Event-ID header (or ?last_event_id=); when that is too old a
+    `resync` event tells the kiosk to reload over REST. Connections close
+    after PUSH_MAX_STREAM_SECONDS and the EventSource reconnects.
+    """
+    topics = {t for t in request.GET.get('topics', ','.join(TOPICS)).split(',') if t in TOPICS}
+    last_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    hub = broker()
+    heartbeat = getattr(settings, 'PUSH_HEARTBEAT_SECONDS', 15)
+    lifetime = getattr(settings, 'PUSH_MAX_STREAM_SECONDS', 300)
+
+    def stream():
+        nonlocal last_id
+        yield 'retry: 3000\n\n'
+        if last_id is None: last_id = hub.last_id()
+        closes_at = time.monotonic() + lifetime
+        while time.monotonic() < closes_at:
+            events = hub.wait(last_id, min(heartbeat, max(closes_at - time.monotonic(), 0)))
+            if events is None:
+                last_id = hub.last_id()
+                yield sse(last_id, 'resync', {})
+                continue
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            for event_id, topic, event, data in events:
+                last_id = event_id
+                if topic in topics: yield sse(event_id, event, data)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # Nginx: flush each event
+    return response
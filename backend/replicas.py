@@ -0,0 +1,82 @@
+import hashlib
+import random
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+# Viewset actions served from a replica unless the viewset lists its own `replica_actions`
+READ_ACTIONS = ('list', 'retrieve')
+
+_state = threading.local()
+
+
+class ReplicaRouter:
+    """
+    Reads go to a replica while ReplicaMiddleware has marked the current
+    request as a read-only viewset action; everything else, and every read
+    inside a transaction, stays on `default`. The first write of a request
+    moves its remaining reads back to the primary.
+    """
+    def db_for_read(self, model, **hints):
+        alias = getattr(_state, 'replica', None)
+        if alias and not connections['default'].in_atomic_block: return alias
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        _state.replica = None
+        _state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+def client_key(request):
+    """Who to pin after a write: the API token, else the session, else the address."""
+    identity = (
+        request.headers.get('Authorization')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        or request.META.get('REMOTE_ADDR', '')
+    )
+    return 'db-pin:' + hashlib.sha1(identity.encode()).hexdigest()
+
+
+def read_only_action(view_func, request):
+    actions = getattr(view_func, 'actions', None) # Set on DRF viewset views by as_view()
+    if not actions: return False
+    action = actions.get(request.method.lower())
+    return action in getattr(view_func.cls, 'replica_actions', READ_ACTIONS)
+
+
+class ReplicaMiddleware:
+    """
+    Routes read-only viewset actions to one of DATABASE_REPLICAS. After a
+    request writes, its client is pinned to the primary for
+    REPLICA_PIN_SECONDS (in the shared cache) so it reads its own writes
+    despite replication lag.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.replica, _state.wrote = None, False
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = _state.wrote
+            _state.replica, _state.wrote = None, False
+        if wrote and settings.DATABASE_REPLICAS:
+            cache.set(client_key(request), 1, settings.REPLICA_PIN_SECONDS)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or not read_only_action(view_func, request): return None
+        if cache.get(client_key(request)): return None
+        _state.replica = random.choice(replicas)
+        return None
@@ -18,3 +18,193 @@ ALTER TABLE backend_patron ALTER COLUMN total_paid TYPE DECIMAL(10, 2);
 
 -- Ensure transaction precision matches
 ALTER TABLE backend_transaction ALTER COLUMN amount TYPE DECIMAL(10, 2);
+
+-- Full-text catalog search (CatalogSearchFilter)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+ALTER TABLE backend_book ADD COLUMN search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION backend_book_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.author, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.series, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(NEW.subjects::text, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(NEW.publisher, '')), 'C') ||
+        setweight(to_tsvector('english', coalesce(NEW.summary, '')), 'D');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER backend_book_search_vector
+    BEFORE INSERT OR UPDATE OF title, author, series, publisher, summary, subjects
+    ON backend_book FOR EACH ROW EXECUTE FUNCTION backend_book_search_vector_update();
+
+CREATE INDEX backend_book_search_vector_gin ON backend_book USING GIN (search_vector);
+CREATE INDEX backend_book_title_trgm ON backend_book USING GIN (title gin_trgm_ops);
+CREATE INDEX backend_book_author_trgm ON backend_book USING GIN (author gin_trgm_ops);
+
+-- Backfill existing rows through the trigger
+UPDATE backend_book SET title = title;
+
+-- Open Library lookups cached by ISBN (a null payload is a negative entry)
+CREATE TABLE backend_isbnmetadatacache (
+    id BIGSERIAL PRIMARY KEY,
+    isbn VARCHAR(13) NOT NULL UNIQUE,
+    payload JSONB NULL,
+    fetched_at TIMESTAMPTZ NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX backend_isbnmetadatacache_expires_at ON backend_isbnmetadatacache (expires_at);
+
+-- Bulk catalog imports, resumable from their last committed chunk
+CREATE TABLE backend_importjob (
+    id BIGSERIAL PRIMARY KEY,
+    file_name VARCHAR(255) NOT NULL,
+    file_path VARCHAR(500) NOT NULL,
+    format VARCHAR(10) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'PENDING',
+    "offset" BIGINT NOT NULL DEFAULT 0,
+    records_read INTEGER NOT NULL DEFAULT 0,
+    imported INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    errors JSONB NOT NULL DEFAULT '[]',
+    message TEXT NULL,
+    created_by VARCHAR(150) NULL,
+    created_at TIMESTAMPTZ NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL,
+    finished_at TIMESTAMPTZ NULL
+);
+
+-- Patron photos and the logo live in MediaStorage; rows keep the storage keys
+ALTER TABLE backend_patron ADD COLUMN photo_key VARCHAR(255);
+ALTER TABLE backend_patron ADD COLUMN photo_thumb_key VARCHAR(255);
+ALTER TABLE backend_systemconfiguration ADD COLUMN logo_key VARCHAR(255);
+
+-- Fines already charged per loan, and partial indexes over open loans only
+ALTER TABLE backend_loan ADD COLUMN fine_accrued DECIMAL(8, 2) NOT NULL DEFAULT 0.00;
+CREATE INDEX loan_open_due_idx ON backend_loan (due_date, id) WHERE returned_at IS NULL;
+CREATE INDEX loan_open_book_idx ON backend_loan (book_id) WHERE returned_at IS NULL;
+CREATE INDEX loan_open_patron_idx ON backend_loan (patron_id) WHERE returned_at IS NULL;
+
+-- Hold queue order per copy, and the shelf-expiry sweep
+CREATE INDEX hold_queue_idx ON backend_hold (book_id, created_at);
+CREATE INDEX hold_shelf_expiry_idx ON backend_hold (expires_at) WHERE is_active;
+
+-- Incremental dashboard rollups (AnalyticsService.refresh)
+CREATE TABLE backend_analyticswatermark (
+    id BIGSERIAL PRIMARY KEY,
+    source VARCHAR(50) NOT NULL UNIQUE,
+    value TIMESTAMPTZ NOT NULL,
+    refreshed_at TIMESTAMPTZ NOT NULL
+);
+CREATE TABLE backend_dailytitlestat (
+    id BIGSERIAL PRIMARY KEY,
+    date DATE NOT NULL,
+    book_id BIGINT NOT NULL REFERENCES backend_book (id) DEFERRABLE INITIALLY DEFERRED,
+    loans INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (date, book_id)
+);
+CREATE INDEX backend_dailytitlestat_book_id ON backend_dailytitlestat (book_id);
+CREATE TABLE backend_dailyclassstat (
+    id BIGSERIAL PRIMARY KEY,
+    date DATE NOT NULL,
+    class_name VARCHAR(100) NOT NULL DEFAULT '',
+    loans INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (date, class_name)
+);
+CREATE TABLE backend_dailyrevenuestat (
+    id BIGSERIAL PRIMARY KEY,
+    date DATE NOT NULL,
+    type VARCHAR(30) NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    total DECIMAL(12, 2) NOT NULL DEFAULT 0.00,
+    UNIQUE (date, type)
+);
+CREATE TABLE backend_dailyoverduesnapshot (
+    id BIGSERIAL PRIMARY KEY,
+    date DATE NOT NULL UNIQUE,
+    overdue_loans INTEGER NOT NULL DEFAULT 0,
+    overdue_patrons INTEGER NOT NULL DEFAULT 0,
+    taken_at TIMESTAMPTZ NOT NULL
+);
+
+-- Ledger history and running balances per patron
+CREATE INDEX txn_patron_history_idx ON backend_transaction (patron_id, timestamp, id);
+
+-- Stocktake sessions and their scans
+CREATE TABLE backend_inventorysession (
+    id BIGSERIAL PRIMARY KEY,
+    name VARCHAR(255) NULL,
+    shelf_location VARCHAR(50) NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'OPEN',
+    started_by VARCHAR(150) NULL,
+    started_at TIMESTAMPTZ NOT NULL,
+    closed_at TIMESTAMPTZ NULL,
+    scanned INTEGER NOT NULL DEFAULT 0,
+    unknown INTEGER NOT NULL DEFAULT 0,
+    misplaced INTEGER NOT NULL DEFAULT 0,
+    missing INTEGER NOT NULL DEFAULT 0,
+    marked_lost INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE backend_inventoryscan (
+    id BIGSERIAL PRIMARY KEY,
+    session_id BIGINT NOT NULL REFERENCES backend_inventorysession (id) DEFERRABLE INITIALLY DEFERRED,
+    barcode_id VARCHAR(50) NOT NULL,
+    book_id BIGINT NULL REFERENCES backend_book (id) DEFERRABLE INITIALLY DEFERRED,
+    shelf_location VARCHAR(50) NOT NULL,
+    previous_shelf VARCHAR(50) NULL,
+    scanned_at TIMESTAMPTZ NOT NULL,
+    CONSTRAINT inventory_scan_once UNIQUE (session_id, barcode_id)
+);
+CREATE INDEX backend_inventoryscan_book_id ON backend_inventoryscan (book_id);
+
+-- Delta-sync change log and offline mutation replay
+CREATE TABLE backend_changelog (
+    seq BIGSERIAL PRIMARY KEY,
+    model VARCHAR(30) NOT NULL,
+    object_id BIGINT NOT NULL,
+    changed_at TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX changelog_object_idx ON backend_changelog (model, object_id, seq);
+CREATE TABLE backend_syncmutation (
+    id BIGSERIAL PRIMARY KEY,
+    client_id VARCHAR(64) NOT NULL UNIQUE,
+    type VARCHAR(10) NOT NULL,
+    payload JSONB NOT NULL,
+    status VARCHAR(10) NOT NULL,
+    result JSONB NOT NULL,
+    device VARCHAR(100) NULL,
+    performed_at TIMESTAMPTZ NULL,
+    applied_at TIMESTAMPTZ NOT NULL,
+    applied_by VARCHAR(150) NULL
+);
+
+-- Title / copy split: a Title per ISBN, many Book copies per Title (keyed by barcode_id)
+CREATE TABLE backend_title (
+    id BIGSERIAL PRIMARY KEY,
+    isbn VARCHAR(13) NOT NULL UNIQUE,
+    title VARCHAR(255) NOT NULL,
+    copy_count INTEGER NOT NULL DEFAULT 0,
+    available_count INTEGER NOT NULL DEFAULT 0,
+    loaned_count INTEGER NOT NULL DEFAULT 0,
+    hold_count INTEGER NOT NULL DEFAULT 0
+);
+ALTER TABLE backend_book DROP CONSTRAINT IF EXISTS backend_book_isbn_key;
+ALTER TABLE backend_book ADD COLUMN record_id BIGINT NULL
+    REFERENCES backend_title (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX book_title_copies_idx ON backend_book (record_id, id);
+
+-- Then fold the existing rows into titles and fill the counters:
+--   python manage.py fold_titles [--merge stand-in-isbns.csv]
+
+-- Circulation rules carry their edit time; workers reload their rule copy when it moves
+ALTER TABLE backend_circulationrule ADD COLUMN updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+-- Sync feed positions are handed out after commit (ChangeLog.sequence), not at insert
+ALTER TABLE backend_changelog RENAME COLUMN seq TO id;
+ALTER TABLE backend_changelog ADD COLUMN seq BIGINT NULL UNIQUE;
+UPDATE backend_changelog SET seq = id;
+DROP INDEX IF EXISTS changelog_object_idx;
+CREATE INDEX changelog_object_idx ON backend_changelog (model, object_id, seq);
+CREATE INDEX changelog_unsequenced_idx ON backend_changelog (id) WHERE seq IS NULL;
@@ -0,0 +1,53 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import Exists, F, OuterRef, Q
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+
+class CatalogSearchFilter(filters.SearchFilter):
+    """
+    Catalog search for the kiosk and desk.
+
+    On PostgreSQL this matches against the trigger-maintained
+    Book.search_vector (GIN indexed, see schema.sql) and falls back to
+    pg_trgm word similarity on title/author so typos still hit. Results are
+    ranked unless the client asked for an explicit ordering. Single-token
+    queries that exactly match an ISBN or barcode short-circuit to that copy.
+    Other databases use DRF's icontains search over `search_fields`.
+    """
+    search_config = 'english'
+
+    def filter_queryset(self, request, queryset, view):
+        terms = ' '.join(self.get_search_terms(request)).strip()
+        if not terms: return queryset
+
+        if ' ' not in terms:
+            exact = queryset.filter(Q(isbn=terms.replace('-', '')) | Q(barcode_id=terms))
+            if exact.exists(): return exact
+
+        if connections[queryset.db].vendor != 'postgresql':
+            return super().filter_queryset(request, queryset, view)
+
+        query = SearchQuery(terms, config=self.search_config, search_type='websearch')
+        queryset = queryset.annotate(rank=SearchRank(F('search_vector'), query)).filter(
+            Q(search_vector=query)
+            | Q(title__trigram_word_similar=terms)
+            | Q(author__trigram_word_similar=terms)
+        )
+        if request.query_params.get(api_settings.ORDERING_PARAM): return queryset
+        return queryset.order_by('-rank', '-id')
+
+
+class TitleGroupFilter(filters.BaseFilterBackend):
+    """
+    One catalog row per title: of the copies that passed the preceding
+    filters, only the first (lowest id) of each title is kept, so an exact
+    barcode search still returns that copy. `?copies=true` lists every copy.
+    Uses the (record, id) index; copies not yet folded into a title stay.
+    """
+    def filter_queryset(self, request, queryset, view):
+        if getattr(view, 'action', None) != 'list' or request.query_params.get('copies') in ('1', 'true'):
+            return queryset
+        earlier = queryset.filter(record_id=OuterRef('record_id'), id__lt=OuterRef('id'))
+        return queryset.filter(~Exists(earlier))
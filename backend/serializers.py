@@ -1,53 +1,232 @@
 
+from django.db import transaction
 from rest_framework import serializers
-from .models import Book, Patron, Loan, CirculationRule, LibraryEvent, SystemAlert, SystemConfiguration, LibraryClass, Hold, Transaction
+from .images import PATRON_SIZES, delete_images, image_url, is_data_url, store_image
+from .models import Book, Patron, Loan, CirculationRule, LibraryEvent, SystemAlert, SystemConfiguration, LibraryClass, Hold, Transaction, ImportJob, InventorySession
+from .wayfinding import ShelfIndex
+
+class SparseFieldsetMixin:
+    """
+    Client-driven field selection on reads. `?fields=a,b` keeps only the named
+    fields (plus id). Summary serializers drop `Meta.summary_exclude` by
+    default and `?expand=c,d` brings any of those back.
+    `model_columns()` reports the columns the kept fields read, so views
+    can load rows with .only().
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        params = request.query_params if request is not None and request.method in ('GET', 'HEAD') else {}
+        requested = {f.strip() for f in params.get('fields', '').split(',') if f.strip()}
+        if requested:
+            keep = requested | {'id'}
+        else:
+            expand = {f.strip() for f in params.get('expand', '').split(',') if f.strip()}
+            keep = set(self.fields) - (set(getattr(self.Meta, 'summary_exclude', [])) - expand)
+        for name in set(self.fields) - keep:
+            self.fields.pop(name)
+
+    def model_columns(self):
+        concrete = {f.name for f in self.Meta.model._meta.concrete_fields}
+        sources = getattr(self.Meta, 'column_sources', {})
+        columns = {'id'}
+        for name, field in self.fields.items():
+            columns.update(c for c in sources.get(name, [field.source]) if c in concrete)
+        return columns
 
 class SystemConfigSerializer(serializers.ModelSerializer):
+    """
+    The logo itself is served by the cacheable system-config/logo endpoint;
+    only its presence is reported here.
+    """
+    has_logo = serializers.SerializerMethodField()
+
     class Meta:
         model = SystemConfiguration
-        fields = ['logo', 'map_data', 'last_updated']
+        fields = ['map_data', 'last_updated', 'has_logo']
 
-class LibraryClassSerializer(serializers.ModelSerializer):
+    def get_has_logo(self, obj):
+        return bool(obj.logo or obj.logo_key)
+
+class LibraryClassSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = LibraryClass
         fields = '__all__'
 
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Book
+        exclude = ['search_vector']
+        read_only_fields = ['record'] # Follows the ISBN (Book.save)
+
+class BookListSerializer(BookSerializer):
+    """
+    Catalog rows: one copy standing for its title, with the title's live
+    counters (annotated by CatalogViewSet). `?expand=location` adds each
+    book's shelf and level from the compiled map.
+    """
+    copy_count = serializers.IntegerField(read_only=True)
+    available_count = serializers.IntegerField(read_only=True)
+    loaned_count = serializers.IntegerField(read_only=True)
+    hold_count = serializers.IntegerField(read_only=True)
+    location = serializers.SerializerMethodField()
+
+    class Meta(BookSerializer.Meta):
+        summary_exclude = ['marc_metadata', 'summary', 'subjects', 'location']
+        column_sources = {'location': ['ddc_code', 'shelf_location']}
+
+    def get_location(self, obj):
+        if not hasattr(self, 'shelf_index'): self.shelf_index = ShelfIndex.current()
+        return self.shelf_index.locate(obj.ddc_code, obj.shelf_location)
+
+class BookImportSerializer(BookSerializer):
+    """
+    Field validation for bulk imports. Uniqueness is settled by the upsert
+    itself, so the per-row UniqueValidator queries are dropped.
+    """
+    class Meta(BookSerializer.Meta):
+        extra_kwargs = {'isbn': {'validators': []}, 'barcode_id': {'validators': []}}
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        exclude = ['file_path']
+
+class InventorySessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = InventorySession
         fields = '__all__'
+        read_only_fields = [
+            'status', 'started_by', 'started_at', 'closed_at', 'scanned', 'unknown', 'misplaced', 'missing', 'marked_lost',
+        ]
+
+class PatronSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """
+    `photo_url` accepts a data URL on write; the image is resized into
+    MediaStorage and only the keys are kept on the row. On read it is the
+    stored image's URL, with `photo_thumb_url` for list views.
+    """
+    photo_url = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    photo_thumb_url = serializers.SerializerMethodField()
 
-class PatronSerializer(serializers.ModelSerializer):
     class Meta:
         model = Patron
-        fields = '__all__'
+        exclude = ['photo_key', 'photo_thumb_key']
+        column_sources = {'photo_url': ['photo_url', 'photo_key'], 'photo_thumb_url': ['photo_thumb_key']}
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if 'photo_url' in data and instance.photo_key: data['photo_url'] = image_url(instance.photo_key, self.context.get('request'))
+        return data
+
+    def get_photo_thumb_url(self, obj):
+        return image_url(obj.photo_thumb_key, self.context.get('request'))
+
+    def create(self, validated_data):
+        self.store_photo(validated_data)
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        stale = self.store_photo(validated_data, instance)
+        instance = super().update(instance, validated_data)
+        if stale: transaction.on_commit(lambda: delete_images(*stale))
+        return instance
+
+    def store_photo(self, validated_data, instance=None):
+        """Swaps a posted data URL for storage keys; returns keys made obsolete."""
+        if 'photo_url' not in validated_data: return []
+        photo = validated_data['photo_url']
+        current = [instance.photo_key, instance.photo_thumb_key] if instance and instance.photo_key else []
+        if is_data_url(photo):
+            try:
+                keys = store_image(photo, 'patrons', PATRON_SIZES)
+            except Exception:
+                raise serializers.ValidationError({'photo_url': 'Photo must be a PNG, JPEG, WebP or GIF image.'})
+            validated_data.update(photo_url=None, photo_key=keys['full'], photo_thumb_key=keys['thumb'])
+            return current
+        if photo and current:
+            validated_data.pop('photo_url') # Echo of the stored image's URL: unchanged
+            return []
+        validated_data.update(photo_url=photo or None, photo_key=None, photo_thumb_key=None)
+        return current
+
+class PatronListSerializer(PatronSerializer):
+    class Meta(PatronSerializer.Meta):
+        summary_exclude = ['photo_url']
+
+class BookSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Book
+        fields = ['id', 'isbn', 'title', 'author', 'barcode_id', 'cover_url', 'material_type', 'status']
+
+class AccountLoanSerializer(serializers.ModelSerializer):
+    book = BookSummarySerializer()
+    is_overdue = serializers.BooleanField()
+    days_overdue = serializers.IntegerField()
+    accruing = serializers.DecimalField(max_digits=8, decimal_places=2)
+
+    class Meta:
+        model = Loan
+        fields = ['id', 'book', 'issued_at', 'due_date', 'renewal_count', 'fine_accrued', 'is_overdue', 'days_overdue', 'accruing']
+
+class AccountHoldSerializer(serializers.ModelSerializer):
+    book = BookSummarySerializer()
+    position = serializers.IntegerField()
+
+    class Meta:
+        model = Hold
+        fields = ['id', 'book', 'created_at', 'expires_at', 'is_active', 'position']
+
+class PatronAccountSerializer(PatronSerializer):
+    """
+    A patron with everything the desk shows, from AccountService.accounts:
+    `balance` is `fines` plus `accruing`, the fines building up on overdue
+    items not yet charged by the nightly accrual.
+    """
+    loans = AccountLoanSerializer(source='open_loans', many=True)
+    holds = AccountHoldSerializer(source='current_holds', many=True)
+    loans_out = serializers.IntegerField()
+    overdue_count = serializers.IntegerField()
+    accruing = serializers.DecimalField(max_digits=8, decimal_places=2)
+    balance = serializers.DecimalField(max_digits=8, decimal_places=2)
+
+    class Meta(PatronSerializer.Meta):
+        exclude = None
+        fields = [
+            'id', 'student_id', 'full_name', 'patron_group', 'class_name', 'is_blocked', 'photo_thumb_url',
+            'fines', 'accruing', 'balance', 'loans_out', 'overdue_count', 'loans', 'holds',
+        ]
 
 class LoanSerializer(serializers.ModelSerializer):
     class Meta:
         model = Loan
         fields = '__all__'
 
-class HoldSerializer(serializers.ModelSerializer):
+class HoldSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Hold
         fields = '__all__'
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = '__all__'
 
-class CirculationRuleSerializer(serializers.ModelSerializer):
+class TransactionListSerializer(TransactionSerializer):
+    class Meta(TransactionSerializer.Meta):
+        summary_exclude = ['note']
+
+class CirculationRuleSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = CirculationRule
         fields = '__all__'
 
-class LibraryEventSerializer(serializers.ModelSerializer):
+class LibraryEventSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = LibraryEvent
         fields = '__all__'
 
-class SystemAlertSerializer(serializers.ModelSerializer):
+class SystemAlertSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = SystemAlert
         fields = '__all__'
@@ -1,48 +1,131 @@
 
+import hashlib
 import requests
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, Count, DecimalField, F, Max, Min, OuterRef, Prefetch, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .models import (
+    Book, Patron, Loan, Hold, CirculationRule, ISBNMetadataCache, SystemConfiguration, Transaction, ChangeLog, Title
+)
+from .kiosk import invalidate_on_commit
+from .labels import card_fields, spine_fields
+from .push import publish_book_status
+from .serializers import SystemConfigSerializer
 
 class CatalogingService:
+    _session = None
+    _session_lock = threading.Lock()
+
+    @classmethod
+    def http(cls):
+        """
+        Shared keep-alive session for Open Library so repeated lookups reuse
+        pooled connections instead of paying a TLS handshake each time.
+        """
+        if cls._session is None:
+            with cls._session_lock:
+                if cls._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=4, pool_maxsize=settings.METADATA_FETCH_WORKERS,
+                        max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+                    )
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    cls._session = session
+        return cls._session
+
     @staticmethod
-    def fetch_book_metadata(isbn):
-        try:
-            url = f"https://openlibrary.org/api/books?bibkeys=ISBN:{isbn}&format=json&jscmd=data"
-            response = requests.get(url, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                key = f"ISBN:{isbn}"
-                if key in data:
-                    book_data = data[key]
-                    return {
-                        'isbn': isbn,
-                        'title': book_data.get('title', 'Unknown Title'),
-                        'author': book_data.get('authors', [{'name': 'Unknown'}])[0]['name'],
-                        'cover_url': book_data.get('cover', {}).get('medium'),
-                        'marc_metadata': book_data,
-                        'ddc_code': book_data.get('identifiers', {}).get('dewey_decimal', ['000.0'])[0]
-                    }
-        except Exception as e:
-            print(f"External Fetch Error: {e}")
-        return None
+    def normalize_metadata(isbn, book_data):
+        return {
+            'isbn': isbn,
+            'title': book_data.get('title', 'Unknown Title'),
+            'author': book_data.get('authors', [{'name': 'Unknown'}])[0]['name'],
+            'cover_url': book_data.get('cover', {}).get('medium'),
+            'marc_metadata': book_data,
+            'ddc_code': book_data.get('identifiers', {}).get('dewey_decimal', ['000.0'])[0]
+        }
+
+    @classmethod
+    def fetch_remote(cls, isbns):
+        """
+        One multi-bibkey Open Library request. Returns {isbn: metadata or None}
+        for every requested ISBN; raises on transport or HTTP errors.
+        """
+        response = cls.http().get(
+            f"{settings.OPEN_LIBRARY_URL}/api/books",
+            params={'bibkeys': ','.join(f"ISBN:{isbn}" for isbn in isbns), 'format': 'json', 'jscmd': 'data'},
+            timeout=settings.METADATA_FETCH_TIMEOUT,
+        )
+        response.raise_for_status()
+        data = response.json()
+        return {
+            isbn: cls.normalize_metadata(isbn, data[f"ISBN:{isbn}"]) if f"ISBN:{isbn}" in data else None
+            for isbn in isbns
+        }
+
+    @classmethod
+    def fetch_many(cls, isbns):
+        """
+        Resolves a list of ISBNs, cache first. Misses are fetched in
+        multi-bibkey chunks concurrently on the shared session, then both hits
+        and confirmed not-founds are written back to ISBNMetadataCache.
+        Chunks that fail in transit are reported as None but not cached.
+        """
+        isbns = list(dict.fromkeys(i.strip().replace('-', '') for i in isbns if i and i.strip()))
+        now = timezone.now()
+        results = {
+            entry.isbn: entry.payload for entry in
+            ISBNMetadataCache.objects.filter(isbn__in=isbns, expires_at__gt=now)
+        }
+        missing = [isbn for isbn in isbns if isbn not in results]
+        if not missing: return results
+
+        size = settings.METADATA_BATCH_SIZE
+        chunks = [missing[i:i + size] for i in range(0, len(missing), size)]
+        fetched = {}
+        with ThreadPoolExecutor(max_workers=min(len(chunks), settings.METADATA_FETCH_WORKERS)) as pool:
+            futures = {pool.submit(cls.fetch_remote, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                try:
+                    fetched.update(future.result())
+                except Exception as e:
+                    print(f"External Fetch Error: {e}")
+                    results.update(dict.fromkeys(futures[future]))
+
+        if fetched:
+            found_ttl = timedelta(days=settings.METADATA_CACHE_TTL_DAYS)
+            missing_ttl = timedelta(hours=settings.METADATA_NEGATIVE_TTL_HOURS)
+            ISBNMetadataCache.objects.bulk_create(
+                [
+                    ISBNMetadataCache(
+                        isbn=isbn, payload=payload, fetched_at=now,
+                        expires_at=now + (found_ttl if payload else missing_ttl),
+                    )
+                    for isbn, payload in fetched.items()
+                ],
+                update_conflicts=True, unique_fields=['isbn'], update_fields=['payload', 'fetched_at', 'expires_at'],
+            )
+            results.update(fetched)
+        return results
+
+    @classmethod
+    def fetch_book_metadata(cls, isbn):
+        return cls.fetch_many([isbn]).get(isbn.strip().replace('-', ''))
 
     @staticmethod
     def generate_zpl(book):
-        def get_field(obj, field):
-            if isinstance(obj, dict): return obj.get(field, '')
-            return getattr(obj, field, '')
-
-        author = get_field(book, 'author')
-        ddc_code = get_field(book, 'ddc_code')
-        barcode_id = get_field(book, 'barcode_id')
-        author_short = author[:3].upper() if author else "UNK"
-        
-        if ddc_code and '.' in ddc_code:
-            parts = ddc_code.split('.')
-            ddc_main = parts[0]
-            ddc_sub = '.' + parts[1]
-        else:
-            ddc_main = ddc_code if ddc_code else "000"
-            ddc_sub = ""
-        
+        ddc_main, ddc_sub, author_short, barcode_id = spine_fields(book)
         return f"""^XA
 ^FO30,30^A0N,30,30^FD{ddc_main}^FS
 ^FO30,65^A0N,30,30^FD{ddc_sub}^FS
@@ -56,9 +139,7 @@ class CatalogingService:
         Generates ZPL code for CR80 PVC Identity Cards.
         Optimized for 300dpi Zebra card printers.
         """
-        name = getattr(patron, 'full_name', 'Unknown Patron')
-        group = getattr(patron, 'patron_group', 'STUDENT')
-        pid = getattr(patron, 'student_id', '000000')
+        name, group, pid = card_fields(patron)
 
         return f"""^XA
 ^CI28
@@ -68,3 +149,619 @@ class CatalogingService:
 ^FO40,225^A0N,30,30^FD{group}^FS
 ^FO40,300^BCN,100,Y,N,N^FD{pid}^FS
 ^XZ"""
+
+QUEUE_LENGTH = Coalesce(F('queue_length'), 0)
+
+class CirculationRuleCache:
+    """
+    Process-local copy of the CirculationRule table keyed by
+    (patron_group, material_type). `rules()` reads the table's stamp (row
+    count and newest `updated_at`, one aggregate over a handful of rows)
+    and reloads when it moved, so a rule edited through any worker applies
+    on every worker from its next batch. Batches call `rules()` once and
+    pass the table to `resolve`.
+    """
+    DEFAULT_LOAN_DAYS = 14
+    DEFAULT_FINE_PER_DAY = Decimal('0.50')
+
+    _table = (None, {}) # (stamp, rules)
+    _lock = threading.Lock()
+
+    @classmethod
+    def rules(cls):
+        stamp = tuple(CirculationRule.objects.aggregate(n=Count('id'), at=Max('updated_at')).values())
+        if stamp != cls._table[0]:
+            with cls._lock:
+                if stamp != cls._table[0]:
+                    cls._table = (stamp, {(r.patron_group, r.material_type): r for r in CirculationRule.objects.all()})
+        return cls._table[1]
+
+    @classmethod
+    def resolve(cls, patron_group, material_type, rules=None):
+        """
+        Returns the matching rule from `rules` (default: a fresh `rules()`),
+        or an unsaved fallback carrying the library-wide defaults (14 days,
+        0.50/day, no item limit).
+        """
+        rule = (cls.rules() if rules is None else rules).get((patron_group, material_type))
+        if rule is None:
+            rule = CirculationRule(
+                patron_group=patron_group, material_type=material_type,
+                loan_days=cls.DEFAULT_LOAN_DAYS, max_items=None,
+                fine_per_day=cls.DEFAULT_FINE_PER_DAY,
+            )
+        return rule
+
+class SystemConfigCache:
+    """
+    Serialized SystemConfiguration memoized per worker for its
+    `last_updated` stamp. Each snapshot reads only the stamp (one single-row
+    query) and reserializes when it moved, so an update_config on any worker
+    is served by every worker from its next request. Reading never writes:
+    a missing row yields the defaults.
+    """
+    _snapshot = None # (version, etag, data)
+
+    @staticmethod
+    def version(stamp):
+        return stamp.isoformat() if stamp else 'default'
+
+    @classmethod
+    def snapshot(cls):
+        stamp = SystemConfiguration.objects.filter(pk=1).values_list('last_updated', flat=True).first()
+        current = cls._snapshot
+        if current and current[0] == cls.version(stamp): return current
+
+        config = SystemConfiguration.objects.filter(pk=1).first() or SystemConfiguration()
+        version = cls.version(config.last_updated)
+        cls._snapshot = (version, cls.etag(version), SystemConfigSerializer(config).data)
+        return cls._snapshot
+
+    @staticmethod
+    def etag(version):
+        return f'"{hashlib.md5(version.encode()).hexdigest()}"'
+
+class CirculationService:
+    @staticmethod
+    def checkout_batch(patron, barcodes):
+        """
+        Issues a batch of barcodes to one patron as a single atomic unit.
+        Books, rules, holds and open-loan counts are loaded set-wise, loans are
+        written with bulk_create and book counters with a single UPDATE.
+        Returns (processed_count, errors) with errors in scan order.
+        """
+        errors = []
+        with transaction.atomic():
+            # Lock the patron row first so concurrent desks serialize on max_items.
+            patron = Patron.objects.select_for_update().get(pk=patron.pk)
+            rules = CirculationRuleCache.rules()
+            books = {
+                b.barcode_id: b for b in
+                Book.objects.select_for_update().filter(barcode_id__in=set(barcodes))
+            }
+            held_ids = [b.id for b in books.values() if b.status == 'HELD']
+            holds = {}
+            if held_ids:
+                for hold in Hold.objects.filter(book_id__in=held_ids, patron=patron, is_active=True):
+                    holds.setdefault(hold.book_id, hold)
+            open_counts = dict(
+                Loan.objects.filter(patron=patron, returned_at__isnull=True)
+                .values_list('book__material_type')
+                .annotate(n=Count('id'))
+            )
+
+            now = timezone.now()
+            loans, issued, consumed_holds = [], set(), []
+            for barcode in barcodes:
+                book = books.get(barcode)
+                if book is None:
+                    errors.append(f"Barcode {barcode}: Not found")
+                    continue
+                if book.id in issued:
+                    errors.append(f"{book.title}: Status LOANED")
+                    continue
+                hold = None
+                if book.status != 'AVAILABLE':
+                    hold = holds.get(book.id) if book.status == 'HELD' else None
+                    if hold is None:
+                        errors.append(f"{book.title}: Status {book.status}")
+                        continue
+
+                rule = CirculationRuleCache.resolve(patron.patron_group, book.material_type, rules)
+                current = open_counts.get(book.material_type, 0)
+                if rule.max_items is not None and current >= rule.max_items:
+                    errors.append(f"{book.title}: Loan limit reached ({rule.max_items})")
+                    continue
+
+                if hold: consumed_holds.append((hold.id, book.record_id))
+                loans.append(Loan(book=book, patron=patron, due_date=now + timedelta(days=rule.loan_days)))
+                open_counts[book.material_type] = current + 1
+                issued.add(book.id)
+
+            if loans:
+                Loan.objects.bulk_create(loans)
+                Book.objects.filter(id__in=issued).update(status='LOANED', loan_count=F('loan_count') + 1)
+                ChangeLog.record(Loan, [loan.id for loan in loans])
+                ChangeLog.record(Book, issued)
+                counts = Title.moves([b for b in books.values() if b.id in issued], 'LOANED')
+                for hold_id, record_id in consumed_holds: counts[(record_id, 'hold_count')] -= 1
+                Title.shift(counts)
+                for book in books.values():
+                    if book.id in issued: book.status = 'LOANED'
+                publish_book_status([b for b in books.values() if b.id in issued])
+                invalidate_on_commit('catalog') # Kiosk pages show availability
+            if consumed_holds:
+                Hold.objects.filter(id__in=[hold_id for hold_id, _ in consumed_holds]).delete()
+                ChangeLog.record(Hold, [hold_id for hold_id, _ in consumed_holds])
+
+        return len(loans), errors
+
+    @staticmethod
+    def return_batch(barcodes, librarian_id='SYSTEM'):
+        """
+        Checks in a batch of barcodes (a desk scan or a whole book-drop bin)
+        as one atomic unit with the books and their open loans row-locked.
+        Overdue fines are added to each patron's balance with a single
+        F()-expression UPDATE and journaled as FINE_ASSESSMENT transactions;
+        the oldest queued Hold on each returned copy is activated and the
+        copy goes to the hold shelf instead of AVAILABLE.
+        Returns (results, errors): results maps barcode -> {book, fine, hold}.
+        """
+        errors, results = [], {}
+        rules = CirculationRuleCache.rules()
+        with transaction.atomic():
+            books = {
+                b.barcode_id: b for b in
+                Book.objects.select_for_update().filter(barcode_id__in=set(barcodes))
+            }
+            loans = {
+                loan.book_id: loan for loan in
+                Loan.objects.select_for_update(of=('self',)).select_related('patron')
+                .only('id', 'book_id', 'due_date', 'fine_accrued', 'patron__id', 'patron__patron_group')
+                .filter(book_id__in=[b.id for b in books.values()], returned_at__isnull=True)
+            }
+
+            now = timezone.now()
+            returned, fines, assessments, loan_fines = [], {}, [], {}
+            for barcode in barcodes:
+                book = books.get(barcode)
+                if book is None:
+                    errors.append(f"Barcode {barcode}: Not found")
+                    continue
+                if barcode in results: continue
+                fine = Decimal('0.00')
+                loan = loans.get(book.id)
+                if not loan and book.status == 'HELD':
+                    errors.append(f"{book.title}: Already on the hold shelf")
+                    continue
+                if loan:
+                    returned.append(loan.id)
+                    overdue_days = (now - loan.due_date).days
+                    if overdue_days > 0:
+                        rule = CirculationRuleCache.resolve(loan.patron.patron_group, book.material_type, rules)
+                        fine = Decimal(overdue_days) * rule.fine_per_day
+                    # The nightly accrual job may already have charged part of it
+                    loan_fines[loan.id] = fine
+                    charge = fine - loan.fine_accrued
+                    if charge > 0:
+                        fines[loan.patron_id] = fines.get(loan.patron_id, Decimal('0.00')) + charge
+                        assessments.append(Transaction(
+                            patron_id=loan.patron_id, amount=charge, type='FINE_ASSESSMENT', method='SYSTEM',
+                            librarian_id=librarian_id, book_title=book.title, timestamp=now,
+                            note=f"Overdue {overdue_days} day(s): {book.barcode_id}",
+                        ))
+                results[barcode] = {'book': book, 'fine': fine, 'hold': None}
+
+            if returned:
+                Loan.objects.filter(id__in=returned).update(returned_at=now, fine_accrued=Case(
+                    *[When(id=loan_id, then=Value(fine)) for loan_id, fine in loan_fines.items() if fine],
+                    default=F('fine_accrued'), output_field=DecimalField(max_digits=8, decimal_places=2),
+                ))
+                ChangeLog.record(Loan, returned)
+            if fines:
+                Patron.objects.filter(id__in=fines).update(fines=F('fines') + Case(
+                    *[When(id=pid, then=Value(amount)) for pid, amount in fines.items()],
+                    output_field=DecimalField(max_digits=8, decimal_places=2),
+                ))
+                Transaction.objects.bulk_create(assessments)
+                ChangeLog.record(Patron, fines)
+
+            checked_in = {r['book'].id: r for r in results.values()}
+            next_holds, hold_expiry = HoldService.hand_off([r['book'] for r in checked_in.values()], now)
+            for book_id, result in checked_in.items():
+                hold = next_holds.get(book_id)
+                result['book'].status = 'HELD' if hold else 'AVAILABLE'
+                result['book'].hold_expires_at = hold_expiry if hold else None
+                result['hold'] = hold
+            publish_book_status([r['book'] for r in checked_in.values()])
+        return results, errors
+
+class HoldError(Exception):
+    pass
+
+class HoldService:
+    """
+    Per-copy hold queues. Queued holds are `is_active=False` rows served in
+    (book, created_at) order; the head of the queue becomes the single
+    active hold while the copy sits on the hold shelf. Book.queue_length
+    counts queued holds and is only changed with F() updates under the
+    book's row lock, as are the Title counters.
+    """
+    @staticmethod
+    def next_in_queue(book_ids):
+        queued = Hold.objects.filter(book_id__in=book_ids, is_active=False).order_by('book_id', 'created_at', 'id')
+        if connections[queued.db].vendor == 'postgresql':
+            return {hold.book_id: hold for hold in queued.distinct('book_id')}
+        heads = {}
+        for hold in queued: heads.setdefault(hold.book_id, hold)
+        return heads
+
+    @classmethod
+    def hand_off(cls, books, now=None):
+        """
+        Copies that are back on the shelf go to the next queued patron (HELD)
+        or to AVAILABLE. Caller must hold the book row locks; `books` carry
+        the status they are leaving.
+        Returns ({book_id: activated hold}, pickup expiry).
+        """
+        expiry = (now or timezone.now()) + timedelta(days=settings.HOLD_PICKUP_DAYS)
+        book_ids = [book.id for book in books]
+        heads = cls.next_in_queue(book_ids) if book_ids else {}
+        if heads:
+            Hold.objects.filter(id__in=[h.id for h in heads.values()]).update(is_active=True, expires_at=expiry)
+            Book.objects.filter(id__in=heads).update(status='HELD', hold_expires_at=expiry, queue_length=Greatest(QUEUE_LENGTH - 1, 0))
+            for hold in heads.values(): hold.is_active, hold.expires_at = True, expiry
+        available = [book_id for book_id in book_ids if book_id not in heads]
+        if available:
+            Book.objects.filter(id__in=available).update(status='AVAILABLE', hold_expires_at=None)
+        counts = Title.moves([b for b in books if b.id in heads], 'HELD')
+        Title.shift(Title.moves([b for b in books if b.id not in heads], 'AVAILABLE', counts))
+        ChangeLog.record(Hold, [h.id for h in heads.values()])
+        ChangeLog.record(Book, book_ids)
+        invalidate_on_commit('catalog')
+        return heads, expiry
+
+    @classmethod
+    def place(cls, patron, book):
+        """Queues a hold, or reserves the copy straight onto the hold shelf if it is available."""
+        with transaction.atomic():
+            book = Book.objects.select_for_update().get(pk=book.pk)
+            if Hold.objects.filter(book=book, patron=patron).exists():
+                raise HoldError(f"{book.title}: Patron already holds this copy")
+            if Loan.objects.filter(book=book, patron=patron, returned_at__isnull=True).exists():
+                raise HoldError(f"{book.title}: Patron already has this copy on loan")
+            if book.status == 'AVAILABLE':
+                expiry = timezone.now() + timedelta(days=settings.HOLD_PICKUP_DAYS)
+                hold = Hold.objects.create(book=book, patron=patron, is_active=True, expires_at=expiry)
+                Book.objects.filter(pk=book.pk).update(status='HELD', hold_expires_at=expiry)
+            elif book.status in ('LOANED', 'HELD'):
+                hold = Hold.objects.create(book=book, patron=patron)
+                Book.objects.filter(pk=book.pk).update(queue_length=QUEUE_LENGTH + 1)
+            else:
+                raise HoldError(f"{book.title}: Status {book.status}")
+            counts = Title.moves([book], 'HELD') if hold.is_active else Counter()
+            counts[(book.record_id, 'hold_count')] += 1
+            Title.shift(counts)
+            ChangeLog.record(Hold, [hold.id])
+            ChangeLog.record(Book, [book.pk])
+            invalidate_on_commit('catalog')
+        return hold
+
+    @classmethod
+    def cancel(cls, hold):
+        """Removes a hold; cancelling the active one passes the copy down the queue."""
+        with transaction.atomic():
+            book = Book.objects.select_for_update().get(pk=hold.book_id)
+            deleted, _ = Hold.objects.filter(pk=hold.pk).delete()
+            if not deleted: raise HoldError('Hold no longer exists')
+            ChangeLog.record(Hold, [hold.pk])
+            Title.shift(Counter({(book.record_id, 'hold_count'): -1}))
+            invalidate_on_commit('catalog')
+            if hold.is_active:
+                if book.status == 'HELD': cls.hand_off([book])
+            else:
+                Book.objects.filter(pk=book.pk).update(queue_length=Greatest(QUEUE_LENGTH - 1, 0))
+                ChangeLog.record(Book, [book.pk])
+
+    @classmethod
+    def promote(cls, book):
+        """
+        Ends the current shelf hold (no-show) and offers the copy to the next
+        patron in the queue. Returns the newly active hold, if any.
+        """
+        with transaction.atomic():
+            book = Book.objects.select_for_update().get(pk=book.pk)
+            if book.status not in ('HELD', 'AVAILABLE'):
+                raise HoldError(f"{book.title}: Status {book.status}")
+            ended = list(Hold.objects.filter(book=book, is_active=True).values_list('id', flat=True))
+            Hold.objects.filter(id__in=ended).delete()
+            ChangeLog.record(Hold, ended)
+            Title.shift(Counter({(book.record_id, 'hold_count'): -len(ended)}))
+            heads, _ = cls.hand_off([book])
+        return heads.get(book.id)
+
+    @classmethod
+    def sweep(cls, now=None, chunk_size=500):
+        """
+        Expires shelf holds past `expires_at` and promotes the next patron on
+        each affected copy, chunk by chunk, with set-based statements only.
+        Books are locked before holds, matching check-in's lock order.
+        """
+        now = now or timezone.now()
+        stats = {'expired': 0, 'promoted': 0, 'released': 0}
+        while True:
+            book_ids = list(
+                Hold.objects.filter(is_active=True, expires_at__lt=now)
+                .order_by('expires_at').values_list('book_id', flat=True)[:chunk_size]
+            )
+            if not book_ids: break
+            with transaction.atomic():
+                on_shelf = list(
+                    Book.objects.select_for_update().filter(id__in=set(book_ids), status='HELD').only('id', 'record_id', 'status')
+                )
+                ended = dict(
+                    Hold.objects.filter(book_id__in=book_ids, is_active=True, expires_at__lt=now).values_list('id', 'book__record_id')
+                )
+                expired, _ = Hold.objects.filter(id__in=ended).delete()
+                ChangeLog.record(Hold, ended)
+                counts = Counter()
+                for record_id in ended.values(): counts[(record_id, 'hold_count')] -= 1
+                Title.shift(counts)
+                heads, _ = cls.hand_off(on_shelf, now)
+            stats['expired'] += expired
+            stats['promoted'] += len(heads)
+            stats['released'] += len(on_shelf) - len(heads)
+        return stats
+
+class LedgerError(Exception):
+    pass
+
+class LedgerService:
+    """
+    Patron money movements. Every change to Patron.fines / total_paid is
+    posted as a Transaction in the same atomic unit with F() updates, so the
+    ledger can always be replayed against the balances.
+    """
+    MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+    @classmethod
+    def signed_amount(cls, prefix=''):
+        amount = F(f'{prefix}amount')
+        return Case(
+            When(**{f'{prefix}type__in': Transaction.DEBIT_TYPES}, then=amount),
+            When(**{f'{prefix}type__in': Transaction.CREDIT_TYPES}, then=-amount),
+            default=amount, output_field=cls.MONEY,
+        )
+
+    @classmethod
+    def post_credit(cls, patron, amount, type, method, librarian_id, note=None):
+        """Records a payment or waiver and lowers the balance (payments also raise total_paid)."""
+        try:
+            amount = Decimal(str(amount)).quantize(Decimal('0.01'))
+        except ArithmeticError:
+            raise LedgerError('Invalid amount')
+        if not amount > 0: raise LedgerError('Amount must be positive')
+        with transaction.atomic():
+            outstanding = Patron.objects.select_for_update().values_list('fines', flat=True).get(pk=patron.pk)
+            if amount > outstanding: raise LedgerError(f'Amount exceeds outstanding balance of {outstanding}')
+            entry = Transaction.objects.create(
+                patron_id=patron.pk, amount=amount, type=type, method=method, librarian_id=librarian_id, note=note,
+            )
+            paid = amount if type in Transaction.PAYMENT_TYPES else Decimal('0.00')
+            Patron.objects.filter(pk=patron.pk).update(fines=F('fines') - amount, total_paid=F('total_paid') + paid)
+            ChangeLog.record(Patron, [patron.pk])
+        return entry
+
+    @classmethod
+    def running_balances(cls, patron_id, entries):
+        """
+        Balance after each entry of a newest-first page: one range SUM over
+        the (patron, timestamp, id) index up to the page's newest row.
+        """
+        if not entries: return []
+        top = entries[0]
+        balance = Transaction.objects.filter(patron_id=patron_id).filter(
+            Q(timestamp__lt=top.timestamp) | Q(timestamp=top.timestamp, id__lte=top.id)
+        ).aggregate(total=Coalesce(Sum(cls.signed_amount()), Value(Decimal('0.00')), output_field=cls.MONEY))['total']
+        balance = Decimal(str(balance)).quantize(Decimal('0.01'))
+        balances = []
+        for entry in entries:
+            balances.append(balance)
+            balance -= -entry.amount if entry.type in Transaction.CREDIT_TYPES else entry.amount
+        return balances
+
+    @classmethod
+    def drift(cls):
+        """
+        Patrons whose stored balances disagree with their ledger, computed
+        with one grouped aggregate (LEFT JOIN ... GROUP BY ... HAVING).
+        """
+        zero = Value(Decimal('0.00'))
+        paid = Case(When(transactions__type__in=Transaction.PAYMENT_TYPES, then=F('transactions__amount')), default=zero)
+        return (
+            Patron.objects.annotate(
+                ledger_fines=Coalesce(Sum(cls.signed_amount('transactions__')), zero, output_field=cls.MONEY),
+                ledger_paid=Coalesce(Sum(paid, output_field=cls.MONEY), zero, output_field=cls.MONEY),
+            )
+            .filter(~Q(fines=F('ledger_fines')) | ~Q(total_paid=F('ledger_paid')))
+            .values('id', 'student_id', 'full_name', 'fines', 'ledger_fines', 'total_paid', 'ledger_paid')
+            .order_by('id')
+        )
+
+    @classmethod
+    def reconcile(cls, post_adjustments=False, librarian_id='SYSTEM'):
+        """
+        Returns the drift report. With `post_adjustments`, balance drift is
+        booked as MANUAL_ADJUSTMENT entries (e.g. opening balances from
+        before the ledger existed) so the ledger matches what patrons owe.
+        """
+        rows = list(cls.drift())
+        if post_adjustments:
+            Transaction.objects.bulk_create([
+                Transaction(
+                    patron_id=row['id'], amount=row['fines'] - row['ledger_fines'], type='MANUAL_ADJUSTMENT',
+                    method='SYSTEM', librarian_id=librarian_id, note='Ledger reconciliation',
+                )
+                for row in rows if row['fines'] != row['ledger_fines']
+            ])
+        return rows
+
+class TitleService:
+    @staticmethod
+    def fold(merge=None, chunk_size=1000):
+        """
+        Links every copy to the Title of its ISBN, creating titles as needed,
+        then recounts all titles. `merge` maps stand-in ISBNs (class sets
+        catalogued under made-up numbers) to the real ISBN their copies
+        should take. Safe to rerun; also repairs drifted counters.
+        """
+        stats = {'merged': 0, 'linked': 0, 'titles': 0}
+        with transaction.atomic():
+            for stand_in, isbn in (merge or {}).items():
+                moved = list(Book.objects.filter(isbn=stand_in).values_list('id', flat=True))
+                stats['merged'] += Book.objects.filter(id__in=moved).update(isbn=isbn, record=None)
+                ChangeLog.record(Book, moved)
+            # Copies whose ISBN was edited by a bulk UPDATE
+            Book.objects.filter(record__isnull=False).exclude(record__isbn=F('isbn')).update(record=None)
+            loose = Book.objects.filter(record__isnull=True).exclude(isbn='')
+            Title.ensure(loose.values('isbn').annotate(name=Min('title')).values_list('isbn', 'name'))
+            stats['linked'] = loose.update(record_id=Subquery(Title.objects.filter(isbn=OuterRef('isbn')).values('id')[:1]))
+            invalidate_on_commit('catalog')
+        ids = list(Title.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(ids), chunk_size): Title.recount(ids[start:start + chunk_size])
+        stats['titles'] = len(ids)
+        return stats
+
+class AccountService:
+    """
+    Desk view of patron accounts: open loans with their books, holds with
+    queue positions, overdue flags and the balance including fines still
+    accruing on items that are out. Three queries (patrons with loan
+    aggregates, open loans, holds) whether it loads one patron or a class.
+    """
+    BOOK_SUMMARY = ['id', 'isbn', 'title', 'author', 'barcode_id', 'cover_url', 'material_type', 'status']
+
+    @classmethod
+    def queryset(cls, now):
+        book_fields = [f'book__{f}' for f in cls.BOOK_SUMMARY]
+        loans = (
+            Loan.objects.filter(returned_at__isnull=True).select_related('book')
+            .only('id', 'patron_id', 'issued_at', 'due_date', 'renewal_count', 'fine_accrued', *book_fields)
+            .order_by('due_date', 'id')
+        )
+        # Holds queued before this one on the same book (created_at, id order, as in promote)
+        ahead = (
+            Hold.objects.filter(book_id=OuterRef('book_id'))
+            .filter(Q(created_at__lt=OuterRef('created_at')) | Q(created_at=OuterRef('created_at'), id__lt=OuterRef('id')))
+            .values('book_id').annotate(n=Count('id')).values('n')
+        )
+        holds = (
+            Hold.objects.select_related('book')
+            .only('id', 'patron_id', 'created_at', 'expires_at', 'is_active', *book_fields)
+            .annotate(ahead=Coalesce(Subquery(ahead), 0))
+            .order_by('created_at', 'id')
+        )
+        out = Q(loans__returned_at__isnull=True)
+        return Patron.objects.annotate(
+            loans_out=Count('loans', filter=out),
+            overdue_count=Count('loans', filter=out & Q(loans__due_date__lt=now)),
+        ).prefetch_related(
+            Prefetch('loans', queryset=loans, to_attr='open_loans'),
+            Prefetch('holds', queryset=holds, to_attr='current_holds'),
+        )
+
+    @classmethod
+    def accounts(cls, patrons=None, now=None):
+        """Loads `patrons` (a Patron queryset filter, default all) with balances computed."""
+        now = now or timezone.now()
+        queryset = cls.queryset(now)
+        if patrons is not None: queryset = queryset.filter(pk__in=patrons.values('pk'))
+        accounts = list(queryset.order_by('full_name', 'id'))
+        rules = CirculationRuleCache.rules()
+        for patron in accounts:
+            patron.accruing = Decimal('0.00')
+            for loan in patron.open_loans:
+                loan.is_overdue = loan.due_date < now
+                loan.days_overdue = max((now - loan.due_date).days, 0)
+                rule = CirculationRuleCache.resolve(patron.patron_group, loan.book.material_type, rules)
+                loan.accruing = max(Decimal(loan.days_overdue) * rule.fine_per_day - loan.fine_accrued, Decimal('0.00'))
+                patron.accruing += loan.accruing
+            for hold in patron.current_holds: hold.position = hold.ahead + 1
+            patron.balance = patron.fines + patron.accruing
+        return accounts
+
+class FineAccrualService:
+    """
+    Nightly accrual of overdue fines on loans that are still out, so balances
+    and blocks reflect reality before items come back. Open overdue loans are
+    walked in (due_date, id) keyset chunks over the partial open-loan index.
+    Loan.fine_accrued records what has been charged so far, so each run only
+    posts the difference and reruns on the same day post nothing.
+    """
+    @staticmethod
+    def run(chunk_size=1000, as_of=None, block_threshold=None, progress=None):
+        as_of = as_of or timezone.now()
+        block_threshold = Decimal(block_threshold if block_threshold is not None else settings.FINE_BLOCK_THRESHOLD)
+        stats = {'scanned': 0, 'assessed': 0, 'amount': Decimal('0.00'), 'blocked': 0}
+        started = time.monotonic()
+        money = DecimalField(max_digits=8, decimal_places=2)
+
+        overdue = (
+            Loan.objects.filter(returned_at__isnull=True, due_date__lt=as_of - timedelta(days=1))
+            .select_related('book', 'patron')
+            .only('id', 'due_date', 'fine_accrued', 'patron_id', 'patron__patron_group',
+                  'book__title', 'book__barcode_id', 'book__material_type')
+            .order_by('due_date', 'id')
+        )
+        cursor = None
+        while True:
+            page = overdue
+            if cursor: page = page.filter(Q(due_date__gt=cursor[0]) | Q(due_date=cursor[0], id__gt=cursor[1]))
+            with transaction.atomic():
+                loans = list(page.select_for_update(of=('self',))[:chunk_size])
+                if not loans: break
+                rules = CirculationRuleCache.rules()
+                cursor = (loans[-1].due_date, loans[-1].id)
+
+                accrued, charges, assessments = {}, {}, []
+                for loan in loans:
+                    days = (as_of - loan.due_date).days
+                    rule = CirculationRuleCache.resolve(loan.patron.patron_group, loan.book.material_type, rules)
+                    target = Decimal(days) * rule.fine_per_day
+                    charge = target - loan.fine_accrued
+                    if charge <= 0: continue
+                    accrued[loan.id] = target
+                    charges[loan.patron_id] = charges.get(loan.patron_id, Decimal('0.00')) + charge
+                    # Stamped when the chunk is written, not with `as_of`: the analytics watermark
+                    # only waits SETTLE_LAG for a row, and a long run's last chunks commit much later
+                    assessments.append(Transaction(
+                        patron_id=loan.patron_id, amount=charge, type='FINE_ASSESSMENT', method='SYSTEM',
+                        librarian_id='SYSTEM', book_title=loan.book.title,
+                        note=f"Overdue {days} day(s), still out: {loan.book.barcode_id}",
+                    ))
+
+                if accrued:
+                    Loan.objects.filter(id__in=accrued).update(fine_accrued=Case(
+                        *[When(id=loan_id, then=Value(target)) for loan_id, target in accrued.items()],
+                        output_field=money,
+                    ))
+                    Patron.objects.filter(id__in=charges).update(fines=F('fines') + Case(
+                        *[When(id=pid, then=Value(amount)) for pid, amount in charges.items()],
+                        output_field=money,
+                    ))
+                    Transaction.objects.bulk_create(assessments)
+                    ChangeLog.record(Loan, accrued)
+                    ChangeLog.record(Patron, charges)
+
+            stats['scanned'] += len(loans)
+            stats['assessed'] += len(assessments)
+            stats['amount'] += sum(charges.values(), Decimal('0.00'))
+            if progress: progress(stats, stats['scanned'] / max(time.monotonic() - started, 1e-6))
+
+        with transaction.atomic():
+            blocked = list(Patron.objects.filter(is_blocked=False, fines__gte=block_threshold).values_list('id', flat=True))
+            stats['blocked'] = Patron.objects.filter(id__in=blocked).update(is_blocked=True)
+            ChangeLog.record(Patron, blocked)
+        stats['elapsed'] = time.monotonic() - started
+        stats['rows_per_sec'] = stats['scanned'] / max(stats['elapsed'], 1e-6)
+        return stats
@@ -23,6 +23,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # Full-text & trigram catalog search
     
     # Third party
     'rest_framework',
@@ -35,6 +36,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.profiling.ProfilingMiddleware', # Outermost: times the whole stack, Server-Timing + /metrics
+    'backend.replicas.ReplicaMiddleware', # Read-only viewset actions -> DATABASE_REPLICAS
     'corsheaders.middleware.CorsMiddleware', # Must be at top
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -43,6 +46,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'backend.kiosk.PublicCacheMiddleware', # Innermost: anonymous GET cache, after auth and CSRF
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -76,6 +80,55 @@ DATABASES = {
         'PORT': os.environ.get('DB_PORT', '5432'),
     }
 }
+if os.environ.get('DB_ENGINE') == 'sqlite': # Local benchmarking / development without Postgres
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+
+# Persistent connections: reuse each worker thread's connection for DB_CONN_MAX_AGE
+# seconds instead of reconnecting per request. Behind PgBouncer in transaction mode,
+# set DB_PGBOUNCER=True (server-side cursors don't survive connection switching).
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', '60'))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+if os.environ.get('DB_PGBOUNCER', 'False') == 'True':
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+# Read replicas (streaming replicas of the primary), comma-separated hosts. Read-only
+# viewset actions use them; a client that writes reads from the primary for
+# REPLICA_PIN_SECONDS afterwards. With DB_ENGINE=sqlite, DB_SQLITE_REPLICA=True adds a
+# second alias on the same file as a stand-in, so the routing can be exercised locally.
+if os.environ.get('DB_ENGINE') == 'sqlite':
+    replica_hosts = ['sqlite'] if os.environ.get('DB_SQLITE_REPLICA', 'False') == 'True' else []
+else:
+    replica_hosts = [h.strip() for h in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if h.strip()]
+DATABASE_REPLICAS = []
+for n, host in enumerate(replica_hosts, start=1):
+    replica = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    if host != 'sqlite': replica['HOST'] = host
+    DATABASES[f'replica{n}'] = replica
+    DATABASE_REPLICAS.append(f'replica{n}')
+DATABASE_ROUTERS = ['backend.replicas.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', '5'))
+
+# Cache: shared across gunicorn workers when REDIS_URL is set. Falls back to
+# per-process memory for local development; nothing that must agree across
+# workers (circulation rules, system config) depends on it.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -106,12 +159,59 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny', # Default open, specific views locked down
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'backend.pagination.LibraryPagination', # ?page= or keyset ?cursor=
     'PAGE_SIZE': 50,
     'PAGE_SIZE_QUERY_PARAM': 'page_size', # Allows client to request ?page_size=12
-    'MAX_PAGE_SIZE': 100
+    'MAX_PAGE_SIZE': 100,
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '1')), # Nginx: client address from X-Forwarded-For
 }
 
+# ==========================================
+# EXTERNAL METADATA (Open Library waterfall)
+# ==========================================
+OPEN_LIBRARY_URL = os.environ.get('OPEN_LIBRARY_URL', 'https://openlibrary.org') # Point at a stub server for tests
+METADATA_FETCH_TIMEOUT = float(os.environ.get('METADATA_FETCH_TIMEOUT', '5'))
+METADATA_FETCH_WORKERS = int(os.environ.get('METADATA_FETCH_WORKERS', '4'))
+METADATA_BATCH_SIZE = 50 # ISBNs per multi-bibkey request
+METADATA_CACHE_TTL_DAYS = int(os.environ.get('METADATA_CACHE_TTL_DAYS', '30'))
+METADATA_NEGATIVE_TTL_HOURS = int(os.environ.get('METADATA_NEGATIVE_TTL_HOURS', '24'))
+
+# Circulation: days a returned copy waits on the hold shelf for the next patron
+HOLD_PICKUP_DAYS = int(os.environ.get('HOLD_PICKUP_DAYS', '3'))
+# Outstanding fines at which the accrual job blocks further borrowing
+FINE_BLOCK_THRESHOLD = os.environ.get('FINE_BLOCK_THRESHOLD', '10.00')
+
+# Profiling: /metrics requires this bearer token when set. QUERY_BUDGET_STRICT makes
+# any view that exceeds its profiling.QUERY_BUDGETS entry raise (enable in test runs).
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', 'False') == 'True'
+
+# Kiosk push channel (SSE). With Redis, events fan out across workers through a
+# capped stream; otherwise each process has its own in-memory broker.
+PUSH_REDIS_URL = os.environ.get('PUSH_REDIS_URL', os.environ.get('REDIS_URL'))
+PUSH_REPLAY_SIZE = int(os.environ.get('PUSH_REPLAY_SIZE', '1000')) # Recent events kept for Last-Event-ID resume
+PUSH_HEARTBEAT_SECONDS = 15
+PUSH_MAX_STREAM_SECONDS = int(os.environ.get('PUSH_MAX_STREAM_SECONDS', '300'))
+
+# Public traffic (kiosks and anonymous browsing). Buckets are (burst, tokens per
+# second) per kiosk key or client address; with Redis they are shared by all workers.
+# Anonymous GETs of the catalog, events and alerts are cached for PUBLIC_CACHE_TTL
+# seconds (0 disables) and dropped on any write to them.
+THROTTLE_REDIS_URL = os.environ.get('THROTTLE_REDIS_URL', os.environ.get('REDIS_URL'))
+KIOSK_KEYS = [k for k in os.environ.get('KIOSK_KEYS', '').split(',') if k]
+KIOSK_THROTTLE_RATES = {
+    'public-ip': (60, 1.0),
+    'public-kiosk': (120, 4.0),   # A kiosk is a whole class queueing at one screen
+    'lookup-ip': (10, 0.2),       # waterfall_search can call Open Library
+    'lookup-kiosk': (30, 1.0),
+}
+PUBLIC_CACHE_TTL = int(os.environ.get('PUBLIC_CACHE_TTL', '15'))
+
+# Bulk catalog import uploads (kept on local disk so jobs can resume by offset)
+IMPORT_ROOT = os.environ.get('IMPORT_ROOT', str(BASE_DIR / 'imports'))
+# A RUNNING job that has not checkpointed for this long lost its worker and may be resumed
+IMPORT_STALE_SECONDS = int(os.environ.get('IMPORT_STALE_SECONDS', '600'))
+
 # ==========================================
 # PROXY & SECURITY CONFIGURATION
 # ==========================================
@@ -143,12 +243,15 @@ if os.environ.get('USE_S3', 'False') == 'True':
     # Static files (CSS, JavaScript, Images)
     STATIC_LOCATION = 'static'
     STATIC_URL = f'{AWS_S3_ENDPOINT_URL}/{STATIC_LOCATION}/'
-    STATICFILES_STORAGE = 'backend.storage_backends.StaticStorage'
 
-    # Media files (Uploads)
+    # Media files (Uploads: patron photos, logo, thumbnails)
     MEDIA_LOCATION = 'media'
     MEDIA_URL = f'{AWS_S3_ENDPOINT_URL}/{MEDIA_LOCATION}/'
-    DEFAULT_FILE_STORAGE = 'backend.storage_backends.MediaStorage'
+
+    STORAGES = {
+        'default': {'BACKEND': 'backend.storage_backends.MediaStorage'},
+        'staticfiles': {'BACKEND': 'backend.storage_backends.StaticStorage'},
+    }
 else:
     STATIC_URL = 'static/'
     STATIC_ROOT = BASE_DIR / 'staticfiles'
@@ -0,0 +1,121 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+
+from .models import Book, ChangeLog, CirculationRule, Hold, Loan, Patron, SyncMutation
+from .serializers import (
+    BookSerializer, CirculationRuleSerializer, HoldSerializer, LoanSerializer, PatronListSerializer,
+)
+from .services import CirculationService
+
+# ChangeLog.model -> (response key, model, serializer)
+FEEDS = {
+    'book': ('books', Book, BookSerializer),
+    'patron': ('patrons', Patron, PatronListSerializer),
+    'loan': ('loans', Loan, LoanSerializer),
+    'hold': ('holds', Hold, HoldSerializer),
+    'circulationrule': ('rules', CirculationRule, CirculationRuleSerializer),
+}
+
+
+class SyncError(Exception):
+    pass
+
+
+class SyncService:
+    """
+    Delta sync for desk clients that work offline.
+
+    `changes(since)` numbers newly committed ChangeLog rows, walks the log
+    in `seq` order, compacts each batch to one entry per object and returns
+    the objects' current state, or their id under `deleted` when they are
+    gone. Positions are only handed out after commit (ChangeLog.sequence),
+    so nothing can appear behind a cursor a client already holds.
+
+    `apply(mutations)` replays offline checkouts and returns. Each mutation
+    is recorded under its client id in the same transaction as its effect,
+    so a retried upload returns the stored outcome instead of applying twice.
+    """
+    MAX_BATCH = 1000
+
+    @classmethod
+    def changes(cls, since=0, limit=500, context=None):
+        limit = max(1, min(limit, cls.MAX_BATCH))
+        ChangeLog.sequence()
+        head = ChangeLog.objects.aggregate(head=Max('seq'))['head'] or 0
+        window = list(ChangeLog.objects.filter(seq__gt=since).order_by('seq').values_list('seq', flat=True)[limit - 1:limit])
+        upper = window[0] if window else head
+        latest = (
+            ChangeLog.objects.filter(seq__gt=since, seq__lte=upper)
+            .values('model', 'object_id').annotate(last=Max('seq'))
+        )
+        touched = {}
+        for row in latest: touched.setdefault(row['model'], set()).add(row['object_id'])
+
+        changes, deleted = {}, {}
+        for name, ids in touched.items():
+            if name not in FEEDS: continue
+            key, model, serializer = FEEDS[name]
+            objects = list(model.objects.filter(id__in=ids).order_by('id'))
+            changes[key] = serializer(objects, many=True, context=context or {}).data
+            gone = ids - {obj.id for obj in objects}
+            if gone: deleted[key] = sorted(gone)
+        return {
+            'since': since, 'next': max(upper, since), 'head': head, 'has_more': upper < head,
+            'changes': changes, 'deleted': deleted,
+        }
+
+    @classmethod
+    def apply(cls, mutations, librarian_id='SYSTEM', device=None):
+        return [cls.apply_one(mutation, librarian_id, device) for mutation in mutations]
+
+    @classmethod
+    def apply_one(cls, mutation, librarian_id, device):
+        client_id = str(mutation.get('client_id') or '').strip()
+        if not client_id: return {'client_id': None, 'status': 'REJECTED', 'duplicate': False, 'errors': ['client_id required']}
+        existing = SyncMutation.objects.filter(client_id=client_id).first()
+        if existing: return cls.outcome(existing, duplicate=True)
+
+        kind = str(mutation.get('type', '')).upper()
+        if kind not in dict(SyncMutation.TYPE_CHOICES):
+            return {'client_id': client_id, 'status': 'REJECTED', 'duplicate': False, 'errors': [f'Unknown mutation type {kind}']}
+        try:
+            with transaction.atomic():
+                record = SyncMutation.objects.create(
+                    client_id=client_id, type=kind, payload=mutation, status='REJECTED', device=device,
+                    performed_at=parse_datetime(mutation['performed_at']) if mutation.get('performed_at') else None,
+                    applied_by=librarian_id,
+                )
+                try:
+                    record.status, record.result = 'APPLIED', cls.perform(kind, mutation, librarian_id)
+                except SyncError as e:
+                    record.result = {'errors': [str(e)]}
+                record.save(update_fields=['status', 'result'])
+        except IntegrityError:
+            # Another upload of the same mutation won the race; report its outcome
+            return cls.outcome(SyncMutation.objects.get(client_id=client_id), duplicate=True)
+        return cls.outcome(record)
+
+    @staticmethod
+    def perform(kind, mutation, librarian_id):
+        barcodes = mutation.get('barcodes') or ([mutation['barcode']] if mutation.get('barcode') else [])
+        if not barcodes: raise SyncError('barcode(s) required')
+        if kind == 'CHECKOUT':
+            patron = Patron.objects.filter(student_id=mutation.get('patron_id')).first()
+            if not patron: raise SyncError('Patron not found')
+            if patron.is_blocked: raise SyncError('Patron is blocked')
+            processed, errors = CirculationService.checkout_batch(patron, barcodes)
+            if not processed: raise SyncError('; '.join(errors) or 'Nothing checked out')
+            return {'processed': processed, 'errors': errors}
+        results, errors = CirculationService.return_batch(barcodes, librarian_id=librarian_id)
+        if not results: raise SyncError('; '.join(errors) or 'Nothing returned')
+        return {
+            'processed': len(results), 'errors': errors,
+            'fines': {barcode: str(r['fine']) for barcode, r in results.items() if r['fine']},
+        }
+
+    @staticmethod
+    def outcome(record, duplicate=False):
+        return {
+            'client_id': record.client_id, 'status': record.status, 'duplicate': duplicate, **record.result,
+        }
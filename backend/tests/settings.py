@@ -0,0 +1,23 @@
+"""
+Test settings: SQLite, in-memory cache, media in a temp folder, and query
+budgets enforced so any view over its QUERY_BUDGETS entry fails the test.
+
+    python manage.py test backend --settings=backend.tests.settings
+"""
+import os
+import tempfile
+
+os.environ.setdefault('DB_ENGINE', 'sqlite')
+os.environ.setdefault('DB_SQLITE_REPLICA', 'True') # replica1 mirrors default (TEST MIRROR) for the routing tests
+os.environ.setdefault('USE_S3', 'False')
+
+from backend.settings import * # noqa: E402,F401,F403
+
+DATABASE_REPLICAS = [] # Routing is opted into per test with override_settings
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+MEDIA_ROOT = tempfile.mkdtemp(prefix='library-test-media-')
+IMPORT_ROOT = tempfile.mkdtemp(prefix='library-test-imports-')
+THROTTLE_REDIS_URL = None
+PUSH_REDIS_URL = None
+QUERY_BUDGET_STRICT = True
@@ -0,0 +1,66 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from backend.models import Book, CirculationRule, Hold, LibraryClass, Loan, Patron
+from backend.services import AccountService
+
+
+class AccountQueryCountTests(TestCase):
+    """Accounts load in the same number of queries for one patron or a whole class."""
+    @classmethod
+    def setUpTestData(cls):
+        CirculationRule.objects.create(patron_group='STUDENT', material_type='REGULAR', fine_per_day=Decimal('0.25'))
+        now = timezone.now()
+        for name, size in (('7-A', 1), ('7-B', 40)):
+            LibraryClass.objects.create(name=name)
+            patrons = Patron.objects.bulk_create([
+                Patron(student_id=f'{name}-{n}', full_name=f'Student {n}', patron_group='STUDENT', class_name=name)
+                for n in range(size)
+            ])
+            books = Book.objects.bulk_create([
+                Book(isbn=f'978{n:010d}', title=f'{name} book {n}', author='A', ddc_code='500', barcode_id=f'{name}-B{n}', status='LOANED')
+                for n in range(size * 2)
+            ])
+            Loan.objects.bulk_create(
+                [Loan(book=books[2 * n], patron=p, due_date=now + timedelta(days=7)) for n, p in enumerate(patrons)] +
+                [Loan(book=books[2 * n + 1], patron=p, due_date=now - timedelta(days=3)) for n, p in enumerate(patrons)]
+            )
+            Hold.objects.bulk_create([Hold(book=books[0], patron=p) for p in patrons])
+        cls.token = Token.objects.create(user=User.objects.create_user('librarian')).key
+
+    def count_queries(self, class_name):
+        with CaptureQueriesContext(connection) as queries:
+            accounts = AccountService.accounts(Patron.objects.filter(class_name=class_name))
+        return len(queries), accounts
+
+    def test_same_query_count_for_one_and_forty_patrons(self):
+        one, small = self.count_queries('7-A')
+        forty, large = self.count_queries('7-B')
+        self.assertEqual((len(small), len(large)), (1, 40))
+        self.assertEqual(one, forty)
+
+    def test_balances(self):
+        _, accounts = self.count_queries('7-B')
+        account = accounts[-1]
+        self.assertEqual(len(account.open_loans), 2)
+        self.assertEqual(sum(loan.is_overdue for loan in account.open_loans), 1)
+        self.assertEqual(account.accruing, Decimal('0.75'))
+        self.assertEqual(account.balance, account.fines + Decimal('0.75'))
+        self.assertEqual(sorted(hold.position for a in accounts for hold in a.current_holds), list(range(1, 41)))
+
+    def test_endpoints_stay_within_budget(self):
+        # QUERY_BUDGET_STRICT fails these requests if they exceed QUERY_BUDGETS
+        client = APIClient(HTTP_AUTHORIZATION=f'Token {self.token}')
+        for name in ('7-A', '7-B'):
+            response = client.get(f'/api/classes/{LibraryClass.objects.get(name=name).pk}/accounts/')
+            self.assertEqual(response.status_code, 200)
+        patron = Patron.objects.filter(class_name='7-B').first()
+        self.assertEqual(client.get(f'/api/patrons/{patron.pk}/account/').status_code, 200)
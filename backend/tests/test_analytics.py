@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from backend.analytics import AnalyticsService
+from backend.models import Book, Loan, Patron
+from backend.services import FineAccrualService
+
+
+class TopTitlesTests(TestCase):
+    def test_copies_of_a_title_rank_together(self):
+        patron = Patron.objects.create(student_id='S1', full_name='Ada', patron_group='STUDENT')
+        class_set = [
+            Book.objects.create(isbn='9780000000001', title='Class Novel', author='Writer', ddc_code='823', barcode_id=f'CS{n}')
+            for n in range(3)
+        ]
+        single = Book.objects.create(isbn='9780000000002', title='Popular Copy', author='Other', ddc_code='500', barcode_id='P1')
+        due = timezone.now() + timedelta(days=7)
+        Loan.objects.bulk_create([Loan(book=book, patron=patron, due_date=due) for book in class_set] + [
+            Loan(book=single, patron=patron, due_date=due) for _ in range(2)
+        ])
+        Loan.objects.update(issued_at=timezone.now() - timedelta(hours=1)) # Past the rollup's settle lag
+        AnalyticsService.refresh()
+
+        top = AnalyticsService.top_titles()
+        self.assertEqual(
+            [(row['isbn'], row['title'], row['author'], row['copies'], row['loans']) for row in top],
+            [('9780000000001', 'Class Novel', 'Writer', 3, 3), ('9780000000002', 'Popular Copy', 'Other', 1, 2)],
+        )
+
+
+class RevenueRollupTests(TestCase):
+    def test_assessments_of_a_run_that_started_long_ago_are_counted(self):
+        patron = Patron.objects.create(student_id='S1', full_name='Ada', patron_group='STUDENT')
+        book = Book.objects.create(isbn='9780000000001', title='Late', author='Writer', ddc_code='823', barcode_id='L1')
+        Loan.objects.create(book=book, patron=patron, due_date=timezone.now() - timedelta(days=5))
+        AnalyticsService.refresh()
+
+        # The run's chunks commit long after the `as_of` it started with
+        started = timezone.now() - timedelta(hours=1)
+        self.assertEqual(FineAccrualService.run(as_of=started)['assessed'], 1)
+        AnalyticsService.refresh(now=timezone.now() + AnalyticsService.SETTLE_LAG + timedelta(seconds=1))
+
+        self.assertEqual([row['type'] for row in AnalyticsService.revenue_by_type()], ['FINE_ASSESSMENT'])
@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from backend.models import Book, CirculationRule, Loan, Patron
+from backend.services import CirculationRuleCache, CirculationService
+
+
+class CirculationRuleCacheTests(TestCase):
+    def setUp(self):
+        self.patron = Patron.objects.create(student_id='S1', full_name='Ada', patron_group='STUDENT')
+        self.rule = CirculationRule.objects.create(patron_group='STUDENT', material_type='REGULAR', loan_days=7, max_items=3)
+        for n in range(3):
+            Book.objects.create(isbn=f'97800000000{n:02d}', title=f'Book {n}', author='A', ddc_code='500', barcode_id=f'B{n}')
+
+    def due_in_days(self, barcode):
+        loan = Loan.objects.get(book__barcode_id=barcode, returned_at__isnull=True)
+        return round((loan.due_date - timezone.now()) / timedelta(days=1))
+
+    def test_edit_reaches_a_worker_holding_a_stale_copy(self):
+        CirculationService.checkout_batch(self.patron, ['B0'])
+        self.assertEqual(self.due_in_days('B0'), 7)
+        # Written directly, as another worker would: nothing here is told to invalidate
+        rule = CirculationRule.objects.get(pk=self.rule.pk)
+        rule.loan_days = 21
+        rule.save()
+        CirculationService.checkout_batch(self.patron, ['B1'])
+        self.assertEqual(self.due_in_days('B1'), 21)
+
+    def test_deleted_rule_falls_back_to_defaults(self):
+        CirculationRuleCache.rules()
+        self.rule.delete()
+        rule = CirculationRuleCache.resolve('STUDENT', 'REGULAR')
+        self.assertEqual((rule.loan_days, rule.max_items), (CirculationRuleCache.DEFAULT_LOAN_DAYS, None))
+
+    def test_table_is_loaded_once_per_batch(self):
+        CirculationRuleCache.rules()
+        with self.assertNumQueries(1): # Just the stamp while it is unchanged
+            rules = CirculationRuleCache.rules()
+            for group in ('STUDENT', 'TEACHER', 'STUDENT'): CirculationRuleCache.resolve(group, 'REGULAR', rules)
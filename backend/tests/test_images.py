@@ -0,0 +1,111 @@
+import base64
+import io
+
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.test import TestCase
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from backend.images import LOGO_SIZES, PATRON_SIZES, store_image
+from backend.models import Patron, SystemConfiguration
+
+
+def data_url(mode='RGB', size=(800, 600), fmt='PNG'):
+    buffer = io.BytesIO()
+    Image.new(mode, size, (200, 40, 40, 128) if mode == 'RGBA' else (200, 40, 40)).save(buffer, format=fmt)
+    mime = 'image/png' if fmt == 'PNG' else 'image/jpeg'
+    return f'data:{mime};base64,{base64.b64encode(buffer.getvalue()).decode()}'
+
+
+def stored_size(key):
+    with default_storage.open(key) as fh:
+        return Image.open(fh).size
+
+
+class StoreImageTests(TestCase):
+    """Runs on the filesystem storage under the test settings' temporary MEDIA_ROOT."""
+    def test_opaque_images_become_jpeg_renditions(self):
+        keys = store_image(data_url(), 'patrons', PATRON_SIZES)
+        self.assertEqual(set(keys), {'full', 'thumb'})
+        self.assertTrue(all(key.endswith('.jpg') for key in keys.values()))
+        self.assertEqual(stored_size(keys['full']), (512, 384))
+        self.assertEqual(stored_size(keys['thumb']), (96, 72))
+
+    def test_transparency_is_kept_as_png(self):
+        keys = store_image(data_url(mode='RGBA'), 'branding', {'full': 512})
+        self.assertTrue(keys['full'].endswith('.png'))
+        with default_storage.open(keys['full']) as fh:
+            self.assertEqual(Image.open(fh).mode, 'RGBA')
+
+    def test_non_raster_types_are_refused(self):
+        svg = '<svg xmlns="http://www.w3.org/2000/svg" onload="alert(1)"/>'
+        for url in ('data:image/svg+xml,' + svg, 'data:text/html,<script>alert(1)</script>', 'data:image/png,' + svg):
+            with self.assertRaises(Exception):
+                store_image(url, 'branding', LOGO_SIZES)
+
+
+class LogoTests(TestCase):
+    def logo(self, logo, logo_key=None):
+        SystemConfiguration.objects.update_or_create(pk=1, defaults={'logo': logo, 'logo_key': logo_key})
+        return self.client.get('/api/system-config/logo/')
+
+    def test_raster_logo_is_served_with_nosniff(self):
+        response = self.logo(data_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+    def test_legacy_script_capable_logos_are_not_served(self):
+        self.assertEqual(self.logo('data:image/svg+xml,<svg xmlns="http://www.w3.org/2000/svg"/>').status_code, 404)
+        self.assertEqual(self.logo('data:text/html,<script>alert(1)</script>').status_code, 404)
+        self.assertEqual(self.logo(None, 'branding/old.svg').status_code, 404)
+
+
+class PatronPhotoTests(TestCase):
+    def setUp(self):
+        token = Token.objects.create(user=User.objects.create_user('librarian')).key
+        self.client = APIClient(HTTP_AUTHORIZATION=f'Token {token}')
+        response = self.client.post('/api/patrons/', {
+            'student_id': 'S1', 'full_name': 'Ada', 'patron_group': 'STUDENT', 'photo_url': data_url(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.url = f"/api/patrons/{response.data['id']}/"
+        self.photo_url = response.data['photo_url']
+        self.patron = Patron.objects.get(student_id='S1')
+
+    def patch(self, photo_url):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, {'photo_url': photo_url}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response, Patron.objects.get(pk=self.patron.pk)
+
+    def test_data_url_is_moved_to_storage(self):
+        self.assertIsNone(self.patron.photo_url)
+        self.assertTrue(default_storage.exists(self.patron.photo_key))
+        self.assertTrue(default_storage.exists(self.patron.photo_thumb_key))
+        self.assertTrue(self.photo_url.endswith(self.patron.photo_key))
+
+    def test_echoed_url_leaves_the_photo_alone(self):
+        _, patron = self.patch(self.photo_url)
+        self.assertEqual((patron.photo_key, patron.photo_thumb_key), (self.patron.photo_key, self.patron.photo_thumb_key))
+        self.assertTrue(default_storage.exists(patron.photo_key))
+
+    def test_replacing_the_photo_deletes_the_old_files(self):
+        _, patron = self.patch(data_url(size=(300, 300)))
+        self.assertNotEqual(patron.photo_key, self.patron.photo_key)
+        self.assertTrue(default_storage.exists(patron.photo_key))
+        self.assertFalse(default_storage.exists(self.patron.photo_key))
+        self.assertFalse(default_storage.exists(self.patron.photo_thumb_key))
+
+    def test_clearing_the_photo_deletes_its_files(self):
+        response, patron = self.patch('')
+        self.assertIsNone(response.data['photo_url'])
+        self.assertEqual((patron.photo_url, patron.photo_key, patron.photo_thumb_key), (None, None, None))
+        self.assertFalse(default_storage.exists(self.patron.photo_key))
+
+    def test_unreadable_image_is_rejected(self):
+        response = self.client.patch(self.url, {'photo_url': 'data:image/png;base64,bm90IGFuIGltYWdl'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Patron.objects.get(pk=self.patron.pk).photo_key, self.patron.photo_key)
@@ -0,0 +1,85 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from backend.importers import CatalogImporter
+from backend.models import Book, ImportJob, Title
+
+
+class ImportUpsertTests(TestCase):
+    def setUp(self):
+        Book.objects.create(
+            isbn='9780000000001', title='Atlas', author='Cartographer', ddc_code='912',
+            barcode_id='X1', summary='precious summary', publisher='Maps Ltd',
+        )
+
+    def test_rows_only_overwrite_their_own_columns(self):
+        # Blank cells are dropped by the readers, so rows in a chunk carry different keys
+        CatalogImporter.write([
+            {'isbn': '9780000000001', 'title': 'Atlas', 'author': 'Cartographer', 'ddc_code': '912',
+             'barcode_id': 'X2', 'summary': 's'},
+            {'isbn': '9780000000001', 'title': 'Atlas (2nd ed.)', 'author': 'Cartographer', 'ddc_code': '912',
+             'barcode_id': 'X1'},
+        ])
+        existing = Book.objects.get(barcode_id='X1')
+        self.assertEqual(existing.title, 'Atlas (2nd ed.)')
+        self.assertEqual(existing.summary, 'precious summary')
+        self.assertEqual(existing.publisher, 'Maps Ltd')
+        self.assertEqual(Book.objects.get(barcode_id='X2').summary, 's')
+        self.assertEqual(Title.objects.get(isbn='9780000000001').copy_count, 2)
+
+    def test_barcodeless_row_refreshes_copies_of_its_isbn(self):
+        CatalogImporter.write([{'isbn': '9780000000001', 'title': 'Atlas', 'author': 'Cartographer', 'ddc_code': '912.1'}])
+        book = Book.objects.get(barcode_id='X1')
+        self.assertEqual(book.ddc_code, '912.1')
+        self.assertEqual(book.summary, 'precious summary')
+        self.assertEqual(Book.objects.count(), 1)
+
+    def test_barcodeless_rows_are_refreshed_in_bulk(self):
+        for n in range(2, 6):
+            Book.objects.create(isbn=f'978000000000{n}', title=f'Book {n}', author='A', ddc_code='500', barcode_id=f'X{n}')
+        rows = [{'isbn': f'978000000000{n}', 'title': f'Book {n}', 'author': 'A', 'ddc_code': '600'} for n in range(1, 6)]
+        with self.assertNumQueries(11): # Same for any number of ISBNs sharing a column set
+            CatalogImporter.write(rows)
+        self.assertEqual(set(Book.objects.values_list('ddc_code', flat=True)), {'600'})
+        self.assertEqual(Book.objects.get(barcode_id='X1').summary, 'precious summary')
+
+    def test_rows_failing_the_upsert_report_their_record_number(self):
+        job = ImportJob.objects.create(file_name='a.csv', file_path='a.csv', format='CSV', records_read=10)
+        rows = [{'isbn': f'978000000001{n}', 'title': 'T', 'author': 'A', 'ddc_code': '500', 'barcode_id': f'B{n}'} for n in range(3)]
+        original = CatalogImporter.write
+
+        def write(batch):
+            if any(row['barcode_id'] == 'B1' for row in batch): raise IntegrityError('duplicate key')
+            original(batch)
+
+        with mock.patch.object(CatalogImporter, 'write', side_effect=write):
+            CatalogImporter(job).commit_chunk(rows, 0)
+        self.assertEqual((job.imported, job.failed), (2, 1))
+        self.assertEqual(job.errors, [{'record': 12, 'isbn': '9780000000011', 'errors': 'duplicate key'}])
+
+
+class ImportResumeTests(TestCase):
+    def setUp(self):
+        self.client = APIClient(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=User.objects.create_user("librarian")).key}')
+        self.job = ImportJob.objects.create(file_name='a.csv', file_path='/nonexistent/a.csv', format='CSV', status='RUNNING')
+
+    def resume(self):
+        return self.client.post(f'/api/catalog-imports/{self.job.pk}/resume/')
+
+    def test_running_job_with_recent_checkpoint_is_not_resumed(self):
+        self.assertEqual(self.resume().status_code, 409)
+
+    def test_running_job_whose_worker_died_is_resumed_once(self):
+        ImportJob.objects.filter(pk=self.job.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(self.resume().status_code, 202)
+        self.assertEqual(len(callbacks), 1) # The worker thread, started on commit
+        self.assertEqual(ImportJob.objects.get(pk=self.job.pk).status, 'RUNNING')
+        self.assertEqual(self.resume().status_code, 409)
@@ -0,0 +1,55 @@
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from rest_framework.request import Request
+
+from backend import kiosk
+from backend.models import Book, Patron
+from backend.profiling import METRICS
+from backend.services import CirculationService, HoldService
+
+
+class KioskThrottleTests(SimpleTestCase):
+    def request(self):
+        request = Request(RequestFactory().get('/api/catalog/'))
+        request.user = AnonymousUser()
+        return request
+
+    def errors(self):
+        return METRICS.counters.get(('library_throttle_errors_total', (('error', 'ImportError'), ('scope', 'public'))), 0)
+
+    def test_backend_failure_lets_requests_through_and_is_reported(self):
+        before = self.errors()
+        self.addCleanup(setattr, kiosk, '_buckets_failing', False)
+        with mock.patch.object(kiosk, 'buckets', side_effect=ImportError('No module named redis')):
+            with self.assertLogs('backend.kiosk', 'ERROR') as logs:
+                self.assertTrue(kiosk.KioskThrottle().allow_request(self.request(), None))
+                self.assertTrue(kiosk.KioskThrottle().allow_request(self.request(), None))
+        self.assertEqual(self.errors(), before + 2)
+        self.assertEqual(len(logs.records), 1) # Once per outage, not per request
+
+        with self.assertLogs('backend.kiosk', 'WARNING') as logs:
+            self.assertTrue(kiosk.KioskThrottle().allow_request(self.request(), None))
+        self.assertIn('recovered', logs.output[0])
+
+
+class CatalogCacheInvalidationTests(TestCase):
+    def generation(self):
+        return cache.get(kiosk.group_version_key('catalog')) or 0
+
+    def test_circulation_and_holds_start_a_new_catalog_generation(self):
+        book = Book.objects.create(isbn='9780000000001', title='Busy', author='Writer', ddc_code='500', barcode_id='B1')
+        ada = Patron.objects.create(student_id='S1', full_name='Ada', patron_group='STUDENT')
+        bea = Patron.objects.create(student_id='S2', full_name='Bea', patron_group='STUDENT')
+        for change in (
+            lambda: CirculationService.checkout_batch(ada, ['B1']),
+            lambda: HoldService.place(bea, book),
+            lambda: CirculationService.return_batch(['B1']),
+            lambda: HoldService.cancel(book.holds.get()),
+        ):
+            before = self.generation()
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            self.assertGreater(self.generation(), before)
@@ -0,0 +1,106 @@
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from backend.models import ISBNMetadataCache
+from backend.services import CatalogingService
+
+
+class StubServer:
+    """Local /api/books: answers `known` ISBNs, after first failing with the statuses in `failures`."""
+    def __init__(self, known, failures=()):
+        self.known, self.failures, self.requests = known, list(failures), []
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                keys = parse_qs(urlparse(self.path).query).get('bibkeys', [''])[0].split(',')
+                stub.requests.append(keys)
+                if stub.failures:
+                    self.send_response(stub.failures.pop(0))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = json.dumps({
+                    key: {'title': f'Title {key}', 'authors': [{'name': 'Author'}], 'identifiers': {'dewey_decimal': ['500.1']}}
+                    for key in keys if key[5:] in stub.known
+                }).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.settings = override_settings(OPEN_LIBRARY_URL=f'http://127.0.0.1:{self.server.server_port}')
+        self.settings.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.settings.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FetchManyTests(TestCase):
+    def test_hits_and_misses_are_cached(self):
+        with StubServer(known={'9780000000001'}) as stub:
+            results = CatalogingService.fetch_many(['978-0000000001', '9780000000002'])
+            self.assertEqual(results['9780000000001']['title'], 'Title ISBN:9780000000001')
+            self.assertIsNone(results['9780000000002'])
+            self.assertEqual(len(stub.requests), 1)
+
+            again = CatalogingService.fetch_many(['9780000000001', '9780000000002'])
+            self.assertEqual(again, results)
+            self.assertEqual(len(stub.requests), 1) # Both answered from ISBNMetadataCache
+
+        miss = ISBNMetadataCache.objects.get(isbn='9780000000002')
+        self.assertIsNone(miss.payload)
+        self.assertLess(miss.expires_at, timezone.now() + timedelta(days=1, minutes=1)) # Negative TTL, not 30 days
+
+    def test_expired_miss_is_looked_up_again(self):
+        ISBNMetadataCache.objects.create(isbn='9780000000003', payload=None, expires_at=timezone.now() - timedelta(seconds=1))
+        with StubServer(known={'9780000000003'}) as stub:
+            self.assertIsNotNone(CatalogingService.fetch_book_metadata('9780000000003'))
+            self.assertEqual(len(stub.requests), 1)
+
+    def test_transient_errors_are_retried(self):
+        with StubServer(known={'9780000000004'}, failures=[503]) as stub:
+            self.assertIsNotNone(CatalogingService.fetch_book_metadata('9780000000004'))
+            self.assertEqual(len(stub.requests), 2)
+
+    def test_failed_chunks_are_not_cached(self):
+        with StubServer(known={'9780000000005'}, failures=[503, 503, 503]) as stub:
+            self.assertIsNone(CatalogingService.fetch_book_metadata('9780000000005'))
+            self.assertEqual(len(stub.requests), 3) # The first try and two retries
+        self.assertFalse(ISBNMetadataCache.objects.filter(isbn='9780000000005').exists())
+
+    @override_settings(METADATA_BATCH_SIZE=2)
+    def test_misses_are_fetched_in_batches(self):
+        isbns = [f'978000000001{n}' for n in range(5)]
+        with StubServer(known=set(isbns)) as stub:
+            results = CatalogingService.fetch_many(isbns)
+        self.assertEqual(sorted(len(keys) for keys in stub.requests), [1, 2, 2])
+        self.assertTrue(all(results[isbn] for isbn in isbns))
+
+
+class WaterfallBatchTests(TestCase):
+    def test_non_string_isbns_are_rejected(self):
+        client = APIClient(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=User.objects.create_user("librarian")).key}')
+        for isbns in ([9780000000001], ['9780000000001', None], [{'isbn': '9780000000001'}]):
+            response = client.post('/api/catalog/waterfall_batch/', {'isbns': isbns}, format='json')
+            self.assertEqual(response.status_code, 400, isbns)
@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from backend.models import Book, Loan, Patron
+
+
+def staff_client():
+    user = User.objects.create_user('librarian', password='lib123')
+    return APIClient(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Runs the hot endpoints under QUERY_BUDGET_STRICT (on in the test
+    settings): ProfilingMiddleware raises QueryBudgetExceeded, failing the
+    test, when a view runs more queries than its QUERY_BUDGETS entry.
+    Batch endpoints are exercised at two sizes to show they stay flat.
+    """
+    def setUp(self):
+        cache.clear()
+        self.client = staff_client()
+        self.patron = Patron.objects.create(student_id='S1', full_name='Ada', patron_group='STUDENT', class_name='7-A')
+        self.books = [
+            Book.objects.create(isbn=f'97800000000{n:02d}', title=f'Book {n}', author='Author', ddc_code='500', barcode_id=f'B{n}')
+            for n in range(12)
+        ]
+
+    def checkout(self, barcodes):
+        response = self.client.post('/api/circulation/checkout/', {'patron_id': 'S1', 'books': barcodes}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['processed'], len(barcodes))
+
+    def test_catalog_list(self):
+        self.assertEqual(self.client.get('/api/catalog/').status_code, 200)
+        self.assertEqual(self.client.get('/api/catalog/', {'search': 'Book', 'ordering': 'title'}).status_code, 200)
+        self.assertEqual(APIClient().get('/api/catalog/').status_code, 200)
+
+    def test_checkout(self):
+        self.checkout(['B0'])
+        self.checkout(['B1', 'B2', 'B3', 'B4', 'B5'])
+
+    def test_return_book(self):
+        self.checkout(['B0'])
+        response = self.client.post('/api/circulation/return_book/', {'barcode': 'B0'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_return_books(self):
+        self.checkout(['B0', 'B1', 'B2', 'B3', 'B4', 'B5'])
+        Loan.objects.filter(book__barcode_id__in=['B4', 'B5']).update(due_date=timezone.now() - timedelta(days=3))
+        for barcodes in (['B0'], ['B1', 'B2', 'B3', 'B4', 'B5']):
+            response = self.client.post('/api/circulation/return_books/', {'barcodes': barcodes}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['processed'], len(barcodes))
+
+    def test_patron_account(self):
+        self.checkout(['B0', 'B1'])
+        response = self.client.get(f'/api/patrons/{self.patron.pk}/account/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['loans']), 2)
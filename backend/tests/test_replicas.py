@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from backend.models import Book
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], PUBLIC_CACHE_TTL=0)
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    The test settings add `replica1` as a TEST MIRROR of `default`
+    (DB_SQLITE_REPLICA), so routing is observable on one database. The
+    mirror is a second connection, so rows must be committed for it to
+    see them.
+    """
+    databases = {'default', 'replica1'}
+
+    def setUp(self):
+        cache.clear()
+        Book.objects.create(isbn='9780000000001', title='Atlas', author='A', ddc_code='912', barcode_id='B1')
+        token = Token.objects.create(user=User.objects.create_user('librarian')).key
+        self.client = APIClient(HTTP_AUTHORIZATION=f'Token {token}')
+
+    def request(self, method, url, **kwargs):
+        with CaptureQueriesContext(connections['default']) as primary, CaptureQueriesContext(connections['replica1']) as replica:
+            response = getattr(self.client, method)(url, format='json', **kwargs)
+        self.assertLess(response.status_code, 300, response.content)
+        return len(primary), len(replica)
+
+    def test_reads_go_to_the_replica(self):
+        primary, replica = self.request('get', '/api/catalog/')
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_writes_go_to_the_primary(self):
+        primary, replica = self.request('post', '/api/catalog/', data={
+            'isbn': '9780000000002', 'title': 'Globe', 'author': 'B', 'ddc_code': '912', 'barcode_id': 'B2',
+        })
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_client_reads_its_own_writes_from_the_primary(self):
+        self.request('patch', '/api/catalog/B1/', data={'title': 'Atlas (2nd ed.)'})
+        primary, replica = self.request('get', '/api/catalog/')
+        self.assertEqual(replica, 0)
+        self.assertGreater(primary, 0)
+        # Other clients are not pinned
+        self.client = APIClient()
+        primary, replica = self.request('get', '/api/catalog/')
+        self.assertEqual(primary, 0)
+
+    def test_pin_expires(self):
+        with override_settings(REPLICA_PIN_SECONDS=0):
+            self.request('patch', '/api/catalog/B1/', data={'title': 'Atlas (2nd ed.)'})
+        primary, replica = self.request('get', '/api/catalog/')
+        self.assertEqual(primary, 0)
@@ -0,0 +1,47 @@
+from django.test import TestCase
+
+from backend.models import Book, ChangeLog
+from backend.sync import SyncService
+
+
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.slow_book = Book.objects.create(isbn='9780000000001', title='Slow', author='A', ddc_code='500', barcode_id='B1')
+        self.fast_book = Book.objects.create(isbn='9780000000002', title='Fast', author='A', ddc_code='500', barcode_id='B2')
+
+    def synced_ids(self, feed):
+        return {book['id'] for book in feed['changes'].get('books', [])}
+
+    def test_slow_transaction_committing_behind_the_cursor_is_still_delivered(self):
+        # The slow writer inserts its row first (lower id) but commits last
+        reserved = ChangeLog.objects.create(model='book', object_id=self.slow_book.id)
+        reserved_id = reserved.id
+        reserved.delete() # Still in flight: invisible to readers
+        ChangeLog.record(Book, [self.fast_book.id])
+
+        first = SyncService.changes(since=0)
+        self.assertEqual(self.synced_ids(first), {self.fast_book.id})
+
+        ChangeLog.objects.create(id=reserved_id, model='book', object_id=self.slow_book.id) # The slow commit lands
+        second = SyncService.changes(since=first['next'])
+        self.assertEqual(self.synced_ids(second), {self.slow_book.id})
+        self.assertGreater(second['next'], first['next'])
+
+    def test_positions_follow_insert_order_and_are_assigned_once(self):
+        ChangeLog.record(Book, [self.slow_book.id, self.fast_book.id])
+        ChangeLog.sequence()
+        ChangeLog.sequence()
+        rows = list(ChangeLog.objects.order_by('id').values_list('seq', flat=True))
+        self.assertEqual(rows, sorted(rows))
+        self.assertNotIn(None, rows)
+
+    def test_paging_compacts_and_reports_deletions(self):
+        ChangeLog.record(Book, [self.slow_book.id])
+        ChangeLog.record(Book, [self.slow_book.id, self.fast_book.id])
+        gone = self.fast_book.id
+        self.fast_book.delete()
+        feed = SyncService.changes(since=0, limit=2)
+        self.assertTrue(feed['has_more'])
+        rest = SyncService.changes(since=feed['next'])
+        self.assertFalse(rest['has_more'])
+        self.assertEqual(rest['deleted'], {'books': [gone]})
@@ -0,0 +1,34 @@
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from backend.models import SystemConfiguration
+from backend.services import SystemConfigCache
+
+
+class SystemConfigCacheTests(TestCase):
+    def test_direct_write_is_picked_up_by_every_worker(self):
+        config = SystemConfiguration.objects.create(pk=1, map_data={'levels': []})
+        version, etag, data = SystemConfigCache.snapshot()
+        self.assertEqual(data['map_data'], {'levels': []})
+        # As another worker's update_config would: nothing in this process is told
+        config.map_data = {'levels': [{'id': 'L1'}]}
+        config.save()
+        new_version, new_etag, new_data = SystemConfigCache.snapshot()
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(new_data['map_data'], {'levels': [{'id': 'L1'}]})
+
+    def test_snapshot_reads_only_the_stamp_while_unchanged(self):
+        SystemConfiguration.objects.create(pk=1)
+        SystemConfigCache.snapshot()
+        with self.assertNumQueries(1):
+            SystemConfigCache.snapshot()
+
+    def test_etag_revalidation_follows_updates(self):
+        client = APIClient()
+        etag = client.get('/api/system-config/')['ETag']
+        self.assertEqual(client.get('/api/system-config/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        config, _ = SystemConfiguration.objects.get_or_create(pk=1)
+        config.save()
+        response = client.get('/api/system-config/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
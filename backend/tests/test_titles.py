@@ -0,0 +1,40 @@
+from django.test import TestCase
+
+from backend.models import Book, Title
+
+
+class TitleCounterTests(TestCase):
+    def counters(self, isbn):
+        return Title.objects.filter(isbn=isbn).values_list('copy_count', 'available_count').get()
+
+    def test_saving_and_deleting_a_copy_recounts_its_title(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(isbn='9780000000001', title='Counted', author='Writer', ddc_code='500', barcode_id='C1')
+        self.assertEqual(self.counters('9780000000001'), (1, 1))
+
+        book = Book.objects.get(pk=book.pk)
+        book.status = 'LOST'
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+        self.assertEqual(self.counters('9780000000001'), (1, 0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.delete()
+        self.assertEqual(self.counters('9780000000001'), (0, 0))
+
+    def test_changing_the_isbn_recounts_both_titles(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(isbn='9780000000001', title='Moved', author='Writer', ddc_code='500', barcode_id='M1')
+        book.isbn = '9780000000002'
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+        self.assertEqual(self.counters('9780000000001'), (0, 0))
+        self.assertEqual(self.counters('9780000000002'), (1, 1))
+
+    def test_unchanged_save_does_not_recount(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(isbn='9780000000001', title='Still', author='Writer', ddc_code='500', barcode_id='S1')
+        book.shelf_location = 'A1'
+        with self.captureOnCommitCallbacks() as callbacks:
+            book.save()
+        self.assertEqual(callbacks, [])
@@ -1,23 +1,39 @@
 
+from django.conf import settings
+from django.conf.urls.static import static
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from .profiling import metrics_view
+from .push import event_stream
 from .views import (
     CatalogViewSet, CirculationViewSet, AuthViewSet, PatronViewSet, 
     CirculationRuleViewSet, LibraryEventViewSet, SystemAlertViewSet, 
-    SystemConfigViewSet, LibraryClassViewSet
+    SystemConfigViewSet, LibraryClassViewSet, ImportJobViewSet, HoldViewSet, AnalyticsViewSet,
+    TransactionViewSet, InventorySessionViewSet, SyncViewSet
 )
 
 router = DefaultRouter()
 router.register(r'catalog', CatalogViewSet, basename='catalog')
+router.register(r'catalog-imports', ImportJobViewSet, basename='catalog-imports')
+router.register(r'inventory', InventorySessionViewSet, basename='inventory')
 router.register(r'circulation', CirculationViewSet, basename='circulation')
 router.register(r'auth', AuthViewSet, basename='auth')
 router.register(r'patrons', PatronViewSet, basename='patrons')
 router.register(r'classes', LibraryClassViewSet, basename='classes')
 router.register(r'system-config', SystemConfigViewSet, basename='system-config')
+router.register(r'holds', HoldViewSet, basename='holds')
+router.register(r'transactions', TransactionViewSet, basename='transactions')
+router.register(r'analytics', AnalyticsViewSet, basename='analytics')
 router.register(r'rules', CirculationRuleViewSet, basename='rules')
 router.register(r'events', LibraryEventViewSet, basename='events')
 router.register(r'alerts', SystemAlertViewSet, basename='alerts')
+router.register(r'sync', SyncViewSet, basename='sync')
 
 urlpatterns = [
+    path('api/push/stream', event_stream, name='push-stream'),
     path('api/', include(router.urls)),
+    path('metrics', metrics_view, name='metrics'),
 ]
+
+# Local media (patron photos) in development; Nginx serves /media/ in production
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
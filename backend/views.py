@@ -1,45 +1,147 @@
+import mimetypes
+import os
+import threading
+import uuid
+from datetime import timedelta
 
 from rest_framework import viewsets, status, filters, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.urls import reverse
 from django.utils import timezone
-from datetime import timedelta
-from decimal import Decimal
-from .models import Book, Patron, Loan, CirculationRule, LibraryEvent, Hold, SystemAlert, SystemConfiguration, LibraryClass, Transaction
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_etags
+from .models import Book, Patron, CirculationRule, LibraryEvent, Hold, SystemAlert, SystemConfiguration, LibraryClass, Transaction, ImportJob, InventorySession, ChangeLog, Title
 from .serializers import (
-    BookSerializer, PatronSerializer, CirculationRuleSerializer, 
-    LibraryEventSerializer, SystemAlertSerializer, SystemConfigSerializer,
-    LibraryClassSerializer, TransactionSerializer
+    BookSerializer, BookListSerializer, PatronSerializer, PatronListSerializer, CirculationRuleSerializer,
+    LibraryEventSerializer, SystemAlertSerializer,
+    LibraryClassSerializer, TransactionSerializer, TransactionListSerializer, ImportJobSerializer, HoldSerializer,
+    InventorySessionSerializer, PatronAccountSerializer
+)
+from .analytics import AnalyticsService
+from .images import LOGO_SIZES, RASTER_TYPES, decode_data_url, delete_images, is_data_url, store_image
+from .importers import detect_format, run_import_job
+from .inventory import InventoryError, InventoryService
+from .kiosk import KioskLookupThrottle, KioskThrottle
+from .labels import card_job, card_queryset, spine_job, spine_queryset
+from .push import publish_on_commit
+from .search import CatalogSearchFilter, TitleGroupFilter
+from .sync import SyncService
+from .wayfinding import ShelfIndex
+from .services import (
+    AccountService, CatalogingService, CirculationService, SystemConfigCache,
+    HoldService, HoldError, LedgerService, LedgerError
 )
-from .services import CatalogingService
 
 class IsLibrarianOrAdmin(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user and request.user.is_authenticated
 
+class LeanReadMixin:
+    """
+    `list` uses `list_serializer_class` when set, and reads (list/retrieve)
+    load only the columns the selected serializer fields need.
+    """
+    list_serializer_class = None
+
+    def get_serializer_class(self):
+        if self.action == 'list' and self.list_serializer_class: return self.list_serializer_class
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            serializer = self.get_serializer_class()(context=self.get_serializer_context())
+            if hasattr(serializer, 'model_columns'): queryset = queryset.only(*serializer.model_columns())
+        return queryset
+
+class ChangeLogMixin:
+    """Records REST writes in the ChangeLog so offline desk clients pick them up on their next sync."""
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        ChangeLog.record(type(serializer.instance), [serializer.instance.pk])
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        ChangeLog.record(type(serializer.instance), [serializer.instance.pk])
+
+    def perform_destroy(self, instance):
+        model, pk = type(instance), instance.pk
+        super().perform_destroy(instance)
+        ChangeLog.record(model, [pk])
+
 class SystemConfigViewSet(viewsets.ViewSet):
     permission_classes = [permissions.AllowAny]
 
     def list(self, request):
-        config, _ = SystemConfiguration.objects.get_or_create(pk=1)
-        serializer = SystemConfigSerializer(config)
-        return Response(serializer.data)
+        version, etag, data = SystemConfigCache.snapshot()
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=304, headers=headers)
+        logo_url = request.build_absolute_uri(reverse('system-config-logo')) + '?v=' + etag.strip('"')
+        return Response({**data, 'logo': logo_url if data['has_logo'] else None}, headers=headers)
+
+    @action(detail=False, methods=['get'])
+    def logo(self, request):
+        """
+        Binary logo decoded from the stored data URL. The URL handed out by
+        `list` is versioned, so browsers may cache it for a day. Only
+        RASTER_TYPES are served; a legacy SVG or other logo is a 404.
+        """
+        version, etag, data = SystemConfigCache.snapshot()
+        headers = {'ETag': etag, 'Cache-Control': 'public, max-age=86400', 'X-Content-Type-Options': 'nosniff'}
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return HttpResponse(status=304, headers=headers)
+        config = SystemConfiguration.objects.filter(pk=1).only('logo', 'logo_key').first()
+        if config and config.logo_key:
+            content_type = mimetypes.guess_type(config.logo_key)[0]
+            if content_type not in RASTER_TYPES: return HttpResponse(status=404)
+            with default_storage.open(config.logo_key) as fh: content = fh.read()
+            return HttpResponse(content, content_type=content_type, headers=headers)
+        if not config or not config.logo: return HttpResponse(status=404)
+        if not is_data_url(config.logo): return HttpResponseRedirect(config.logo)
+        content_type, content = decode_data_url(config.logo)
+        if content_type not in RASTER_TYPES: return HttpResponse(status=404)
+        return HttpResponse(content, content_type=content_type, headers=headers)
 
     @action(detail=False, methods=['post'], permission_classes=[IsLibrarianOrAdmin])
     def update_config(self, request):
         config, _ = SystemConfiguration.objects.get_or_create(pk=1)
-        config.logo = request.data.get('logo', config.logo)
+        stale_logo = None
+        logo = request.data.get('logo')
+        if is_data_url(logo):
+            try:
+                keys = store_image(logo, 'branding', LOGO_SIZES)
+            except Exception:
+                return Response({'success': False, 'message': 'Logo must be a PNG, JPEG, WebP or GIF image'}, status=400)
+            stale_logo, config.logo_key, config.logo = config.logo_key, keys['full'], None
+        elif 'logo' in request.data and reverse('system-config-logo') not in (logo or ''):
+            # Cleared, or pointed at an external URL (our own logo URL echoed back is a no-op)
+            stale_logo, config.logo_key, config.logo = config.logo_key, None, logo or None
         config.map_data = request.data.get('map_data', config.map_data)
         config.save()
+        transaction.on_commit(ShelfIndex.current) # Recompile the shelf index for the new stamp
+        if stale_logo: transaction.on_commit(lambda: delete_images(stale_logo))
         return Response({'success': True})
 
-class LibraryClassViewSet(viewsets.ModelViewSet):
+class LibraryClassViewSet(LeanReadMixin, viewsets.ModelViewSet):
     queryset = LibraryClass.objects.all()
     serializer_class = LibraryClassSerializer
     permission_classes = [IsLibrarianOrAdmin]
 
+    @action(detail=True, methods=['get'])
+    def accounts(self, request, pk=None):
+        """Account (loans, holds, balance) of every patron in the class, in a fixed number of queries."""
+        accounts = AccountService.accounts(Patron.objects.filter(class_name=self.get_object().name))
+        return Response(PatronAccountSerializer(accounts, many=True, context={'request': request}).data)
+
 class AuthViewSet(viewsets.ViewSet):
     permission_classes = [permissions.AllowAny]
 
@@ -67,36 +169,236 @@ class AuthViewSet(viewsets.ViewSet):
             'user': {'id': str(user.id), 'username': user.username, 'full_name': f"{user.first_name} {user.last_name}".strip() or user.username, 'role': role}
         })
 
-class CatalogViewSet(viewsets.ModelViewSet):
-    queryset = Book.objects.all()
+class CatalogViewSet(ChangeLogMixin, LeanReadMixin, viewsets.ModelViewSet):
+    queryset = Book.objects.defer('search_vector')
     serializer_class = BookSerializer
+    list_serializer_class = BookListSerializer
     lookup_field = 'isbn'
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [filters.OrderingFilter, CatalogSearchFilter, TitleGroupFilter]
     search_fields = ['title', 'author', 'isbn', 'barcode_id']
     ordering_fields = ['created_at', 'loan_count', 'title']
     ordering = ['-created_at']
+    keyset_fields = ['created_at', 'loan_count']
+    replica_actions = ('list', 'retrieve', 'waterfall_search', 'waterfall_batch', 'locate', 'locate_batch', 'labels')
+    public_cache_group = 'catalog' # kiosk.PublicCacheMiddleware
+    public_actions = ['list', 'retrieve', 'waterfall_search', 'locate', 'locate_batch']
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve', 'waterfall_search']: return [permissions.AllowAny()]
+        if self.action in self.public_actions: return [permissions.AllowAny()]
         return [IsLibrarianOrAdmin()]
 
+    def get_throttles(self):
+        if self.action == 'waterfall_search': return [KioskThrottle(), KioskLookupThrottle()]
+        if self.action in self.public_actions: return [KioskThrottle()]
+        return []
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # The title's materialized counters ride along on the join, no per-row aggregates
+            queryset = queryset.annotate(**{
+                field: F(f'record__{field}') for field in ('copy_count', 'available_count', 'loaned_count', 'hold_count')
+            })
+        return queryset
+
+    def get_object(self):
+        """`catalog/<isbn>/` is a copy's barcode, or an ISBN for the title's first copy."""
+        value = self.kwargs[self.lookup_field]
+        book = (
+            self.get_queryset().filter(Q(barcode_id=value) | Q(isbn=value))
+            .order_by(Case(When(barcode_id=value, then=Value(0)), default=Value(1)), 'id').first()
+        )
+        if book is None: raise Http404
+        self.check_object_permissions(self.request, book)
+        return book
+
     @action(detail=False, methods=['get'])
     def waterfall_search(self, request):
         isbn = request.query_params.get('isbn')
         if not isbn: return Response({'error': 'ISBN required'}, status=400)
-        if Book.objects.filter(isbn=isbn).exists():
-            book = Book.objects.get(isbn=isbn)
-            return Response({'source': 'LOCAL', 'status': 'FOUND', 'data': BookSerializer(book).data})
+        book = Book.objects.filter(isbn=isbn).first()
+        if book: return Response({'source': 'LOCAL', 'status': 'FOUND', 'data': BookSerializer(book).data})
         external_data = CatalogingService.fetch_book_metadata(isbn)
         if external_data: return Response({'source': 'EXTERNAL', 'status': 'FOUND', 'data': external_data})
         return Response({'source': 'ALL', 'status': 'NOT_FOUND'}, status=404)
 
-class PatronViewSet(viewsets.ModelViewSet):
-    queryset = Patron.objects.all()
+    @action(detail=False, methods=['post'])
+    def waterfall_batch(self, request):
+        """
+        Waterfall lookup for a list of ISBNs (e.g. a vendor invoice): one local
+        query, then the metadata cache, then concurrent Open Library fetches.
+        """
+        isbns = request.data.get('isbns', [])
+        if not isinstance(isbns, list) or not isbns: return Response({'error': 'isbns list required'}, status=400)
+        if not all(isinstance(isbn, str) for isbn in isbns): return Response({'error': 'isbns must be strings'}, status=400)
+        local = {b.isbn: b for b in Book.objects.filter(isbn__in=isbns)}
+        external = CatalogingService.fetch_many([i for i in isbns if i not in local])
+        results = {}
+        for isbn in isbns:
+            external_data = external.get(isbn.strip().replace('-', ''))
+            if isbn in local:
+                results[isbn] = {'source': 'LOCAL', 'status': 'FOUND', 'data': BookSerializer(local[isbn]).data}
+            elif external_data:
+                results[isbn] = {'source': 'EXTERNAL', 'status': 'FOUND', 'data': external_data}
+            else:
+                results[isbn] = {'source': 'ALL', 'status': 'NOT_FOUND'}
+        return Response({'results': results})
+
+    @action(detail=False, methods=['get'])
+    def locate(self, request):
+        """Shelf and level for ?isbn= / ?barcode=, or for a raw ?ddc_code= (&shelf_location=)."""
+        params = request.query_params
+        if params.get('isbn') or params.get('barcode'):
+            book = Book.objects.filter(
+                **({'isbn': params['isbn']} if params.get('isbn') else {'barcode_id': params['barcode']})
+            ).values('ddc_code', 'shelf_location').first()
+            if not book: return Response({'error': 'Book not found'}, status=404)
+        elif params.get('ddc_code') or params.get('shelf_location'):
+            book = {'ddc_code': params.get('ddc_code'), 'shelf_location': params.get('shelf_location')}
+        else:
+            return Response({'error': 'isbn, barcode or ddc_code required'}, status=400)
+        location = ShelfIndex.current().locate(book['ddc_code'], book['shelf_location'])
+        if not location: return Response({'error': 'No shelf covers this item'}, status=404)
+        return Response(location)
+
+    @action(detail=False, methods=['post'])
+    def locate_batch(self, request):
+        """{isbns: [...]} -> {isbn: location or null} with one query."""
+        isbns = request.data.get('isbns', [])
+        if not isinstance(isbns, list) or not isbns: return Response({'error': 'isbns list required'}, status=400)
+        index = ShelfIndex.current()
+        rows = Book.objects.filter(isbn__in=isbns).values_list('isbn', 'ddc_code', 'shelf_location')
+        located = {isbn: index.locate(ddc_code, shelf) for isbn, ddc_code, shelf in rows}
+        return Response({'results': {isbn: located.get(isbn) for isbn in isbns}})
+
+    @action(detail=False, methods=['get', 'post'])
+    def labels(self, request):
+        """
+        Spine labels for a shelf, an acquisition batch or explicit ids, streamed
+        as one ZPL job (?shelf_location=, ?acquired_from=&acquired_to=, ?ids=).
+        """
+        return zpl_job(request, spine_queryset, spine_job, 'spine-labels.zpl')
+
+def zpl_job(request, queryset_for, job, filename):
+    params = request.data if request.method == 'POST' else request.query_params
+    try:
+        queryset = queryset_for(params)
+    except (TypeError, ValueError) as e:
+        return Response({'error': str(e)}, status=400)
+    if queryset is None: return Response({'error': 'A filter is required'}, status=400)
+    response = StreamingHttpResponse(job(queryset), content_type='application/vnd.zebra.zpl; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+class ImportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Bulk catalog imports. Uploads are streamed to IMPORT_ROOT and processed
+    on a background thread; poll the job for progress and per-record errors.
+    """
+    queryset = ImportJob.objects.order_by('-created_at')
+    serializer_class = ImportJobSerializer
+    permission_classes = [IsLibrarianOrAdmin]
+
+    @action(detail=False, methods=['post'])
+    def upload(self, request):
+        upload = request.FILES.get('file')
+        if not upload: return Response({'error': 'file required'}, status=400)
+        fmt = request.data.get('format') or detect_format(upload.name)
+        if fmt not in dict(ImportJob.FORMAT_CHOICES): return Response({'error': f'Unsupported format {fmt}'}, status=400)
+
+        os.makedirs(settings.IMPORT_ROOT, exist_ok=True)
+        path = os.path.join(settings.IMPORT_ROOT, f"{uuid.uuid4().hex}-{os.path.basename(upload.name)}")
+        with open(path, 'wb') as fh:
+            for part in upload.chunks(): fh.write(part)
+        job = ImportJob.objects.create(
+            file_name=upload.name, file_path=path, format=fmt, created_by=request.user.username
+        )
+        self.start(job)
+        return Response(ImportJobSerializer(job).data, status=202)
+
+    @action(detail=True, methods=['post'])
+    def resume(self, request, pk=None):
+        """
+        Restarts a failed job, or a pending / running one whose worker died:
+        one that has not checkpointed for IMPORT_STALE_SECONDS. Claimed with a
+        conditional UPDATE so two resumes never start two workers.
+        """
+        job = self.get_object()
+        stale = timezone.now() - timedelta(seconds=settings.IMPORT_STALE_SECONDS)
+        claimed = ImportJob.objects.filter(
+            Q(status='FAILED') | Q(status__in=('PENDING', 'RUNNING'), updated_at__lt=stale), pk=job.pk,
+        ).update(status='RUNNING', updated_at=timezone.now())
+        if not claimed: return Response({'error': f'Job is {job.status}'}, status=409)
+        job.refresh_from_db()
+        self.start(job)
+        return Response(ImportJobSerializer(job).data, status=202)
+
+    @staticmethod
+    def start(job):
+        thread = threading.Thread(target=run_import_job, args=(job.pk,), daemon=True)
+        transaction.on_commit(thread.start)
+
+class InventorySessionViewSet(viewsets.ModelViewSet):
+    """
+    Stocktakes: open a session, upload scanner batches to `scan`, then
+    `close` for the missing / misplaced report.
+    """
+    queryset = InventorySession.objects.order_by('-started_at')
+    serializer_class = InventorySessionSerializer
+    permission_classes = [IsLibrarianOrAdmin]
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+
+    def perform_create(self, serializer):
+        serializer.save(started_by=self.request.user.username)
+
+    @action(detail=True, methods=['post'])
+    def scan(self, request, pk=None):
+        barcodes = request.data.get('barcodes', [])
+        if not isinstance(barcodes, list): return Response({'error': 'barcodes list required'}, status=400)
+        try:
+            stats = InventoryService.scan_batch(self.get_object(), request.data.get('shelf_location'), barcodes)
+        except InventoryError as e:
+            return Response({'error': str(e)}, status=409)
+        return Response(stats)
+
+    @action(detail=True, methods=['post'])
+    def close(self, request, pk=None):
+        lost_after_days = request.data.get('lost_after_days')
+        try:
+            session, report = InventoryService.close(
+                self.get_object(), int(lost_after_days) if lost_after_days not in (None, '') else None
+            )
+        except ValueError:
+            return Response({'error': 'lost_after_days must be an integer'}, status=400)
+        except InventoryError as e:
+            return Response({'error': str(e)}, status=409)
+        return Response({'session': InventorySessionSerializer(session).data, **report})
+
+class PatronViewSet(ChangeLogMixin, LeanReadMixin, viewsets.ModelViewSet):
+    queryset = Patron.objects.order_by('id')
     serializer_class = PatronSerializer
+    list_serializer_class = PatronListSerializer
     permission_classes = [IsLibrarianOrAdmin]
     filter_backends = [filters.SearchFilter]
     search_fields = ['full_name', 'student_id']
+    keyset_fields = ['id']
+
+    @action(detail=False, methods=['get', 'post'])
+    def cards(self, request):
+        """ID cards for a class set (?class_name=) or explicit ids, streamed as one ZPL job."""
+        return zpl_job(request, card_queryset, card_job, 'id-cards.zpl')
+
+    def perform_destroy(self, instance):
+        held = list(instance.holds.values_list('book__record_id', flat=True))
+        super().perform_destroy(instance)
+        Title.recount(held) # The patron's holds went with them
+
+    @action(detail=True, methods=['get'])
+    def account(self, request, pk=None):
+        """The patron with open loans, holds, overdue flags and balance in one response."""
+        accounts = AccountService.accounts(Patron.objects.filter(pk=pk))
+        if not accounts: return Response({'error': 'Patron not found'}, status=404)
+        return Response(PatronAccountSerializer(accounts[0], context={'request': request}).data)
 
 class CirculationViewSet(viewsets.ViewSet):
     @action(detail=False, methods=['post'], permission_classes=[IsLibrarianOrAdmin])
@@ -108,69 +410,274 @@ class CirculationViewSet(viewsets.ViewSet):
         except Patron.DoesNotExist:
             return Response({'success': False, 'message': 'Patron not found'}, status=404)
         if patron.is_blocked: return Response({'success': False, 'message': 'Patron is blocked'}, status=403)
-        
-        success_count = 0
-        errors = []
-        for barcode in book_barcodes:
-            try:
-                book = Book.objects.get(barcode_id=barcode)
-                rule = CirculationRule.objects.filter(patron_group=patron.patron_group, material_type=book.material_type).first()
-                loan_days = rule.loan_days if rule else 14
-                due_date = timezone.now() + timedelta(days=loan_days)
-                
-                if book.status != 'AVAILABLE':
-                    active_hold = Hold.objects.filter(book=book, is_active=True, patron=patron).first()
-                    if book.status == 'HELD' and active_hold:
-                        active_hold.delete()
-                    else:
-                        errors.append(f"{book.title}: Status {book.status}")
-                        continue
-                
-                Loan.objects.create(book=book, patron=patron, due_date=due_date)
-                book.status = 'LOANED'
-                book.loan_count += 1
-                book.save()
-                success_count += 1
-            except Book.DoesNotExist:
-                errors.append(f"Barcode {barcode}: Not found")
-        
+
+        success_count, errors = CirculationService.checkout_batch(patron, book_barcodes)
         return Response({'success': True, 'processed': success_count, 'errors': errors})
 
     @action(detail=False, methods=['post'], permission_classes=[IsLibrarianOrAdmin])
     def return_book(self, request):
         barcode = request.data.get('barcode')
-        book = Book.objects.filter(barcode_id=barcode).first()
+        results, errors = CirculationService.return_batch([barcode], librarian_id=request.user.username)
+        if barcode not in results:
+            if errors and not errors[0].endswith('Not found'):
+                return Response({'success': False, 'message': errors[0]}, status=409)
+            return Response({'success': False, 'message': 'Book not found'}, status=404)
+        result = results[barcode]
+        return Response({
+            'success': True, 'fine_amount': float(result['fine']), 'book': BookSerializer(result['book']).data,
+            'held_for': result['hold'].patron_id if result['hold'] else None,
+        })
+
+    @action(detail=False, methods=['post'], permission_classes=[IsLibrarianOrAdmin])
+    def return_books(self, request):
+        """Batch check-in for emptying the book-drop bin."""
+        barcodes = request.data.get('barcodes', [])
+        results, errors = CirculationService.return_batch(barcodes, librarian_id=request.user.username)
+        return Response({
+            'success': True,
+            'processed': len(results),
+            'total_fines': float(sum(r['fine'] for r in results.values())),
+            'results': [
+                {
+                    'barcode': barcode, 'title': r['book'].title, 'status': r['book'].status,
+                    'fine_amount': float(r['fine']), 'held_for': r['hold'].patron_id if r['hold'] else None,
+                }
+                for barcode, r in results.items()
+            ],
+            'errors': errors,
+        })
+
+class HoldViewSet(LeanReadMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Hold queues. Filter with ?book=<id> or ?patron=<id>; results come back
+    in queue order (served by the (book, created_at) index).
+    """
+    queryset = Hold.objects.order_by('book_id', 'created_at', 'id')
+    serializer_class = HoldSerializer
+    permission_classes = [IsLibrarianOrAdmin]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        for param in ('book', 'patron'):
+            value = self.request.query_params.get(param)
+            if value: queryset = queryset.filter(**{f'{param}_id': value})
+        return queryset
+
+    def create(self, request):
+        patron = Patron.objects.filter(student_id=request.data.get('patron_id')).first()
+        if not patron: return Response({'success': False, 'message': 'Patron not found'}, status=404)
+        if patron.is_blocked: return Response({'success': False, 'message': 'Patron is blocked'}, status=403)
+        book = Book.objects.filter(barcode_id=request.data.get('barcode')).only('id').first()
+        if not book: return Response({'success': False, 'message': 'Book not found'}, status=404)
+        try:
+            hold = HoldService.place(patron, book)
+        except HoldError as e:
+            return Response({'success': False, 'message': str(e)}, status=409)
+        return Response(HoldSerializer(hold).data, status=201)
+
+    def destroy(self, request, pk=None):
+        try:
+            HoldService.cancel(self.get_object())
+        except HoldError as e:
+            return Response({'success': False, 'message': str(e)}, status=409)
+        return Response(status=204)
+
+    @action(detail=False, methods=['post'])
+    def promote(self, request):
+        book = Book.objects.filter(barcode_id=request.data.get('barcode')).only('id').first()
         if not book: return Response({'success': False, 'message': 'Book not found'}, status=404)
-        
-        loan = Loan.objects.filter(book=book, returned_at__isnull=True).first()
-        fine = Decimal('0.00')
-        if loan:
-            loan.returned_at = timezone.now()
-            loan.save()
-            if loan.due_date < timezone.now():
-                delta = timezone.now() - loan.due_date
-                if delta.days > 0:
-                    rule = CirculationRule.objects.filter(patron_group=loan.patron.patron_group, material_type=book.material_type).first()
-                    fine_rate = rule.fine_per_day if rule else Decimal('0.50')
-                    fine = Decimal(delta.days) * fine_rate
-                    loan.patron.fines += fine
-                    loan.patron.save()
-        
-        book.status = 'AVAILABLE'
-        book.save()
-        return Response({'success': True, 'fine_amount': float(fine), 'book': BookSerializer(book).data})
-
-class CirculationRuleViewSet(viewsets.ModelViewSet):
+        try:
+            hold = HoldService.promote(book)
+        except HoldError as e:
+            return Response({'success': False, 'message': str(e)}, status=409)
+        return Response({'success': True, 'hold': HoldSerializer(hold).data if hold else None})
+
+    @action(detail=False, methods=['post'])
+    def sweep(self, request):
+        return Response({'success': True, **HoldService.sweep()})
+
+class TransactionViewSet(LeanReadMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    The money ledger, newest first. With ?patron=<id> the history walks the
+    (patron, timestamp, id) index and each row carries the running balance
+    after it. Supports keyset paging (?cursor=) on timestamp.
+    """
+    queryset = Transaction.objects.order_by('-timestamp', '-id')
+    serializer_class = TransactionSerializer
+    list_serializer_class = TransactionListSerializer
+    permission_classes = [IsLibrarianOrAdmin]
+    keyset_fields = ['timestamp']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        patron = self.request.query_params.get('patron')
+        if patron: queryset = queryset.filter(patron_id=patron)
+        return queryset
+
+    def list(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        rows = page if page is not None else list(queryset)
+        data = self.get_serializer(rows, many=True).data
+        patron = request.query_params.get('patron')
+        if patron:
+            for item, balance in zip(data, LedgerService.running_balances(patron, rows)):
+                item['balance'] = str(balance)
+        return self.get_paginated_response(data) if page is not None else Response(data)
+
+    def post_credit(self, request, type, method):
+        patron = Patron.objects.filter(student_id=request.data.get('patron_id')).only('id').first()
+        if not patron: return Response({'success': False, 'message': 'Patron not found'}, status=404)
+        try:
+            entry = LedgerService.post_credit(
+                patron, request.data.get('amount', 0), type, method, request.user.username, request.data.get('note'),
+            )
+        except LedgerError as e:
+            return Response({'success': False, 'message': str(e)}, status=400)
+        patron.refresh_from_db(fields=['fines', 'total_paid'])
+        return Response({
+            'success': True, 'transaction': TransactionSerializer(entry).data,
+            'fines': patron.fines, 'total_paid': patron.total_paid,
+        }, status=201)
+
+    @action(detail=False, methods=['post'])
+    def pay(self, request):
+        type = request.data.get('type', 'FINE_PAYMENT')
+        if type not in Transaction.PAYMENT_TYPES: return Response({'success': False, 'message': f'Invalid payment type {type}'}, status=400)
+        return self.post_credit(request, type, 'CASH')
+
+    @action(detail=False, methods=['post'])
+    def waive(self, request):
+        return self.post_credit(request, 'WAIVE', 'SYSTEM')
+
+    @action(detail=False, methods=['get'])
+    def reconcile(self, request):
+        drift = list(LedgerService.drift())
+        return Response({'drifted': len(drift), 'patrons': drift})
+
+class AnalyticsViewSet(viewsets.ViewSet):
+    """
+    Dashboard figures served from the daily rollup tables. Every read is
+    bounded by the ?days= window (default 30, max 366), never by history.
+    """
+    permission_classes = [IsLibrarianOrAdmin]
+    max_age = 300 # Rollups refresh every few minutes (manage.py refresh_analytics)
+
+    def window(self, request):
+        try:
+            return max(1, min(int(request.query_params.get('days', 30)), 366))
+        except ValueError:
+            return 30
+
+    def respond(self, data):
+        response = Response(data)
+        patch_cache_control(response, private=True, max_age=self.max_age)
+        refreshed = AnalyticsService.last_refreshed()
+        if refreshed: response['Last-Modified'] = http_date(refreshed.timestamp())
+        return response
+
+    @action(detail=False, methods=['get'])
+    def dashboard(self, request):
+        days = self.window(request)
+        return self.respond({
+            'days': days,
+            'top_titles': AnalyticsService.top_titles(days),
+            'loans_by_class': AnalyticsService.loans_by_class(days),
+            'daily_loans': AnalyticsService.daily_loans(days),
+            'revenue_by_type': AnalyticsService.revenue_by_type(days),
+            'overdue': AnalyticsService.overdue(),
+        })
+
+    @action(detail=False, methods=['get'])
+    def top_titles(self, request):
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 100))
+        except ValueError:
+            limit = 10
+        return self.respond(AnalyticsService.top_titles(self.window(request), limit))
+
+    @action(detail=False, methods=['get'])
+    def loans_by_class(self, request):
+        return self.respond(AnalyticsService.loans_by_class(self.window(request)))
+
+    @action(detail=False, methods=['get'])
+    def revenue(self, request):
+        return self.respond(AnalyticsService.revenue_by_type(self.window(request)))
+
+    @action(detail=False, methods=['get'])
+    def overdue(self, request):
+        return self.respond(AnalyticsService.overdue())
+
+    @action(detail=False, methods=['post'])
+    def refresh(self, request):
+        return Response({'success': True, 'folded': AnalyticsService.refresh()})
+
+class CirculationRuleViewSet(ChangeLogMixin, LeanReadMixin, viewsets.ModelViewSet):
     queryset = CirculationRule.objects.all()
     serializer_class = CirculationRuleSerializer
+    permission_classes = [IsLibrarianOrAdmin] # Workers pick up edits from the table's stamp (CirculationRuleCache)
+
+class SyncViewSet(viewsets.ViewSet):
+    """
+    Offline desk clients: GET ?since=<next>&limit= for the compacted delta
+    since their last pull, POST `mutations` to replay queued checkouts and
+    returns. Each mutation carries a client-generated `client_id`.
+    """
     permission_classes = [IsLibrarianOrAdmin]
 
-class LibraryEventViewSet(viewsets.ModelViewSet):
+    def list(self, request):
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = int(request.query_params.get('limit', 500))
+        except ValueError:
+            return Response({'error': 'since and limit must be integers'}, status=400)
+        if since < 0: return Response({'error': 'since must not be negative'}, status=400)
+        return Response(SyncService.changes(since, limit, context={'request': request}))
+
+    @action(detail=False, methods=['post'])
+    def mutations(self, request):
+        mutations = request.data.get('mutations')
+        if not isinstance(mutations, list) or not all(isinstance(m, dict) for m in mutations):
+            return Response({'error': 'mutations list required'}, status=400)
+        results = SyncService.apply(mutations, request.user.username, request.data.get('device'))
+        return Response({'results': results})
+
+class PushMixin:
+    """Broadcasts `<push_event>.created/updated/deleted` on the kiosk push channel after commit."""
+    push_topic = None
+    push_event = None
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        publish_on_commit(self.push_topic, f'{self.push_event}.created', serializer.data)
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        publish_on_commit(self.push_topic, f'{self.push_event}.updated', serializer.data)
+
+    def perform_destroy(self, instance):
+        pk = instance.pk
+        super().perform_destroy(instance)
+        publish_on_commit(self.push_topic, f'{self.push_event}.deleted', {'id': pk})
+
+class LibraryEventViewSet(PushMixin, LeanReadMixin, viewsets.ModelViewSet):
     queryset = LibraryEvent.objects.all()
     serializer_class = LibraryEventSerializer
     permission_classes = [permissions.AllowAny] # Publicly viewable for Kiosk
+    throttle_classes = [KioskThrottle]
+    push_topic, push_event = 'events', 'event'
+    public_cache_group = 'events'
 
-class SystemAlertViewSet(viewsets.ModelViewSet):
+class SystemAlertViewSet(PushMixin, LeanReadMixin, viewsets.ModelViewSet):
     queryset = SystemAlert.objects.filter(is_resolved=False)
     serializer_class = SystemAlertSerializer
     permission_classes = [permissions.AllowAny] # Kiosks can POST alerts
+    throttle_classes = [KioskThrottle]
+    push_topic, push_event = 'alerts', 'alert'
+    public_cache_group = 'alerts'
+
+    def perform_update(self, serializer):
+        was_resolved = serializer.instance.is_resolved
+        super(PushMixin, self).perform_update(serializer)
+        resolved = serializer.instance.is_resolved and not was_resolved
+        publish_on_commit('alerts', 'alert.resolved' if resolved else 'alert.updated', serializer.data)
@@ -0,0 +1,106 @@
+import re
+import threading
+from bisect import bisect_right
+from heapq import heappop, heappush
+
+DDC_NUMBER = re.compile(r'\s*([+-]?(?:\d+\.?\d*|\.\d+))')
+
+
+def parse_ddc(value):
+    """Leading numeric part of a DDC code ('823.912 ROW' -> 823.912), like parseFloat."""
+    if value is None: return None
+    if isinstance(value, (int, float)): return float(value)
+    match = DDC_NUMBER.match(str(value))
+    return float(match.group(1)) if match else None
+
+
+def legacy_shelf_label(ddc):
+    """Server copy of the kiosk's getShelfFromDDC fallback (utils.ts)."""
+    if not ddc: return 'Unknown'
+    upper = ddc.strip().upper()
+    if upper.startswith(('FIC', 'JF')) or upper == 'F': return 'Shelf C'
+    if upper.startswith('B'): return 'Shelf D'
+    number = parse_ddc(ddc)
+    if number is None: return 'Shelf A'
+    if 0 <= number < 300: return 'Shelf A'
+    if 300 <= number < 600: return 'Shelf B'
+    if 600 <= number < 900: return 'Shelf C'
+    if number >= 900: return 'Shelf D'
+    return 'Unknown'
+
+
+class ShelfIndex:
+    """
+    `map_data` ({levels, shelves}) compiled for lookups. Shelf DDC ranges
+    [minDDC, maxDDC] are flattened into sorted breakpoints where each point
+    and each gap between points has a precomputed owner, so locating a DDC
+    number is one bisect. Overlaps resolve to the earliest shelf in the
+    map, as the kiosk's linear scan did.
+    """
+    def __init__(self, map_data):
+        map_data = map_data if isinstance(map_data, dict) else {}
+        self.shelves = [s for s in map_data.get('shelves') or [] if isinstance(s, dict)]
+        # Level backgrounds can be large data URLs; lookups only carry the placement fields
+        self.levels = {
+            l.get('id'): {k: l.get(k) for k in ('id', 'name', 'stationX', 'stationY')}
+            for l in map_data.get('levels') or [] if isinstance(l, dict)
+        }
+        self.by_id = {}
+        self.by_label = {}
+        for shelf in self.shelves:
+            self.by_id.setdefault(shelf.get('id'), shelf)
+            self.by_label.setdefault(shelf.get('label'), shelf)
+        self.compile_ranges()
+
+    def compile_ranges(self):
+        ranges = []
+        for order, shelf in enumerate(self.shelves):
+            low, high = parse_ddc(shelf.get('minDDC')), parse_ddc(shelf.get('maxDDC'))
+            if low is not None and high is not None and low <= high: ranges.append((low, high, order))
+        ranges.sort()
+        self.points = sorted({p for low, high, _ in ranges for p in (low, high)})
+        self.point_owner, self.gap_owner = [], []
+        active, pending = [], iter(ranges)
+        upcoming = next(pending, None)
+        for i, point in enumerate(self.points):
+            while upcoming and upcoming[0] == point:
+                heappush(active, (upcoming[2], upcoming[1]))
+                upcoming = next(pending, None)
+            while active and active[0][1] < point: heappop(active)
+            self.point_owner.append(active[0][0] if active else None)
+            while active and active[0][1] <= point: heappop(active)
+            self.gap_owner.append(active[0][0] if active else None)
+
+    def shelf_for_ddc(self, ddc):
+        number = parse_ddc(ddc)
+        if number is None: return None
+        i = bisect_right(self.points, number) - 1
+        if i < 0: return None
+        owner = self.point_owner[i] if self.points[i] == number else self.gap_owner[i]
+        return self.shelves[owner] if owner is not None else None
+
+    def locate(self, ddc_code=None, shelf_location=None):
+        """Same precedence as the kiosk: shelf id, then the legacy label, then the DDC range."""
+        shelf = (
+            self.by_id.get(shelf_location) if shelf_location else None
+        ) or self.by_label.get(legacy_shelf_label(ddc_code)) or self.shelf_for_ddc(ddc_code)
+        if not shelf: return None
+        return {'shelf': shelf, 'level': self.levels.get(shelf.get('levelId'))}
+
+    # ------------------------------------------------------------------
+    # Process-local compiled copy, rebuilt when the config stamp changes
+    # ------------------------------------------------------------------
+
+    _current = (None, None) # (config version, ShelfIndex)
+    _lock = threading.Lock()
+
+    @classmethod
+    def current(cls):
+        from .services import SystemConfigCache # services imports serializers, which use this module
+        version, _, data = SystemConfigCache.snapshot()
+        compiled_version, index = cls._current
+        if compiled_version == version: return index
+        with cls._lock:
+            if cls._current[0] != version:
+                cls._current = (version, cls(data.get('map_data')))
+            return cls._current[1]
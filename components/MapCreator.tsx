@@ -231,7 +231,7 @@ const MapCreator: React.FC<MapCreatorProps> = ({ onRefreshConfig }) => {
                          </button>
                     </div>
                     
-                    <input type="file" ref={logoInputRef} onChange={handleLogoUpload} accept="image/*" className="hidden" />
+                    <input type="file" ref={logoInputRef} onChange={handleLogoUpload} accept="image/png,image/jpeg,image/webp,image/gif" className="hidden" />
                     
                     <div className="aspect-video bg-slate-50 rounded-2xl border-2 border-dashed border-slate-200 flex flex-col items-center justify-center overflow-hidden relative group">
                         {config.logo ? (
@@ -197,7 +197,7 @@ const PatronFormModal: React.FC<PatronFormModalProps> = ({ isOpen, onClose, onSa
                                 >
                                     <Upload className="h-4 w-4" /> Upload File
                                 </button>
-                                <input type="file" ref={fileInputRef} className="hidden" accept="image/*" onChange={handleFileUpload} />
+                                <input type="file" ref={fileInputRef} className="hidden" accept="image/png,image/jpeg,image/webp,image/gif" onChange={handleFileUpload} />
                                 {formData.photo_url && (
                                     <button 
                                         type="button"